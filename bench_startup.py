@@ -0,0 +1,166 @@
+"""pybuild启动耗时基准测试
+
+测量 `pybuild -h`、`pybuild init` 和空构建(没有任何改动的 `pybuild build`)的端到端耗时。
+
+用法:
+    python3 bench_startup.py                          # 测试 python3 main.py
+    python3 bench_startup.py --pybuild dist/pybuild.pyz
+    python3 bench_startup.py --pybuild dist/pybuild/pybuild -n 50
+    python3 bench_startup.py --json result.json       # 保存结果
+    python3 bench_startup.py --compare result.json    # 与保存的结果比较,中位数变慢超过阈值时返回1
+
+每次运行使用新建的临时项目和临时缓存目录,并关闭构建历史记录,结果不受本机已有缓存影响。
+"""
+
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def pybuild_command(pybuild):
+    """返回运行pybuild的命令列表,.py/.pyz文件使用当前Python解释器运行"""
+    path = os.path.abspath(pybuild)
+    if path.endswith((".py", ".pyz")):
+        return [sys.executable, path]
+    return [path]
+
+
+def run(command, cwd, env):
+    """运行一次命令,返回耗时(秒);命令失败时抛出异常"""
+    start = time.perf_counter()
+    result = subprocess.run(
+        command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"命令执行失败: {' '.join(command)}\n{result.stderr.decode(errors='replace')}"
+        )
+    return elapsed
+
+
+def measure(command, cwd, env, runs, warmup):
+    """预热后运行runs次,返回各次耗时(毫秒)"""
+    for _ in range(warmup):
+        run(command, cwd, env)
+    return [run(command, cwd, env) * 1000 for _ in range(runs)]
+
+
+def summarize(samples):
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "max": max(samples),
+        "runs": len(samples),
+    }
+
+
+def main(args):
+    pybuild = os.path.join(ROOT, "main.py")
+    runs = 20
+    warmup = 3
+    json_path = None
+    compare_path = None
+    threshold = 0.2
+    skip_build = False
+
+    i = 1
+    while i < len(args):
+        arg = args[i]
+        if arg == "--pybuild" and i + 1 < len(args):
+            i += 1
+            pybuild = args[i]
+        elif arg == "-n" and i + 1 < len(args):
+            i += 1
+            runs = int(args[i])
+        elif arg == "--warmup" and i + 1 < len(args):
+            i += 1
+            warmup = int(args[i])
+        elif arg == "--json" and i + 1 < len(args):
+            i += 1
+            json_path = args[i]
+        elif arg == "--compare" and i + 1 < len(args):
+            i += 1
+            compare_path = args[i]
+        elif arg == "--threshold" and i + 1 < len(args):
+            i += 1
+            threshold = float(args[i])
+        elif arg == "--no-build":
+            skip_build = True
+        else:
+            print(__doc__)
+            return 1
+        i += 1
+
+    command = pybuild_command(pybuild)
+    work_dir = tempfile.mkdtemp(prefix="pybuild-bench-")
+    env = dict(os.environ)
+    env["PYBUILD_CACHE_DIR"] = os.path.join(work_dir, "cache")
+    env["PYBUILD_NO_HISTORY"] = "1"
+    try:
+        run(command + ["new", "bench"], work_dir, env)
+        project_dir = os.path.join(work_dir, "bench")
+
+        cases = [("-h", ["-h"]), ("init", ["init"])]
+        if skip_build or shutil.which("cmake") is None:
+            print("跳过空构建测试(未找到cmake或指定了--no-build)")
+        else:
+            # 先完整构建一次,之后的build都是空构建
+            run(command + ["build"], project_dir, env)
+            cases.append(("build (no-op)", ["build"]))
+
+        print(f"pybuild: {' '.join(command)}")
+        print(f"每项运行 {runs} 次(预热 {warmup} 次)\n")
+        print(f"{'命令':<16}{'最小':>10}{'中位数':>10}{'平均':>10}{'最大':>10}  (毫秒)")
+        results = {}
+        for name, case_args in cases:
+            results[name] = summarize(
+                measure(command + case_args, project_dir, env, runs, warmup)
+            )
+            r = results[name]
+            print(
+                f"{name:<16}{r['min']:>10.1f}{r['median']:>10.1f}{r['mean']:>10.1f}{r['max']:>10.1f}"
+            )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"pybuild": " ".join(command), "python": sys.version.split()[0], "results": results},
+                f,
+                indent=2,
+                ensure_ascii=False,
+            )
+        print(f"\n结果已写入: {json_path}")
+
+    if compare_path:
+        with open(compare_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressed = False
+        print(f"\n与 {compare_path} 比较(中位数,阈值 +{threshold:.0%}):")
+        for name, r in results.items():
+            if name not in baseline:
+                continue
+            old = baseline[name]["median"]
+            change = (r["median"] - old) / old if old else 0.0
+            mark = ""
+            if change > threshold:
+                regressed = True
+                mark = "  <-- 变慢"
+            print(f"  {name:<16}{old:>8.1f} -> {r['median']:>8.1f} ms ({change:+.0%}){mark}")
+        if regressed:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
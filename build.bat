@@ -1,6 +1,15 @@
 @echo off
 setlocal enabledelayedexpansion
 
+REM ʽ: onefile(ļ,ÿжҪѹ)onedir(Ŀ¼ʽ,)zipapp(PyInstaller)
+set MODE=%~1
+if "!MODE!"=="" set MODE=onefile
+if not "!MODE!"=="onefile" if not "!MODE!"=="onedir" if not "!MODE!"=="zipapp" (
+    echo δ֪Ĵʽ!MODE!ѡonefile/onedir/zipapp
+    exit /b 1
+)
+echo ʽ!MODE!
+
 echo ڼPython...
 REM ޸汾Python 3.12+ʽ
 for /f "tokens=1,2 delims=. " %%a in ('python -c "import sys; print(sys.version_info.major, sys.version_info.minor)" 2^>^&1') do (
@@ -23,6 +32,21 @@ if !major! equ 3 if !minor! lss 6 (
 )
 echo ? ǰPython汾!major!.!minor!(Ҫ)
 
+REM zipapp: main.pyΪ__main__.pyzip,pythonֱ
+if "!MODE!"=="zipapp" (
+    if exist "dist\zipapp\" rmdir /s /q "dist\zipapp"
+    mkdir "dist\zipapp"
+    copy /y main.py "dist\zipapp\__main__.py" >nul
+    python -m zipapp "dist\zipapp" -o "dist\pybuild.pyz" -p python
+    if !errorlevel! neq 0 (
+        echo zipappʧ
+        exit /b 1
+    )
+    rmdir /s /q "dist\zipapp"
+    echo ? ɹִļ·dist\pybuild.pyz
+    exit /b 0
+)
+
 REM 鲢װPyInstaller
 pip show pyinstaller >nul 2>&1
 if %errorlevel% neq 0 (
@@ -60,7 +84,7 @@ if exist "resources\" (
 
 REM ؼŻ
 echo ô...
-set COMMAND=pyinstaller --onefile ^
+set COMMAND=pyinstaller --!MODE! ^
     --add-binary "!PYTHON_LIB!;." ^
     !RESOURCES_ARG! ^
     --windowed ^
@@ -79,9 +103,11 @@ if %errorlevel% neq 0 (
     exit /b 1
 )
 
-REM ֤
-if exist "dist\pybuild.exe" (
-    echo ? ɹִļ·dist\pybuild.exe
+REM ֤(onedirģʽ¿ִļλdist\pybuild\Ŀ¼)
+set EXE_PATH=dist\pybuild.exe
+if "!MODE!"=="onedir" set EXE_PATH=dist\pybuild\pybuild.exe
+if exist "!EXE_PATH!" (
+    echo ? ɹִļ·!EXE_PATH!
 ) else (
     echo ? ʧܣδҵִļ
     exit /b 1
@@ -7,6 +7,15 @@ echo "检测到操作系统：$OS $ARCH"
 function die() { echo "$@" >&2; exit 1; }
 function is_installed() { command -v "$1" >/dev/null 2>&1; }
 
+# 打包方式: onefile(单个文件,每次运行都要解压到临时目录)
+#           onedir(目录形式,启动最快)、zipapp(单个.pyz文件,不依赖PyInstaller)
+MODE="${1:-onefile}"
+case $MODE in
+    onefile|onedir|zipapp) ;;
+    *) die "未知的打包方式:$MODE(可选:onefile/onedir/zipapp)" ;;
+esac
+echo "打包方式:$MODE"
+
 echo "检测Python版本..."
 if ! is_installed python3; then
     die "未找到Python3,请先安装Python 3.6及以上版本"
@@ -22,6 +31,18 @@ fi
 echo "当前Python版本:$PY_VERSION(符合要求)"
 
 
+if [[ $MODE == "zipapp" ]]; then
+    # main.py作为__main__.py打入zip,直接由系统中的python3运行,没有解压开销
+    STAGING="dist/zipapp"
+    rm -rf "$STAGING" && mkdir -p "$STAGING" || die "创建目录失败:$STAGING"
+    cp main.py "$STAGING/__main__.py" || die "复制main.py失败"
+    python3 -m zipapp "$STAGING" -o dist/pybuild.pyz -p "/usr/bin/env python3" || die "zipapp打包失败"
+    rm -rf "$STAGING"
+    echo "✅ 打包成功！可执行文件路径：dist/pybuild.pyz"
+    exit 0
+fi
+
+
 echo "检查并安装PyInstaller..."
 if ! is_installed pyinstaller; then
     echo "PyInstaller未安装,正在通过pip安装..."
@@ -104,20 +125,20 @@ fi
 
 case $OS in
     Linux)
-        COMMAND="pyinstaller --onefile \
+        COMMAND="pyinstaller --$MODE \
             --add-binary \"$PYTHON_LIB:$SEP.\" \
             $RESOURCES_ARG \
             -n pybuild main.py"
         ;;
     Darwin)
-        COMMAND="pyinstaller --onefile \
+        COMMAND="pyinstaller --$MODE \
             --add-binary \"$PYTHON_LIB:$SEP.\" \
             $RESOURCES_ARG \
             --noconsole \
             -n pybuild main.py"
         ;;
     WindowsNT)
-        COMMAND="pyinstaller --onefile \
+        COMMAND="pyinstaller --$MODE \
             --add-binary \"$PYTHON_LIB:$SEP.\" \
             $RESOURCES_ARG \
             --windowed \
@@ -140,6 +161,10 @@ case $OS in
         EXE_PATH="dist/pybuild.exe"
         ;;
 esac
+# onedir模式下可执行文件位于 dist/pybuild/ 目录中
+if [[ $MODE == "onedir" ]]; then
+    EXE_PATH="dist/pybuild/$(basename "$EXE_PATH")"
+fi
 
 if [[ -f "$EXE_PATH" ]]; then
     echo "✅ 打包成功！可执行文件路径：$EXE_PATH"
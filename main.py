@@ -1,16 +1,17 @@
 import os
 import sys
-import json
-import shutil
-import platform
-import subprocess
 import stat
-import re
+import threading
+import io
+import time
+from contextlib import contextmanager
+
+# json、subprocess等模块在用到它们的函数中导入,-h、init等简单命令不必承担导入耗时
 
 # 平台定义
-PLATFORM_WINDOWS = platform.system() == "Windows"
-PLATFORM_MACOS = platform.system() == "Darwin"
-PLATFORM_LINUX = platform.system() == "Linux"
+PLATFORM_WINDOWS = sys.platform == "win32"
+PLATFORM_MACOS = sys.platform == "darwin"
+PLATFORM_LINUX = sys.platform.startswith("linux")
 CMAKE_SOURCE_DIR = "{CMAKE_SOURCE_DIR}"
 # 路径和文件扩展名定义
 if PLATFORM_WINDOWS:
@@ -59,21 +60,83 @@ def print_usage(program_name):
     print("    -D, --dep <依赖>         添加项目依赖")
     print("    -h, --help               显示此帮助信息")
     print("    -p, --precompile-headers 创建预编译头文件")
+    print("    --unity[=N]              开启Unity构建,每批合并N个源文件 (默认8)")
     print("  build                      构建项目")
     print("    -d, --debug              使用Debug模式构建")
-    print("    -r, --release            使用Release模式构建")
+    print("    -r, --release            使用Release模式构建 (与-d同时使用时并发构建两种配置)")
+    print("    --configs <配置列表>     并发构建多个配置,如 Debug,Release,RelWithDebInfo")
     print("    -p, --prefix             指定安装目录")
     print("    -c, --configure-only     选择是否构建")
     print("    -b, --build-dir          设置构建目录")
-    print("    -t, --test               设置构建测试代码")
+    print("    -t, --test               构建测试代码,构建成功后运行测试")
     print("    -C, --clean-cache        构建前清理cmake缓存")
-    print("  init                       根据CMake.json创建新项目")
+    print("    --compiler-cache <工具>  指定编译器缓存: auto/ccache/sccache (默认auto)")
+    print("    --no-compiler-cache      不使用ccache/sccache")
+    print("    -G, --generator <名称>   生成器: auto/ninja/make或CMake生成器名 (默认auto,优先Ninja)")
+    print("    --compiler <名称>        编译器: auto/gcc/clang (默认auto)")
+    print("    --reconfigure            强制重新运行CMake配置")
+    print("    --explain-configure      显示触发重新配置的输入")
+    print("    --unity[=N], --no-unity  本次构建开启/关闭Unity构建,覆盖CMake.json")
+    print("    --profile <名称>         使用CMake.json中profiles定义的构建配置方案,每个方案有独立的构建目录")
+    print("    --lto                    检查编译器支持后开启链接时优化(IPO)")
+    print("    --pgo -- <训练命令>      PGO三阶段构建: 插桩构建、运行训练命令、使用profile构建(GCC/Clang)")
+    print("    --pgo-retrain            与--pgo相同,但重新收集profile")
+    print("    --trace <文件>           记录各阶段耗时,输出Chrome trace JSON(build/get/install均可用)")
+    print("    --all                    按依赖顺序构建工作区中的所有项目(pybuild-workspace.json或*/CMake.json)")
+    print("      -j, --jobs <N>         同时构建N个项目(默认CPU核心数)")
+    print("      --force                不跳过输入未改变的项目")
+    print("      --install              每个项目构建成功后增量安装,供依赖它的项目使用")
+    print("  init                       根据CMake.json创建新项目,并生成src/下的源文件列表")
+    print("  watch [build参数]          监视文件改变并自动增量构建,CMake.json/CMakeLists.txt改变时重新配置")
+    print("    --test                   构建成功后运行测试")
+    print("    --debounce <毫秒>        等待连续改变结束的时间(默认300)")
+    print("    --poll                   使用轮询代替inotify")
+    print("  test                       并行运行测试(CTest,没有时运行bin/下名称包含test的程序)")
+    print("    -b, --build-dir <目录>   构建目录(默认build)")
+    print("    -j, --jobs <N>           同时运行N个测试(默认CPU核心数)")
+    print("    --shard <k>/<n>          只运行n个分片中的第k个")
+    print("    --junit <文件>           输出JUnit XML报告")
+    print("    --skip-unchanged         跳过输入未改变且上次通过的测试")
+    print("  clean                      清理构建目录(默认全部删除,旧目录改名后在后台删除)")
+    print("    --cache                  只删除CMake缓存,保留目标文件")
+    print("    --objects                只删除目标文件和预编译头,保留配置")
+    print("    --all                    删除整个构建目录(默认)")
+    print("    -b, --build-dir <目录>   构建目录(默认build)")
+    print("    --dry-run                只显示各级别能释放的空间")
+    print("    --wait                   在前台删除,删除完成后返回")
+    print("  toolchain [--refresh]      显示探测到的生成器和编译器")
     print("  install <path>             安装生成的文件,如果不设置path则选择默认路径")
-    print("  uninstall                  卸载安装的库")
-    print("  get <下载链接>             使用git安装第三方库")
+    print("    --incremental            增量安装: 只替换内容改变的文件,记录文件哈希")
+    print("    -b, --build-dir <目录>   从该构建目录安装(默认build)")
+    print("    --profile <名称>         从配置方案的构建目录安装")
+    print("  uninstall                  按build/install_manifest.txt卸载安装的库,并删除变空的目录")
+    print("    -b, --build-dir <目录>   构建目录(默认build)")
+    print("    --dry-run                只显示将要删除的文件和目录")
+    print("  get <下载链接>             使用git安装第三方库,按CMake.json中的依赖顺序构建并安装")
     print("    -d, --debug              使用Debug模式构建 (默认)")
     print("    -r, --release            使用Release模式构建")
     print("    -p, --prefix             指定安装目录")
+    print("    -j, --jobs <N>           同时下载构建N个库,共享CPU编译任务")
+    print("    --no-mirror              不使用本地git镜像缓存,直接完整克隆")
+    print("    --no-artifact-cache      不使用预编译产物缓存")
+    print("  pch --suggest              统计src/和include/中最常包含的系统/第三方头文件并生成pch.h")
+    print("    -n, --limit <N>          最多包含N个头文件(默认20)")
+    print("    --min-count <N>          只选择至少被N个文件包含的头文件(默认2)")
+    print("    --dry-run                只显示统计结果,不写入pch.h")
+    print("  analyze includes           根据compile_commands.json分析头文件包含关系,找出修改后重新编译最多的头文件")
+    print("    -b, --build-dir <目录>   构建目录(默认build)")
+    print("    -n, --limit <N>          显示前N个头文件(默认20)")
+    print("    --metric lines|size      按行数或字节数加权(默认lines)")
+    print("    --json <文件>            同时把结果写入JSON文件")
+    print("    --all                    包括项目外的第三方头文件")
+    print("  stats                      显示当前项目的构建耗时趋势、百分位和耗时突增")
+    print("    --command <命令>         只统计build/get/install中的一种")
+    print("    -n, --limit <N>          显示最近N次运行(默认10)")
+    print("    --csv <文件>             导出全部记录为CSV")
+    print("  cache stats                显示预编译产物缓存统计")
+    print("  cache prune                按LRU清理产物缓存")
+    print("    --max-size <大小>        清理到指定大小以内(如 2G)")
+    print("    --all                    清空缓存")
     print("示例:")
     print(f"  {program_name} new myapp -e -D fmt -D sdl2")
     print(f"  {program_name} new mylib -s -D boost")
@@ -88,23 +151,87 @@ def print_usage(program_name):
     print("    -D, --dep <dependency>       Add project dependency")
     print("    -h, --help                   Display this help message")
     print("    -p, --precompile-headers     Create precompiled headers")
+    print("    --unity[=N]                  Enable unity builds, merging N sources per batch (default 8)")
     print("  build                          Build project")
     print("    -d, --debug                  Build using Debug mode")
-    print("    -r, --release                Build using Release mode")
+    print("    -r, --release                Build using Release mode (with -d, build both concurrently)")
+    print("    --configs <list>             Build several configurations concurrently, e.g. Debug,Release")
     print("    -p, --prefix                 Specify installation directory")
     print("    -c, --configure-only         Configure without building")
     print("    -b, --build-dir              Set build directory")
-    print("    -t, --test                   Set up the build and test code")
+    print("    -t, --test                   Build the tests and run them after a successful build")
     print("    -C, --clean-cache            Clean cmake cache before building")
-    print("  init                           Create new project based on CMake.json")
+    print("    --compiler-cache <tool>      Compiler cache: auto/ccache/sccache (default auto)")
+    print("    --no-compiler-cache          Do not use ccache/sccache")
+    print("    -G, --generator <name>       Generator: auto/ninja/make or a CMake generator name (default auto, prefers Ninja)")
+    print("    --compiler <name>            Compiler: auto/gcc/clang (default auto)")
+    print("    --reconfigure                Force CMake to reconfigure")
+    print("    --explain-configure          Show which input triggered a reconfigure")
+    print("    --unity[=N], --no-unity      Turn unity builds on/off for this build, overriding CMake.json")
+    print("    --profile <name>             Use a build profile from the profiles section of CMake.json (own build dir)")
+    print("    --lto                        Enable link-time optimization (IPO) if the compiler supports it")
+    print("    --pgo -- <training command>  Three-stage PGO build: instrument, train, rebuild with profiles (GCC/Clang)")
+    print("    --pgo-retrain                Like --pgo, but collect new profiles")
+    print("    --trace <file>               Write a Chrome trace JSON of all phases (also for get/install)")
+    print("    --all                        Build all workspace projects in dependency order (pybuild-workspace.json or */CMake.json)")
+    print("      -j, --jobs <N>             Build N projects at once (default CPU count)")
+    print("      --force                    Do not skip projects whose inputs are unchanged")
+    print("      --install                  Incrementally install each project after it builds, for its dependents")
+    print("  init                           Create new project based on CMake.json and list the sources under src/")
+    print("  watch [build options]          Rebuild on file changes; reconfigure when CMake.json/CMakeLists.txt change")
+    print("    --test                       Run the tests after a successful build")
+    print("    --debounce <ms>              Wait for a burst of changes to settle (default 300)")
+    print("    --poll                       Poll instead of using inotify")
+    print("  test                           Run tests in parallel (CTest, or bin/ programs named *test*)")
+    print("    -b, --build-dir <dir>        Build directory (default build)")
+    print("    -j, --jobs <N>               Run N tests at once (default CPU count)")
+    print("    --shard <k>/<n>              Only run shard k of n")
+    print("    --junit <file>               Write a JUnit XML report")
+    print("    --skip-unchanged             Skip tests that passed last time and whose inputs are unchanged")
+    print("  clean                          Clean the build directory (default: all, deleted in the background)")
+    print("    --cache                      Only delete the CMake cache, keep object files")
+    print("    --objects                    Only delete object files and precompiled headers, keep the configuration")
+    print("    --all                        Delete the whole build directory (default)")
+    print("    -b, --build-dir <dir>        Build directory (default build)")
+    print("    --dry-run                    Only show how much space each level would free")
+    print("    --wait                       Delete in the foreground and return when done")
+    print("  toolchain [--refresh]          Show detected generators and compilers")
     print(
         "  install <path>                 Install built files (uses default path if omitted)"
     )
-    print("  uninstall                      Uninstall installed library")
-    print("  get <urls>                     use git to install third party library")
+    print("    --incremental                Only replace files whose content changed; record file hashes")
+    print("    -b, --build-dir <dir>        Install from this build directory (default build)")
+    print("    --profile <name>             Install from the build directory of a build profile")
+    print("  uninstall                      Uninstall the files in build/install_manifest.txt and prune empty directories")
+    print("    -b, --build-dir <dir>        Build directory (default build)")
+    print("    --dry-run                    Only list the files and directories that would be removed")
+    print(
+        "  get <urls>                     use git to install third party library (built and installed in CMake.json dependency order)"
+    )
     print("    -d, --debug                  Build using Debug mode (dafault)")
     print("    -r, --release                Build using Release mode")
     print("    -p, --prefix                 Specify installation directory")
+    print("    -j, --jobs <N>               Clone and build N libraries concurrently")
+    print("    --no-mirror                  Clone directly instead of using the local git mirror cache")
+    print("    --no-artifact-cache          Always build instead of using prebuilt artifacts")
+    print("  pch --suggest                  Generate pch.h from the most included system/third-party headers in src/ and include/")
+    print("    -n, --limit <N>              Include at most N headers (default 20)")
+    print("    --min-count <N>              Only headers included by at least N files (default 2)")
+    print("    --dry-run                    Only show the counts, do not write pch.h")
+    print("  analyze includes               Rank headers by how many translation units recompile when they change")
+    print("    -b, --build-dir <dir>        Build directory (default build)")
+    print("    -n, --limit <N>              Show the top N headers (default 20)")
+    print("    --metric lines|size          Weight by line count or bytes (default lines)")
+    print("    --json <file>                Also write the result to a JSON file")
+    print("    --all                        Include third-party headers outside the project")
+    print("  stats                          Show build time trends, percentiles and jumps of this project")
+    print("    --command <name>             Only include build, get or install runs")
+    print("    -n, --limit <N>              Show the last N runs (default 10)")
+    print("    --csv <file>                 Export all records as CSV")
+    print("  cache stats                    Show prebuilt artifact cache statistics")
+    print("  cache prune                    Evict least recently used artifacts")
+    print("    --max-size <size>            Shrink the cache below size (e.g. 2G)")
+    print("    --all                        Remove all artifacts")
     print("Examples:")
     print(f"  {program_name} new myapp -e -D fmt -D sdl2")
     print(f"  {program_name} new mylib -s -D boost")
@@ -120,47 +247,446 @@ def print_usage(program_name):
         print("      sudo apt-get install build-essential cmake")
 
 
-def create_precompile_headers(add_precompile_headers) -> bool:
-    """创建预编译头文件"""
+def write_file_if_changed(path, content, changed_files=None) -> bool:
+    """仅当内容与磁盘上的文件不同时才写入,返回文件是否被改写
+
+    内容先写入同目录下的临时文件,再通过os.replace原子替换,
+    内容相同时不触碰文件,保持其修改时间,避免触发CMake重新配置。
+    changed_files: 若指定,被改写的文件路径会追加到该列表中
+    """
+    import shutil
+    import tempfile
+
+    try:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            if f.read() == content:
+                return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".pybuild-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            f.write(content)
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        else:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if changed_files is not None:
+        changed_files.append(path)
+    return True
+
+
+# 未扫描源文件时pch.h默认包含的头文件
+DEFAULT_PCH_HEADERS = [
+    "string",
+    "iostream",
+    "vector",
+    "map",
+    "array",
+    "algorithm",
+    "functional",
+    "future",
+    "mutex",
+    "thread",
+]
+
+
+def render_precompile_headers(headers, counts=None):
+    """生成pch.h的内容
+
+    counts: 头文件 -> 包含它的源文件数,用于在注释中说明选择依据
+    """
+    f = io.StringIO()
+    f.write("#ifndef PCH_H\n")
+    f.write("#define PCH_H\n\n")
+    if counts:
+        f.write("// 由 pybuild pch --suggest 根据src/和include/中的包含次数生成\n")
+    for header in headers:
+        if counts:
+            f.write(f"#include <{header}>  // {counts[header]} 个文件\n")
+        else:
+            f.write(f"#include <{header}>\n")
+    f.write("\n#endif\n")
+    return f.getvalue()
+
+
+def create_precompile_headers(add_precompile_headers, changed_files=None) -> bool:
+    """创建预编译头文件(内容未改变时不改写)
+
+    已存在的pch.h(如由 pch --suggest 生成)不会被默认内容覆盖
+    """
     if not add_precompile_headers:
         return True
 
-    # 保存当前工作目录
-    cwd = os.getcwd()
-
     try:
         # 确保include目录存在
         os.makedirs("include", exist_ok=True)
+        if os.path.exists("include/pch.h"):
+            return True
 
-        with open("include/pch.h", "w", encoding="utf-8") as f:
+        if write_file_if_changed(
+            "include/pch.h",
+            render_precompile_headers(DEFAULT_PCH_HEADERS),
+            changed_files,
+        ):
             print("创建预编译头文件pch.h")
-            f.write("#ifndef PCH_H\n")
-            f.write("#define PCH_H\n\n")
-            f.write("#include <string>\n")
-            f.write("#include <iostream>\n")
-            f.write("#include <vector>\n")
-            f.write("#include <map>\n")
-            f.write("#include <array>\n")
-            f.write("#include <algorithm>\n")
-            f.write("#include <functional>\n")
-            f.write("#include <future>\n")
-            f.write("#include <mutex>\n")
-            f.write("#include <thread>\n\n")
-            f.write("#endif\n")
-
         return True
     except Exception as e:
-        print(f"打开pch.h失败: {e}")
+        print(f"写入pch.h失败: {e}")
         return False
-    finally:
-        # 切换回原目录
-        os.chdir(cwd)
+
+
+# #include 指令(re按模式字符串缓存编译结果)
+INCLUDE_PATTERN = r'^\s*#\s*include\s*([<"])([^>"]+)[>"]'
+PROJECT_SOURCE_EXTENSIONS = (".c", ".cc", ".cpp", ".cxx", ".h", ".hh", ".hpp", ".hxx", ".inl")
+
+
+def count_external_includes(project_dir="."):
+    """统计src/和include/中每个系统/第三方头文件被多少个文件包含
+
+    <...> 形式的包含,以及在项目中找不到的 "..." 形式的包含都视为外部头文件
+    """
+    import re
+
+    counts = {}
+    search_dirs = [os.path.join(project_dir, d) for d in ["include", "src"]]
+    for top in search_dirs:
+        for root, dirs, names in os.walk(top):
+            for name in names:
+                if not name.endswith(PROJECT_SOURCE_EXTENSIONS) or name == "pch.h":
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    with open(path, "r", encoding="utf-8", errors="replace") as f:
+                        text = f.read()
+                except OSError:
+                    continue
+                headers = set()
+                for kind, header in re.findall(INCLUDE_PATTERN, text, re.MULTILINE):
+                    header = header.strip()
+                    if header == "pch.h":
+                        continue
+                    if kind == '"' and any(
+                        os.path.exists(os.path.join(d, header))
+                        for d in [root] + search_dirs
+                    ):
+                        continue
+                    headers.add(header)
+                for header in headers:
+                    counts[header] = counts.get(header, 0) + 1
+    return counts
+
+
+def pch_command(args):
+    """pybuild pch --suggest: 根据包含次数最多的外部头文件生成pch.h"""
+    suggest = False
+    limit = 20
+    min_count = 2
+    dry_run = False
+    i = 2
+    while i < len(args):
+        arg = args[i]
+        if arg == "--suggest":
+            suggest = True
+        elif arg in ("-n", "--limit", "--min-count") and i + 1 < len(args):
+            i += 1
+            try:
+                value = int(args[i])
+                if value < 1:
+                    raise ValueError
+            except ValueError:
+                what = "包含次数" if arg == "--min-count" else "头文件数量"
+                print(f"错误：无效的{what}: {args[i]}")
+                return 1
+            if arg == "--min-count":
+                min_count = value
+            else:
+                limit = value
+        elif arg == "--dry-run":
+            dry_run = True
+        else:
+            print(f"未知参数: {arg}")
+            suggest = False
+            break
+        i += 1
+
+    if not suggest:
+        print("用法: pybuild pch --suggest [-n <数量>] [--min-count <次数>] [--dry-run]")
+        return 1
+
+    counts = count_external_includes()
+    ranked = sorted(
+        (h for h, c in counts.items() if c >= min_count),
+        key=lambda h: (-counts[h], h),
+    )[:limit]
+    if not ranked:
+        print(f"没有被至少 {min_count} 个文件包含的系统/第三方头文件,未生成pch.h")
+        return 1
+
+    print(f"{'包含次数':>8}  头文件")
+    for header in ranked:
+        print(f"{counts[header]:>8}  {header}")
+    if dry_run:
+        return 0
+
+    os.makedirs("include", exist_ok=True)
+    if write_file_if_changed(
+        "include/pch.h", render_precompile_headers(ranked, counts)
+    ):
+        print("已更新 include/pch.h")
+    else:
+        print("include/pch.h 已是最新")
+    if not read_cmake_json().get("project", {}).get("precompile_headers"):
+        print('提示: 在CMake.json中设置 "precompile_headers": true 并运行 init 以启用预编译头')
+    return 0
+
+
+INCLUDES_CACHE_FILE = "pybuild-includes-cache.json"
+
+
+def compile_command_include_dirs(entry):
+    """从compile_commands.json的一项中提取 (引号包含目录, 包含目录) 列表"""
+    import shlex
+
+    if "arguments" in entry:
+        arguments = entry["arguments"]
+    else:
+        arguments = shlex.split(entry.get("command", ""), posix=not PLATFORM_WINDOWS)
+    directory = entry.get("directory", ".")
+    quote_dirs = []
+    include_dirs = []
+    i = 0
+    while i < len(arguments):
+        arg = arguments[i]
+        for prefix, target in [
+            ("-iquote", quote_dirs),
+            ("-isystem", include_dirs),
+            ("-I", include_dirs),
+            ("/I", include_dirs),
+        ]:
+            if arg.startswith(prefix):
+                path = arg[len(prefix) :]
+                if not path and i + 1 < len(arguments):
+                    i += 1
+                    path = arguments[i]
+                target.append(os.path.normpath(os.path.join(directory, path)))
+                break
+        i += 1
+    return quote_dirs, include_dirs
+
+
+def parse_include_file(path, cache, stats):
+    """读取文件中的包含指令,按修改时间缓存解析结果
+
+    返回 {"lines", "size", "includes": [[类型, 名称], ...]},文件不存在时返回None
+    """
+    import re
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    entry = cache.get(path)
+    if entry is not None and entry["mtime"] == st.st_mtime_ns and entry["size"] == st.st_size:
+        return entry
+    stats["parsed"] += 1
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    entry = {
+        "mtime": st.st_mtime_ns,
+        "size": st.st_size,
+        "lines": text.count("\n"),
+        "includes": [[kind, name.strip()] for kind, name in re.findall(INCLUDE_PATTERN, text, re.MULTILINE)],
+    }
+    cache[path] = entry
+    return entry
+
+
+def build_include_graph(commands, cache, stats):
+    """根据编译命令建立传递包含关系
+
+    返回 (头文件 -> 依赖它的编译单元集合, 头文件 -> 解析结果)
+    无法在包含目录中找到的头文件(如标准库)不计入
+    """
+    dependents = {}
+    headers = {}
+    resolved = {}
+    for entry in commands:
+        tu = os.path.normpath(os.path.join(entry.get("directory", "."), entry["file"]))
+        quote_dirs, include_dirs = compile_command_include_dirs(entry)
+        search_key = (tuple(quote_dirs), tuple(include_dirs))
+        seen = set()
+        pending = [tu]
+        while pending:
+            current = pending.pop()
+            info = parse_include_file(current, cache, stats)
+            if info is None:
+                continue
+            if current != tu:
+                headers[current] = info
+                dependents.setdefault(current, set()).add(tu)
+            current_dir = os.path.dirname(current)
+            for kind, name in info["includes"]:
+                key = (current_dir, kind, name, search_key)
+                if key not in resolved:
+                    candidates = ([current_dir] + quote_dirs if kind == '"' else []) + include_dirs
+                    resolved[key] = None
+                    for directory in candidates:
+                        path = os.path.normpath(os.path.join(directory, name))
+                        if os.path.isfile(path):
+                            resolved[key] = path
+                            break
+                path = resolved[key]
+                if path is not None and path not in seen:
+                    seen.add(path)
+                    pending.append(path)
+    return dependents, headers
+
+
+def analyze_includes(args):
+    """pybuild analyze includes: 找出修改后导致最多重新编译的头文件
+
+    按 依赖它的编译单元数 x 头文件行数(或字节数) 排序
+    """
+    import json
+
+    build_dir = "build"
+    limit = 20
+    metric = "lines"
+    json_path = None
+    show_all = False
+    i = 3  # args[1]是"analyze",args[2]是"includes"
+    while i < len(args):
+        arg = args[i]
+        if (arg == "-b" or arg == "--build-dir") and i + 1 < len(args):
+            i += 1
+            build_dir = args[i]
+        elif (arg == "-n" or arg == "--limit") and i + 1 < len(args):
+            i += 1
+            try:
+                limit = int(args[i])
+                if limit < 1:
+                    raise ValueError
+            except ValueError:
+                print(f"错误：无效的显示数量: {args[i]}")
+                return 1
+        elif arg == "--metric" and i + 1 < len(args) and args[i + 1] in ("lines", "size"):
+            i += 1
+            metric = args[i]
+        elif arg == "--json" and i + 1 < len(args):
+            i += 1
+            json_path = args[i]
+        elif arg == "--all":
+            show_all = True
+        else:
+            print(f"未知参数: {arg}")
+            return 1
+        i += 1
+
+    commands_path = os.path.join(build_dir, "compile_commands.json")
+    try:
+        with open(commands_path, "r", encoding="utf-8") as f:
+            commands = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"无法读取 {commands_path}: {e}")
+        print("请先运行 pybuild build (生成器需要支持CMAKE_EXPORT_COMPILE_COMMANDS)")
+        return 1
+
+    cache_path = os.path.join(build_dir, INCLUDES_CACHE_FILE)
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    stats = {"parsed": 0}
+    dependents, headers = build_include_graph(commands, cache, stats)
+
+    # 只保留仍然存在的文件,避免缓存无限增长
+    cache = {path: info for path, info in cache.items() if os.path.exists(path)}
+    write_file_if_changed(cache_path, json.dumps(cache, sort_keys=True))
+
+    project_root = os.path.abspath(".")
+    rows = []
+    for path, tus in dependents.items():
+        info = headers[path]
+        path = os.path.abspath(path)
+        internal = path.startswith(project_root + os.sep)
+        if not internal and not show_all:
+            continue
+        weight = info["lines"] if metric == "lines" else info["size"]
+        rows.append(
+            {
+                "header": os.path.relpath(path) if internal else path,
+                "translation_units": len(tus),
+                "lines": info["lines"],
+                "size": info["size"],
+                "score": len(tus) * weight,
+            }
+        )
+    rows.sort(key=lambda row: (-row["score"], row["header"]))
+    rows = rows[:limit]
+
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "translation_units": len(commands),
+                    "headers": len(dependents),
+                    "metric": metric,
+                    "ranking": rows,
+                },
+                f,
+                indent=2,
+                ensure_ascii=False,
+            )
+        print(f"分析结果已写入: {json_path}")
+
+    print(
+        f"{len(commands)} 个编译单元, {len(dependents)} 个头文件, 重新解析 {stats['parsed']} 个文件"
+    )
+    if not rows:
+        print("没有找到项目头文件")
+        return 0
+    print(f"{'得分':>10} {'编译单元':>8} {'行数':>8} {'字节':>10}  头文件")
+    for row in rows:
+        print(
+            f"{row['score']:>10} {row['translation_units']:>8} {row['lines']:>8} {row['size']:>10}  {row['header']}"
+        )
+    print(f"得分 = 依赖该头文件的编译单元数 x {'行数' if metric == 'lines' else '字节数'}")
+    return 0
+
+
+def analyze_command(args):
+    """pybuild analyze <子命令>"""
+    if len(args) > 2 and args[2] == "includes":
+        return analyze_includes(args)
+    print(
+        "用法: pybuild analyze includes [-b <构建目录>] [-n <数量>] [--metric lines|size] [--json <文件>] [--all]"
+    )
+    return 1
 
 
 def create_cmake_json(
-    project_name, project_type, deps, num_deps, add_precompile_headers, include_dir
+    project_name,
+    project_type,
+    deps,
+    num_deps,
+    add_precompile_headers,
+    include_dir,
+    changed_files=None,
+    unity=None,
 ) -> bool:
-    """创建CMake.json配置文件"""
+    """创建CMake.json配置文件(内容未改变时不改写)"""
+    import json
+
     try:
         config = {
             "project": {
@@ -168,9 +694,12 @@ def create_cmake_json(
                 "type": project_type,
                 "version": "1.0.0",
                 "precompile_headers": add_precompile_headers,
+                "cxx_standard": DEFAULT_CXX_STANDARD,
             },
             "dependencies": {},
             "include_dir": [],
+            "sources": {"include": list(DEFAULT_SOURCE_INCLUDE), "exclude": []},
+            "unity": unity_settings(unity),
         }
 
         # 添加依赖项
@@ -179,8 +708,11 @@ def create_cmake_json(
         for i in include_dir:
             config["include_dir"].append(i)
 
-        with open("CMake.json", "w", encoding="utf-8") as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+        write_file_if_changed(
+            "CMake.json",
+            json.dumps(config, indent=2, ensure_ascii=False),
+            changed_files,
+        )
         return True
     except Exception as e:
         print(f"创建CMake.json失败: {e}")
@@ -211,10 +743,13 @@ def parse_cmake_json(
     num_deps: list,
     add_precompile_headers: list,
     include_dir: list,
+    json_path="CMake.json",
 ):
     """解析CMake.json配置文件"""
+    import json
+
     try:
-        with open("CMake.json", "r", encoding="utf-8") as f:
+        with open(json_path, "r", encoding="utf-8") as f:
             config = json.load(f)
 
         # 解析项目信息
@@ -246,6 +781,293 @@ def parse_cmake_json(
         return False
 
 
+def read_cmake_json(project_dir="."):
+    """读取项目的CMake.json,返回配置字典;文件不存在或解析失败时返回空字典"""
+    import json
+
+    try:
+        with open(os.path.join(project_dir, "CMake.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def cmake_quote(value):
+    """把字符串写成CMake带引号的参数,转义 \\、"、$ 和 ;(分号不会把路径拆成列表的两项)"""
+    for char in ("\\", '"', "$", ";"):
+        value = value.replace(char, "\\" + char)
+    return f'"{value}"'
+
+
+# 自动发现源文件: 生成的源文件列表(相对项目根目录)和默认匹配规则
+SOURCE_LIST_FILE = "cmake/pybuild_sources.cmake"
+DEFAULT_SOURCE_INCLUDE = ["src/*.cpp", "src/*.cc", "src/*.cxx"]
+_source_index_lock = threading.Lock()
+
+
+def source_index_path(project_dir):
+    """返回项目源文件索引的路径(按项目绝对路径区分,保存在缓存目录中)"""
+    import hashlib
+
+    key = hashlib.sha256(
+        os.path.abspath(project_dir).encode("utf-8")
+    ).hexdigest()[:24]
+    return get_cache_dir("sources", key + ".json")
+
+
+def scan_source_tree(project_dir, index):
+    """扫描src/目录树,返回(文件列表, 新索引, 重新扫描的目录数)
+
+    index记录每个目录的修改时间及其中的文件和子目录;目录修改时间未变时
+    (目录中没有增删或重命名条目)直接复用索引,不再列出目录内容。
+    刚刚修改过的目录不写入修改时间,下次一定重新扫描,避免同一时间戳内的改动被漏掉。
+    """
+    files = []
+    new_index = {}
+    rescanned = 0
+    now_ns = time.time_ns()
+    pending = ["src"]
+    while pending:
+        rel_dir = pending.pop()
+        try:
+            mtime = os.stat(os.path.join(project_dir, rel_dir)).st_mtime_ns
+        except OSError:
+            continue
+
+        entry = index.get(rel_dir)
+        if entry is None or entry.get("mtime") != mtime:
+            rescanned += 1
+            entry = {"files": [], "dirs": []}
+            with os.scandir(os.path.join(project_dir, rel_dir)) as it:
+                for item in it:
+                    if item.is_dir():
+                        entry["dirs"].append(item.name)
+                    elif item.is_file():
+                        entry["files"].append(item.name)
+            entry["files"].sort()
+            entry["dirs"].sort()
+            entry["mtime"] = mtime if now_ns - mtime > 2_000_000_000 else None
+        new_index[rel_dir] = entry
+
+        files.extend(f"{rel_dir}/{name}" for name in entry["files"])
+        pending.extend(f"{rel_dir}/{name}" for name in entry["dirs"])
+    return files, new_index, rescanned
+
+
+def discover_sources(project_dir=".", changed_files=None):
+    """发现src/下的源文件并生成 cmake/pybuild_sources.cmake
+
+    CMake.json中的 "sources": {"include": [...], "exclude": [...]} 为相对项目根目录的
+    通配符规则(* 可以匹配多级目录)。源文件列表只在增删文件或规则改变时改写,
+    内容不变时保持修改时间,不会触发CMake重新配置。
+    返回源文件列表
+    """
+    import fnmatch
+    import json
+
+    sources_config = read_cmake_json(project_dir).get("sources", {})
+    include = sources_config.get("include", DEFAULT_SOURCE_INCLUDE)
+    exclude = sources_config.get("exclude", [])
+
+    with _source_index_lock:
+        index_path = source_index_path(project_dir)
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except Exception:
+            index = {}
+
+        files, new_index, rescanned = scan_source_tree(project_dir, index)
+        sources = sorted(
+            path
+            for path in files
+            if any(fnmatch.fnmatch(path, pattern) for pattern in include)
+            and not any(fnmatch.fnmatch(path, pattern) for pattern in exclude)
+        )
+
+        f = io.StringIO()
+        f.write("# 由pybuild根据src/目录自动生成,请勿手动修改\n")
+        f.write("# 匹配规则见CMake.json中的sources项\n")
+        f.write("set(PYBUILD_SOURCES\n")
+        for path in sources:
+            f.write(f"    {cmake_quote(path)}\n")
+        f.write(")\n")
+        os.makedirs(
+            os.path.join(project_dir, os.path.dirname(SOURCE_LIST_FILE)), exist_ok=True
+        )
+        list_path = os.path.join(project_dir, SOURCE_LIST_FILE)
+        if write_file_if_changed(list_path, f.getvalue()):
+            print(f"源文件列表已更新: {len(sources)} 个源文件 (重新扫描 {rescanned} 个目录)")
+            if changed_files is not None:
+                changed_files.append(SOURCE_LIST_FILE)
+
+        if new_index != index:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            write_file_if_changed(index_path, json.dumps(new_index, sort_keys=True))
+    return sources
+
+
+def cmakelists_contains(project_dir, marker):
+    """项目的CMakeLists.txt中是否包含marker,用于判断是否由新版本pybuild生成"""
+    try:
+        with open(os.path.join(project_dir, "CMakeLists.txt"), "r", encoding="utf-8") as f:
+            return marker in f.read()
+    except OSError:
+        return False
+
+
+# Unity(jumbo)构建的默认设置,与CMake的UNITY_BUILD_BATCH_SIZE默认值一致
+DEFAULT_UNITY = {"enabled": False, "batch_size": 8, "exclude": []}
+
+
+def unity_settings(unity):
+    """合并CMake.json中的unity设置与默认值"""
+    settings = dict(DEFAULT_UNITY)
+    if isinstance(unity, dict):
+        settings.update(unity)
+    elif isinstance(unity, bool):
+        settings["enabled"] = unity
+    return settings
+
+
+def parse_unity_arg(arg):
+    """解析 --unity[=N],返回批大小(未指定时为None);格式错误时抛出ValueError"""
+    if arg == "--unity":
+        return None
+    batch_size = int(arg[len("--unity=") :])
+    if batch_size < 1:
+        raise ValueError(arg)
+    return batch_size
+
+
+DEFAULT_CXX_STANDARD = 11
+
+
+def write_profile_settings(f, cxx_standard):
+    """写入构建配置方案的设置
+
+    pybuild build 每次通过 -DPYBUILD_CXX_STANDARD 等参数传入当前配置方案的值,
+    在创建目标之前设置,对之后的所有目标生效
+    """
+    f.write("# 构建配置方案(CMake.json中的profiles,通过 pybuild build --profile <名称> 选择)\n")
+    f.write(f'set(PYBUILD_CXX_STANDARD {cxx_standard} CACHE STRING "C++标准")\n')
+    f.write('set(PYBUILD_CXX_FLAGS "" CACHE STRING "额外的编译选项")\n')
+    f.write('set(PYBUILD_LINK_FLAGS "" CACHE STRING "额外的链接选项")\n')
+    f.write('set(PYBUILD_DEFINES "" CACHE STRING "额外的预处理宏(分号分隔)")\n')
+    f.write("set(CMAKE_CXX_STANDARD ${PYBUILD_CXX_STANDARD})\n")
+    f.write('separate_arguments(PYBUILD_CXX_FLAGS_LIST NATIVE_COMMAND "${PYBUILD_CXX_FLAGS}")\n')
+    f.write('separate_arguments(PYBUILD_LINK_FLAGS_LIST NATIVE_COMMAND "${PYBUILD_LINK_FLAGS}")\n')
+    f.write("add_compile_options(${PYBUILD_CXX_FLAGS_LIST})\n")
+    f.write("add_link_options(${PYBUILD_LINK_FLAGS_LIST})\n")
+    f.write("add_compile_definitions(${PYBUILD_DEFINES})\n")
+
+
+def profile_flags(value):
+    """配置方案中的选项可以写成字符串或列表"""
+    if isinstance(value, list):
+        return " ".join(str(v) for v in value)
+    return str(value or "")
+
+
+def write_lto(f):
+    """写入链接时优化设置,在创建目标之前开启,对之后的所有目标生效"""
+    f.write("# 链接时优化(pybuild build --lto 时开启)\n")
+    f.write('option(PYBUILD_LTO "开启链接时优化(IPO/LTO)" OFF)\n')
+    f.write("if(PYBUILD_LTO)\n")
+    f.write("    include(CheckIPOSupported)\n")
+    f.write(
+        "    check_ipo_supported(RESULT PYBUILD_IPO_SUPPORTED OUTPUT PYBUILD_IPO_ERROR LANGUAGES CXX)\n"
+    )
+    f.write("    if(PYBUILD_IPO_SUPPORTED)\n")
+    f.write("        set(CMAKE_INTERPROCEDURAL_OPTIMIZATION ON)\n")
+    f.write("    else()\n")
+    f.write('        message(WARNING "当前编译器不支持链接时优化: ${PYBUILD_IPO_ERROR}")\n')
+    f.write("    endif()\n")
+    f.write("endif()\n\n")
+
+
+def write_unity_build(f, project_name, unity):
+    """写入Unity构建设置
+
+    默认值来自CMake.json,pybuild build 每次通过 -DPYBUILD_UNITY_BUILD/-DPYBUILD_UNITY_BATCH_SIZE 传入实际值
+    """
+    settings = unity_settings(unity)
+    f.write("\n# Unity构建(可通过 pybuild build --unity[=N] / --no-unity 覆盖)\n")
+    f.write(
+        f'option(PYBUILD_UNITY_BUILD "合并源文件进行Unity构建" {"ON" if settings["enabled"] else "OFF"})\n'
+    )
+    f.write(
+        f'set(PYBUILD_UNITY_BATCH_SIZE {int(settings["batch_size"])} CACHE STRING "每个Unity源文件合并的源文件数")\n'
+    )
+    f.write(f"set_target_properties({project_name} PROPERTIES\n")
+    f.write("    UNITY_BUILD ${PYBUILD_UNITY_BUILD}\n")
+    f.write("    UNITY_BUILD_BATCH_SIZE ${PYBUILD_UNITY_BATCH_SIZE}\n")
+    f.write(")\n")
+    if settings["exclude"]:
+        f.write("# 不能与其他源文件合并编译的源文件\n")
+        f.write("set_source_files_properties(\n")
+        for path in settings["exclude"]:
+            f.write(f"    {cmake_quote(path)}\n")
+        f.write("    PROPERTIES SKIP_UNITY_BUILD_INCLUSION ON\n")
+        f.write(")\n")
+
+
+def write_output_directories(f):
+    """写入输出目录设置
+
+    多配置构建时pybuild通过 -DPYBUILD_OUTPUT_SUFFIX=/<配置> 把各配置的产物分开存放
+    """
+    f.write("# 输出目录(多配置构建时按配置分开存放)\n")
+    f.write('set(PYBUILD_OUTPUT_SUFFIX "" CACHE STRING "pybuild多配置构建的输出子目录")\n')
+    f.write(
+        "set(CMAKE_RUNTIME_OUTPUT_DIRECTORY ${CMAKE_SOURCE_DIR}/bin${PYBUILD_OUTPUT_SUFFIX})  # 可执行文件\n"
+    )
+    f.write(
+        "set(CMAKE_ARCHIVE_OUTPUT_DIRECTORY ${CMAKE_SOURCE_DIR}/lib/static${PYBUILD_OUTPUT_SUFFIX})  # 静态库\n"
+    )
+    f.write(
+        "set(CMAKE_LIBRARY_OUTPUT_DIRECTORY ${CMAKE_SOURCE_DIR}/lib/shared${PYBUILD_OUTPUT_SUFFIX})  # 共享库\n"
+    )
+
+
+def write_precompile_headers(f, project_name, project_type):
+    """写入CMake原生预编译头设置
+
+    预编译头由单独的 <项目名>_pch 目标编译一次,项目目标和测试等其他目标
+    通过 pybuild_use_pch(<目标>) 以REUSE_FROM方式共享,不再各自编译
+    """
+    pch_target = f"{project_name}_pch"
+    f.write("\n# 预编译头文件(由 pybuild pch --suggest 生成内容)\n")
+    f.write("set(PYBUILD_PCH_SOURCE ${CMAKE_BINARY_DIR}/pybuild_pch.cpp)\n")
+    f.write("if(NOT EXISTS ${PYBUILD_PCH_SOURCE})\n")
+    f.write('    file(WRITE ${PYBUILD_PCH_SOURCE} "// 由pybuild生成,用于编译共享的预编译头\\n")\n')
+    f.write("endif()\n")
+    f.write(f"add_library({pch_target} OBJECT ${{PYBUILD_PCH_SOURCE}})\n")
+    # 编译选项只来自目录级的add_compile_options,两个目标本来就相同,复制会重复
+    for prop, command in [
+        ("INCLUDE_DIRECTORIES", "target_include_directories"),
+        ("COMPILE_DEFINITIONS", "target_compile_definitions"),
+    ]:
+        f.write(
+            f"{command}({pch_target} PRIVATE $<TARGET_PROPERTY:{project_name},{prop}>)\n"
+        )
+    if project_type == "shared":
+        f.write(
+            f"set_target_properties({pch_target} PROPERTIES POSITION_INDEPENDENT_CODE ON)\n"
+        )
+    f.write(
+        f"target_precompile_headers({pch_target} PRIVATE ${{CMAKE_SOURCE_DIR}}/include/pch.h)\n\n"
+    )
+    f.write("# 其他目标(如测试)调用 pybuild_use_pch(<目标>) 复用同一份预编译头\n")
+    f.write("function(pybuild_use_pch target)\n")
+    if project_type == "shared":
+        # GCC要求使用预编译头的目标与编译它时的-fPIC设置一致
+        f.write("    target_compile_options(${target} PRIVATE ${CMAKE_CXX_COMPILE_OPTIONS_PIC})\n")
+    f.write(f"    target_precompile_headers(${{target}} REUSE_FROM {pch_target})\n")
+    f.write("endfunction()\n")
+    f.write(f"pybuild_use_pch({project_name})\n")
+
+
 def create_cmakelists(
     project_name,
     project_type,
@@ -253,15 +1075,26 @@ def create_cmakelists(
     num_deps,
     add_precompile_headers,
     include_dir: list,
+    changed_files=None,
+    unity=None,
+    cxx_standard=None,
 ):
-    """创建CMakeLists.txt文件"""
+    """创建CMakeLists.txt文件
+
+    内容先在内存中生成,与磁盘上的文件相同时不改写,保持修改时间不变
+    unity: CMake.json中的unity设置
+    cxx_standard: 默认的C++标准,构建配置方案可以覆盖
+    """
     try:
-        with open("CMakeLists.txt", "w", encoding="utf-8") as f:
+        with io.StringIO() as f:
             f.write("cmake_minimum_required(VERSION 3.16)\n")
             f.write(f"project({project_name} LANGUAGES CXX)\n\n")
-            f.write("set(CMAKE_CXX_STANDARD 11)\n")
+            write_profile_settings(f, cxx_standard or DEFAULT_CXX_STANDARD)
             f.write("set(CMAKE_CXX_STANDARD_REQUIRED ON)\n")
             f.write("set(CMAKE_EXPORT_COMPILE_COMMANDS ON)\n\n")
+            f.write("# 源文件列表由pybuild根据src/目录自动生成(PYBUILD_SOURCES)\n")
+            f.write(f"include(${{CMAKE_SOURCE_DIR}}/{SOURCE_LIST_FILE})\n\n")
+            write_lto(f)
 
             if PLATFORM_WINDOWS:
                 if num_deps > 0:
@@ -284,20 +1117,10 @@ def create_cmakelists(
                     f.write("include_directories(${PKG_CONFIG_INCLUDE_DIRS})\n")
                     f.write("link_directories(${PKG_CONFIG_LIBRARY_DIRS})\n")
                     f.write("add_definitions(${PKG_CONFIG_CFLAGS_OTHER})\n\n")
-                elif project_type != "library":
-                    f.write(
-                        f"target_include_directories(${project_name} PRIVATE ${CMAKE_SOURCE_DIR}/include)\n\n"
-                    )
 
             if project_type == "executable":
-                f.write(
-                    f"""set(CMAKE_RUNTIME_OUTPUT_DIRECTORY ${CMAKE_SOURCE_DIR}/bin)  # 可执行文件
-                    set(CMAKE_ARCHIVE_OUTPUT_DIRECTORY ${CMAKE_SOURCE_DIR}/lib/static)  # 静态库
-                    set(CMAKE_LIBRARY_OUTPUT_DIRECTORY ${CMAKE_SOURCE_DIR}/lib/shared)  # 共享库\n"""
-                )
-                f.write(f"add_executable({project_name}\n")
-                f.write("    src/main.cpp\n")
-                f.write(")\n")
+                write_output_directories(f)
+                f.write(f"add_executable({project_name} ${{PYBUILD_SOURCES}})\n")
                 f.write(
                     f"target_include_directories({project_name} PRIVATE ${CMAKE_SOURCE_DIR}/include)\n"
                 )
@@ -308,14 +1131,8 @@ def create_cmakelists(
                 f.write("    RUNTIME DESTINATION bin\n")
                 f.write(")\n")
             elif project_type == "static":
-                f.write(
-                    f"""set(CMAKE_RUNTIME_OUTPUT_DIRECTORY ${CMAKE_SOURCE_DIR}/bin)  # 可执行文件
-                    set(CMAKE_ARCHIVE_OUTPUT_DIRECTORY ${CMAKE_SOURCE_DIR}/lib/static)  # 静态库
-                    set(CMAKE_LIBRARY_OUTPUT_DIRECTORY ${CMAKE_SOURCE_DIR}/lib/shared)  # 共享库\n"""
-                )
-                f.write(f"add_library({project_name} STATIC\n")
-                f.write(f"    src/{project_name}.cpp\n")
-                f.write(")\n")
+                write_output_directories(f)
+                f.write(f"add_library({project_name} STATIC ${{PYBUILD_SOURCES}})\n")
                 f.write(
                     f"target_include_directories({project_name} PRIVATE ${CMAKE_SOURCE_DIR}/include)\n"
                 )
@@ -329,14 +1146,8 @@ def create_cmakelists(
                     f"install(FILES include/{project_name}.h DESTINATION include)\n"
                 )
             elif project_type == "shared":
-                f.write(
-                    f"""set(CMAKE_RUNTIME_OUTPUT_DIRECTORY ${CMAKE_SOURCE_DIR}/bin)  # 可执行文件
-                    set(CMAKE_ARCHIVE_OUTPUT_DIRECTORY ${CMAKE_SOURCE_DIR}/lib/static)  # 静态库
-                    set(CMAKE_LIBRARY_OUTPUT_DIRECTORY ${CMAKE_SOURCE_DIR}/lib/shared)  # 共享库\n"""
-                )
-                f.write(f"add_library({project_name} SHARED\n")
-                f.write(f"    src/{project_name}.cpp\n")
-                f.write(")\n")
+                write_output_directories(f)
+                f.write(f"add_library({project_name} SHARED ${{PYBUILD_SOURCES}})\n")
                 f.write(
                     f"target_include_directories({project_name} PRIVATE ${CMAKE_SOURCE_DIR}/include)\n"
                 )
@@ -351,14 +1162,8 @@ def create_cmakelists(
                 )
             else:
                 print("未设置项目类型,自动选择为:executable")
-                f.write(
-                    f"""set(CMAKE_RUNTIME_OUTPUT_DIRECTORY ${CMAKE_SOURCE_DIR}/bin)  # 可执行文件
-                    set(CMAKE_ARCHIVE_OUTPUT_DIRECTORY ${CMAKE_SOURCE_DIR}/lib/static)  # 静态库
-                    set(CMAKE_LIBRARY_OUTPUT_DIRECTORY ${CMAKE_SOURCE_DIR}/lib/shared)  # 共享库\n"""
-                )
-                f.write(f"add_executable({project_name}\n")
-                f.write("    src/main.cpp\n")
-                f.write(")\n")
+                write_output_directories(f)
+                f.write(f"add_executable({project_name} ${{PYBUILD_SOURCES}})\n")
                 f.write(
                     f"target_include_directories({project_name} PRIVATE ${CMAKE_SOURCE_DIR}/include)\n"
                 )
@@ -369,35 +1174,7 @@ def create_cmakelists(
                 f.write("    RUNTIME DESTINATION bin\n")
                 f.write(")\n")
 
-            if add_precompile_headers:
-                f.write("set(PRECOMPILED_HEADER ${CMAKE_SOURCE_DIR}/include/pch.h)\n")
-                f.write("if(MSVC)\n")
-                f.write(f"\tset_target_properties({project_name} PROPERTIES\n")
-                f.write('\t\tCOMPILE_FLAGS "/Yu\\"${PRECOMPILED_HEADER}\\""\n')
-                f.write("\t)\n")
-                f.write(
-                    "\tset_source_files_properties(${PRECOMPILED_HEADER} PROPERTIES\n"
-                )
-                f.write('\t\tCOMPILE_FLAGS "/Yc"${PRECOMPILED_HEADER}""\n')
-                f.write("\t)\n")
-                f.write('elseif(CMAKE_CXX_COMPILER_ID MATCHES "GNU|Clang")\n')
-                f.write('\tset(PCH_OUTPUT "${CMAKE_BINARY_DIR}/pch.h.gch")\n')
-                f.write("\tadd_custom_command(\n")
-                f.write("\t\tOUTPUT ${PCH_OUTPUT}\n")
-                f.write("\t\tCOMMAND ${CMAKE_CXX_COMPILER}\n")
-                f.write("\t\t\t\t${CMAKE_CXX_FLAGS}\n")
-                f.write("\t\t\t\t-x c++-header\n")
-                f.write("\t\t\t\t-o ${PCH_OUTPUT}\n")
-                f.write("\t\t\t\t-I ${CMAKE_SOURCE_DIR}/include\n")
-                f.write("\t\t\t\t${PRECOMPILED_HEADER}\n")
-                f.write("\t\tDEPENDS ${PRECOMPILED_HEADER}\n")
-                f.write("\t)\n")
-                f.write("\tadd_custom_target(pch_target DEPENDS ${PCH_OUTPUT})\n")
-                f.write(f"\tadd_dependencies({project_name} pch_target)\n")
-                f.write(f"\ttarget_compile_options({project_name} PRIVATE\n")
-                f.write("\t\t-include ${PRECOMPILED_HEADER}\n")
-                f.write("\t)\n")
-                f.write("endif()\n")
+            write_unity_build(f, project_name, unity)
 
             if len(include_dir) > 0:
                 f.write(f"target_include_directories({project_name} PUBLIC \n")
@@ -425,18 +1202,20 @@ def create_cmakelists(
                         f.write(f"    ${{{deps[i]}_LIBRARIES}}\n")
                     f.write(")\n")
 
+            if add_precompile_headers:
+                write_precompile_headers(f, project_name, project_type)
+
+            write_file_if_changed("CMakeLists.txt", f.getvalue(), changed_files)
         return True
     except Exception as e:
         print(f"创建CMakeLists.txt失败: {e}")
         return False
 
 
-def create_main_cpp_file(add_precompile_headers):
+def create_main_cpp_file():
     """创建初始的main.cpp文件"""
     try:
         with open("src/main.cpp", "w", encoding="utf-8") as f:
-            if add_precompile_headers:
-                f.write('#include "pch.h"\n')
             f.write("#include <iostream>\n\n")
             f.write("int main() {\n")
             f.write('    std::cout << "Hello, World!" << std::endl;\n')
@@ -448,13 +1227,11 @@ def create_main_cpp_file(add_precompile_headers):
         return False
 
 
-def create_library_files(project_name, add_precompile_headers):
+def create_library_files(project_name):
     """创建库源文件和头文件"""
     try:
         # 创建源文件
         with open(f"src/{project_name}.cpp", "w", encoding="utf-8") as f:
-            if add_precompile_headers:
-                f.write(f'#include "pch.h"\n')
             f.write(f'#include "{project_name}.h"\n\n')
             f.write(f"int {project_name}_function() {{\n")
             f.write("    return 0;\n")
@@ -484,6 +1261,7 @@ def create_new_project(args):
     project_name_set = False
     add_precompile_headers = False
     include_dir = []
+    unity = dict(DEFAULT_UNITY)
 
     # 解析命令行参数
     i = 2  # args[0]是程序名，args[1]是"new"
@@ -501,6 +1279,16 @@ def create_new_project(args):
         elif arg == "-p" or arg == "--precompile-headers":
             add_precompile_headers = True
             i += 1
+        elif arg == "--unity" or arg.startswith("--unity="):
+            try:
+                batch_size = parse_unity_arg(arg)
+            except ValueError:
+                print(f"错误：无效的Unity批大小: {arg}")
+                return 1
+            unity["enabled"] = True
+            if batch_size:
+                unity["batch_size"] = batch_size
+            i += 1
         elif arg == "-i" or arg == "--include-dir":
             if i + 1 >= len(args):
                 print("未设置include路径")
@@ -568,6 +1356,7 @@ def create_new_project(args):
             len(deps_from_cli),
             add_precompile_headers,
             include_dir,
+            unity=unity,
         ):
             return 1
 
@@ -604,15 +1393,19 @@ def create_new_project(args):
             num_deps[0],
             add_precompile_headers,
             include_dir,
+            unity=read_cmake_json().get("unity"),
+            cxx_standard=read_cmake_json()
+            .get("project", {})
+            .get("cxx_standard", DEFAULT_CXX_STANDARD),
         ):
             return 1
 
         # 创建源文件
         if project_type == "executable":
-            if not create_main_cpp_file(add_precompile_headers):
+            if not create_main_cpp_file():
                 return 1
         else:
-            if not create_library_files(project_name, add_precompile_headers):
+            if not create_library_files(project_name):
                 return 1
 
         # 创建预编译头文件
@@ -620,6 +1413,9 @@ def create_new_project(args):
             if not create_precompile_headers(add_precompile_headers):
                 return 1
 
+        # 生成源文件列表
+        discover_sources()
+
         # 输出成功信息
         print("\n项目创建成功! 结构如下:")
         print(f"{project_name}{PATH_SEP}")
@@ -714,6 +1510,9 @@ def init_project(args):
         os.makedirs("include", exist_ok=True)
         os.makedirs("build", exist_ok=True)
 
+        # 记录真正被改写的文件
+        changed_files = []
+
         # 创建CMakeLists.txt文件
         if not create_cmakelists(
             project_name[0],
@@ -722,25 +1521,36 @@ def init_project(args):
             num_deps[0],
             add_precompile_headers[0],
             include_dir,
+            changed_files,
+            unity=read_cmake_json().get("unity"),
+            cxx_standard=read_cmake_json()
+            .get("project", {})
+            .get("cxx_standard", DEFAULT_CXX_STANDARD),
         ):
             return 1
 
         # 创建源文件（如果不存在）
         if project_type[0] == "executable":
             if not os.path.exists("src/main.cpp"):
-                if not create_main_cpp_file(add_precompile_headers[0]):
+                if not create_main_cpp_file():
                     return 1
+                changed_files.append("src/main.cpp")
         else:
             src_file = f"src/{project_name[0]}.cpp"
             if not os.path.exists(src_file):
-                if not create_library_files(project_name[0], add_precompile_headers[0]):
+                if not create_library_files(project_name[0]):
                     return 1
+                changed_files.append(f"include/{project_name[0]}.h")
+                changed_files.append(src_file)
 
         # 创建预编译头文件
         if add_precompile_headers[0]:
-            if not create_precompile_headers(add_precompile_headers[0]):
+            if not create_precompile_headers(add_precompile_headers[0], changed_files):
                 return 1
 
+        # 发现src/下的源文件,只在增删文件时改写源文件列表
+        discover_sources(".", changed_files)
+
         # 确保CMake.json存在
         if not os.path.exists("CMake.json"):
             create_cmake_json(
@@ -750,21 +1560,17 @@ def init_project(args):
                 num_deps[0],
                 add_precompile_headers[0],
                 include_dir,
+                changed_files,
             )
-            print("  CMake.json (已创建)")
-        else:
-            print("  CMake.json (已更新)")
 
         # 输出成功信息
         print("\n项目初始化成功!")
-        print("已创建/更新以下文件:")
-        print("  CMakeLists.txt")
-
-        if project_type[0] in ["static", "shared"]:
-            print(f"  include/{project_name[0]}.h")
-            print(f"  src/{project_name[0]}.cpp")
+        if changed_files:
+            print("已创建/更新以下文件:")
+            for path in changed_files:
+                print(f"  {path}")
         else:
-            print("  src/main.cpp")
+            print("所有文件均已是最新,没有文件被改写")
 
         if num_deps[0] > 0:
             print("\n注意 : 本项目的依赖项需要通过系统包管理器安装")
@@ -781,172 +1587,1653 @@ def init_project(args):
         return 1
 
 
-def execute_command(command):
-    """执行命令并检查状态"""
-    print(f"执行命令: {command}")
-    try:
-        result = subprocess.run(command, shell=True, check=True, text=True)
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"命令执行失败: {e.stderr}")
-        return False
-    except Exception as e:
-        print(f"命令执行错误: {e}")
-        return False
+# 构建追踪(Chrome trace-event格式),为None表示未启用 --trace
+_trace_events = None
+_trace_lock = threading.Lock()
+_trace_start = 0.0
+_trace_threads = {}
+# 每个线程上正在进行的阶段,用于识别包含子阶段的父阶段
+_phase_local = threading.local()
 
 
-def clean_project_cache():
-    """清理项目缓存"""
-    original_dir = os.getcwd()
+def trace_now():
+    """返回相对于追踪开始的时间(微秒)"""
+    return (time.perf_counter() - _trace_start) * 1e6
 
-    try:
-        # 检查build目录是否存在
-        if not os.path.exists("build"):
-            print("build目录不存在,无需清理")
-            os.makedirs("build", exist_ok=True)
-            return 0
 
-        # 进入build目录
-        os.chdir("build")
+def start_trace():
+    """开始记录追踪事件"""
+    global _trace_events, _trace_start
+    _trace_events = []
+    _trace_start = time.perf_counter()
 
-        # 清理操作
-        if PLATFORM_WINDOWS:
-            # Windows: 返回上级目录后删除整个build
-            os.chdir("..")
-            if os.path.exists("build"):
-                # 确保所有文件可写
-                def make_writable(path):
-                    for root, dirs, files in os.walk(path):
-                        for d in dirs:
-                            os.chmod(os.path.join(root, d), stat.S_IWRITE)
-                        for f in files:
-                            os.chmod(os.path.join(root, f), stat.S_IWRITE)
-
-                make_writable("build")
-                shutil.rmtree("build", ignore_errors=True)
-
-            os.makedirs("build", exist_ok=True)
-        else:
-            # POSIX: 使用更可靠的递归删除命令
-            execute_command(
-                "find . -delete 2>/dev/null || { rm -rf ./* && rm -rf .[!.]*; }"
+
+def trace_enabled():
+    return _trace_events is not None
+
+
+def trace_thread_id(name=None):
+    """把当前线程(或指定名称的虚拟线程)映射为较小的tid,便于在Perfetto中显示"""
+    key = name or threading.get_ident()
+    with _trace_lock:
+        if key not in _trace_threads:
+            tid = len(_trace_threads) + 1
+            _trace_threads[key] = tid
+            _trace_events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": 1,
+                    "tid": tid,
+                    "args": {"name": name or threading.current_thread().name},
+                }
+            )
+        return _trace_threads[key]
+
+
+def add_trace_event(name, category, ts, dur, tid=None, args=None):
+    """添加一个完整事件(ph=X),时间单位为微秒"""
+    if _trace_events is None:
+        return
+    event = {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": ts,
+        "dur": max(0.0, dur),
+        "pid": 1,
+        "tid": tid if tid is not None else trace_thread_id(),
+    }
+    if args:
+        event["args"] = args
+    with _trace_lock:
+        _trace_events.append(event)
+
+
+@contextmanager
+def trace_span(name, category="pybuild", **args):
+    """记录一个阶段的耗时
+
+    阶段(category为phase)的耗时累加到本次运行的统计中(写入构建历史);
+    只累加最内层的阶段,包含子阶段的父阶段(如 pgo instrument 中的 configure/build)
+    不计入,避免同一段时间被统计两次。启用 --trace 时所有阶段都会写入追踪事件。
+    """
+    frame = None
+    if category == "phase":
+        stack = getattr(_phase_local, "stack", None)
+        if stack is None:
+            stack = _phase_local.stack = []
+        if stack:
+            stack[-1]["has_children"] = True
+        frame = {"has_children": False}
+        stack.append(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if frame is not None:
+            _phase_local.stack.pop()
+            if not frame["has_children"]:
+                record_run_metric("phases", name, elapsed)
+        if _trace_events is not None:
+            add_trace_event(
+                name, category, (start - _trace_start) * 1e6, elapsed * 1e6, args=args
             )
 
-        print("CMake缓存清理成功")
-        return 0
+
+def write_trace(path):
+    """把追踪事件写出为Chrome trace-event JSON(可在Perfetto/chrome://tracing中打开)"""
+    import json
+
+    if _trace_events is None:
+        return
+    try:
+        with _trace_lock:
+            data = {"traceEvents": list(_trace_events), "displayTimeUnit": "ms"}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        print(f"构建追踪已写入: {path}")
     except Exception as e:
-        print(f"清理缓存失败: {e}")
-        return 1
-    finally:
-        # 返回原始目录
-        os.chdir(original_dir)
+        print(f"写入构建追踪失败: {e}")
 
 
-def build_project(args):
-    """构建项目"""
-    cmake_build_type = "Debug"
-    make_install_prefix = ""
-    build_dir = "build"
-    additional_flags = ""
-    configure_only = False
-    clean_cache = False
-    build_test = False
+def ninja_log_size(build_path):
+    """返回.ninja_log当前的大小,用于之后只读取本次构建追加的记录"""
+    try:
+        return os.path.getsize(os.path.join(build_path, ".ninja_log"))
+    except OSError:
+        return None
 
-    # 设置默认安装路径
-    if PLATFORM_WINDOWS:
-        make_install_prefix = ".\\install"  # Windows默认安装路径
-    else:
-        make_install_prefix = "/usr/local"
 
-    # 解析命令行参数
-    i = 2  # args[0]是程序名，args[1]是"build"
-    while i < len(args):
-        arg = args[i]
-        if arg == "-d" or arg == "--debug":
-            cmake_build_type = "Debug"
-            i += 1
-        elif arg == "-r" or arg == "--release":
-            cmake_build_type = "Release"
-            i += 1
-        elif arg == "-p" or arg == "--prefix":
-            if i + 1 < len(args) and not args[i + 1].startswith("-"):
-                i += 1
-                make_install_prefix = args[i]
-            else:
-                print("错误：未指定安装目录,使用默认安装目录")
-                if PLATFORM_WINDOWS:
-                    make_install_prefix = ".\\install"
-                else:
-                    make_install_prefix = "/usr/local"
-            i += 1
-        elif arg == "-c" or arg == "--configure-only":
-            configure_only = True
-            i += 1
-        elif arg == "-b" or arg == "--build-dir":
-            if i + 1 < len(args) and not args[i + 1].startswith("-"):
-                i += 1
-                build_dir = args[i]
-            else:
-                print("错误：未指定构建目录")
-                return 1
-            i += 1
-        elif arg == "-t" or arg == "--test":
-            build_test = True
-        elif arg == "-C" or arg == "--clean-cache":
-            clean_cache = True
-            i += 1
+def trace_ninja_log(build_path, offset, build_start, label):
+    """把本次构建在.ninja_log中追加的记录转换为每个目标/目标文件的追踪事件
+
+    ninja记录的时间是相对于ninja启动的毫秒数,以build_start(微秒)为基准对齐;
+    并行的任务按时间区间分配到不同的虚拟线程上。
+    """
+    log_path = os.path.join(build_path, ".ninja_log")
+    try:
+        with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+            if offset is not None and os.path.getsize(log_path) >= offset:
+                f.seek(offset)
+            lines = f.read().splitlines()
+    except OSError:
+        return
+
+    entries = []
+    for line in lines:
+        parts = line.split("\t")
+        if line.startswith("#") or len(parts) < 4:
+            continue
+        try:
+            entries.append((int(parts[0]), int(parts[1]), parts[3]))
+        except ValueError:
+            continue
+    entries.sort()
+
+    lanes = []  # 每个虚拟线程上最后一个任务的结束时间
+    for start_ms, end_ms, output in entries:
+        for lane, lane_end in enumerate(lanes):
+            if lane_end <= start_ms:
+                lanes[lane] = end_ms
+                break
         else:
-            # 收集额外的CMake参数
-            if additional_flags:
-                additional_flags += " "
-            additional_flags += arg
-            i += 1
+            lane = len(lanes)
+            lanes.append(end_ms)
+        is_object = output.endswith((".o", ".obj"))
+        add_trace_event(
+            os.path.basename(output),
+            "object" if is_object else "target",
+            build_start + start_ms * 1000,
+            (end_ms - start_ms) * 1000,
+            tid=trace_thread_id(f"{label} ninja #{lane + 1}"),
+            args={"output": output},
+        )
+
+
+def trace_cmake_profile(profile_path, configure_start, configure_end, label):
+    """把CMake --profiling-output生成的google-trace事件对齐到配置阶段
+
+    CMake以成对的B/E事件记录每条命令,这里转换为完整事件(X);
+    配置阶段在最后一条CMake命令结束之后的时间近似为生成(generate)阶段。
+    """
+    import json
 
-    print(f"构建模式: {cmake_build_type} | 安装路径: {make_install_prefix}")
+    try:
+        with open(profile_path, "r", encoding="utf-8") as f:
+            events = json.load(f)
+        if isinstance(events, dict):
+            events = events.get("traceEvents", [])
+    except Exception:
+        return
+
+    spans = []
+    stack = []
+    for e in events:
+        if e.get("ph") == "B":
+            stack.append(e)
+        elif e.get("ph") == "E" and stack:
+            begin = stack.pop()
+            spans.append((begin, e["ts"] - begin["ts"]))
+        elif e.get("ph") == "X":
+            spans.append((e, e.get("dur", 0)))
+    if not spans:
+        return
+
+    base = min(begin["ts"] for begin, _ in spans)
+    tid = trace_thread_id(f"{label} cmake")
+    last_end = configure_start
+    for begin, dur in spans:
+        ts = configure_start + begin["ts"] - base
+        last_end = max(last_end, ts + dur)
+        add_trace_event(
+            begin.get("name", "cmake"),
+            "cmake",
+            ts,
+            dur,
+            tid=tid,
+            args=begin.get("args"),
+        )
+    if configure_end > last_end:
+        add_trace_event(
+            "generate",
+            "phase",
+            last_end,
+            configure_end - last_end,
+            tid=tid,
+            args={"estimated": True},
+        )
+
+
+def new_run_metrics():
+    return {"phases": {}, "objects_rebuilt": None, "fingerprints": []}
+
+
+# 本次运行的统计数据,运行结束后写入构建历史数据库
+_run_metrics = new_run_metrics()
+# 当前线程所属的运行: Python API的每次调用各有一个上下文 {"metrics", "output"},
+# 没有时使用进程级的 _run_metrics 并直接输出到终端
+_run_local = threading.local()
+
+
+def current_run():
+    """返回当前线程所属运行的上下文,不在API调用中时返回None"""
+    return getattr(_run_local, "run", None)
+
+
+def current_run_output():
+    """返回当前运行捕获输出的缓冲区,不捕获时返回None"""
+    run = current_run()
+    return run["output"] if run else None
+
+
+def inherit_run(func):
+    """包装提交到线程池的函数,使工作线程继承提交线程的运行上下文(统计数据和输出捕获)"""
+    run = current_run()
+
+    def wrapper(*args, **kwargs):
+        previous = current_run()
+        _run_local.run = run
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _run_local.run = previous
 
-    if clean_cache:
-        print("清理缓存")
-        if clean_project_cache() != 0:
-            print("清理缓存失败")
-            return 1
+    return wrapper
 
-    # 处理构建目录
-    try:
-        os.makedirs(build_dir, exist_ok=True)
-    except Exception as e:
-        print(f"创建构建目录失败: {build_dir} - {e}")
-        return 1
 
-    # 保存当前目录
-    cwd = os.getcwd()
+class ThreadOutput:
+    """按线程分流的sys.stdout
 
-    try:
-        # 进入构建目录
-        os.chdir(build_dir)
+    属于捕获输出的运行的线程写入该运行的缓冲区,其他线程写入原来的stdout,
+    多个线程同时调用API时各自的输出互不混杂
+    """
 
-        need_configure = True
+    def __init__(self, stream):
+        self.stream = stream
 
-        # 检查是否存在CMake缓存文件
-        if os.path.exists("CMakeCache.txt"):
-            # 尝试获取缓存的构建类型
-            try:
-                with open("CMakeCache.txt", "r", encoding="utf-8") as f:
-                    existing_type = ""
-                    for line in f:
-                        if line.startswith("CMAKE_BUILD_TYPE:STRING"):
-                            parts = line.split("=")
-                            if len(parts) > 1:
-                                existing_type = parts[1].strip()
-                                break
-
-                if existing_type == cmake_build_type:
-                    need_configure = False
-                    print("检测到现有的CMake缓存(构建类型相同),跳过配置阶段")
+    def write(self, text):
+        output = current_run_output()
+        if output is not None:
+            return output.write(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+# 正在捕获输出的运行数,最后一个结束时恢复原来的sys.stdout
+_capture_count = 0
+
+
+@contextmanager
+def run_context(capture_output=False):
+    """在当前线程中开始一次独立的运行,统计数据(和capture_output时的输出)单独记录
+
+    捕获输出期间sys.stdout被替换为ThreadOutput(多个运行共用一个),
+    所有捕获输出的运行结束后恢复原来的sys.stdout
+    """
+    global _capture_count
+    run = {
+        "metrics": new_run_metrics(),
+        "output": io.StringIO() if capture_output else None,
+    }
+    if capture_output:
+        with _trace_lock:
+            if not isinstance(sys.stdout, ThreadOutput):
+                sys.stdout = ThreadOutput(sys.stdout)
+            _capture_count += 1
+    previous = current_run()
+    _run_local.run = run
+    try:
+        yield run
+    finally:
+        _run_local.run = previous
+        if capture_output:
+            with _trace_lock:
+                _capture_count -= 1
+                # 调用方在此期间自己替换了sys.stdout时保留它
+                if _capture_count == 0 and isinstance(sys.stdout, ThreadOutput):
+                    sys.stdout = sys.stdout.stream
+
+
+def record_run_metric(kind, name=None, value=None):
+    """记录本次运行的统计数据
+
+    kind为"phases"时把value(秒)累加到阶段name上;
+    为"objects_rebuilt"时累加重新编译的目标文件数(value为None表示未统计);
+    为"fingerprints"时追加配置指纹
+    """
+    run = current_run()
+    metrics = run["metrics"] if run else _run_metrics
+    with _trace_lock:
+        if kind == "phases":
+            phases = metrics["phases"]
+            phases[name] = phases.get(name, 0.0) + value
+        elif kind == "objects_rebuilt":
+            if value is not None:
+                metrics["objects_rebuilt"] = (metrics["objects_rebuilt"] or 0) + value
+        elif kind == "fingerprints":
+            metrics["fingerprints"].append(value)
+
+
+def count_rebuilt_objects(build_path, ninja_offset, since):
+    """统计本次构建重新编译的目标文件数量,无法廉价统计时返回None
+
+    Ninja构建读取.ninja_log中从ninja_offset开始追加的记录;其他生成器需要遍历并stat
+    整个CMakeFiles目录,只在设置了PYBUILD_COUNT_OBJECTS=1时统计修改时间不早于since的目标文件
+    """
+    if ninja_offset is not None:
+        log_path = os.path.join(build_path, ".ninja_log")
+        try:
+            if os.path.getsize(log_path) < ninja_offset:
+                # ninja重写(压缩)了日志,无法区分本次构建的记录
+                return None
+            with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+                f.seek(ninja_offset)
+                lines = f.read().splitlines()
+        except OSError:
+            return None
+        return sum(
+            1
+            for line in lines
+            if not line.startswith("#")
+            and line.count("\t") >= 3
+            and line.split("\t")[3].endswith((".o", ".obj"))
+        )
+    if os.environ.get("PYBUILD_COUNT_OBJECTS") != "1":
+        return None
+    count = 0
+    for root, _, files in os.walk(os.path.join(build_path, "CMakeFiles")):
+        for name in files:
+            if name.endswith((".o", ".obj")):
+                try:
+                    if os.path.getmtime(os.path.join(root, name)) >= since:
+                        count += 1
+                except OSError:
+                    pass
+    return count
+
+
+def peak_memory_kb():
+    """返回本进程及其子进程中最大的常驻内存(KB),不支持的平台返回None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # macOS上ru_maxrss的单位是字节
+    return peak // 1024 if PLATFORM_MACOS else peak
+
+
+def open_history_db():
+    """打开(必要时创建)构建历史数据库"""
+    import sqlite3
+
+    path = get_cache_dir("history.sqlite")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path, timeout=30)
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project TEXT NOT NULL,
+            command TEXT NOT NULL,
+            args TEXT,
+            started_at REAL,
+            duration REAL,
+            exit_status INTEGER,
+            commit_hash TEXT,
+            config_fingerprint TEXT,
+            phases TEXT,
+            objects_rebuilt INTEGER,
+            peak_memory_kb INTEGER
+        )"""
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS runs_project ON runs (project, command)")
+    # 每个测试最近一次的结果,用于按耗时调度和跳过未改变的已通过测试
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS tests (
+            project TEXT NOT NULL,
+            build_dir TEXT NOT NULL,
+            name TEXT NOT NULL,
+            duration REAL,
+            status TEXT,
+            pass_fingerprint TEXT,
+            finished_at REAL,
+            PRIMARY KEY (project, build_dir, name)
+        )"""
+    )
+    return db
+
+
+def record_history(command, args, started_at, duration, exit_status, project=None, metrics=None):
+    """把一次build/get/install运行写入构建历史(PYBUILD_NO_HISTORY=1时跳过)
+
+    project: 项目目录,默认为当前目录;metrics: 本次运行的统计数据,默认为进程级的统计
+    """
+    import hashlib
+    import json
+
+    if os.environ.get("PYBUILD_NO_HISTORY"):
+        return
+    project = os.path.abspath(project or os.getcwd())
+    metrics = metrics or _run_metrics
+    try:
+        result = run_git(["rev-parse", "HEAD"], cwd=project, quiet=True)
+        commit_hash = result.stdout.strip() if result.returncode == 0 else ""
+    except Exception:
+        commit_hash = ""
+    fingerprints = metrics["fingerprints"]
+    if len(fingerprints) > 1:
+        fingerprint = hashlib.sha256("".join(fingerprints).encode("utf-8")).hexdigest()
+    else:
+        fingerprint = fingerprints[0] if fingerprints else ""
+    try:
+        db = open_history_db()
+        with db:
+            db.execute(
+                """INSERT INTO runs (project, command, args, started_at, duration,
+                exit_status, commit_hash, config_fingerprint, phases,
+                objects_rebuilt, peak_memory_kb)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    project,
+                    command,
+                    " ".join(args),
+                    started_at,
+                    duration,
+                    exit_status,
+                    commit_hash,
+                    fingerprint,
+                    json.dumps(metrics["phases"]),
+                    metrics["objects_rebuilt"],
+                    peak_memory_kb(),
+                ),
+            )
+        db.close()
+    except Exception as e:
+        print(f"警告: 写入构建历史失败: {e}")
+
+
+def percentile(values, p):
+    """返回已排序列表values的第p百分位数(线性插值)"""
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * p / 100.0
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def stats_command(args):
+    """pybuild stats: 显示当前项目的构建耗时趋势、百分位数和耗时突增的运行"""
+    command_filter = None
+    limit = 10
+    csv_path = None
+    i = 2
+    while i < len(args):
+        if args[i] == "--command" and i + 1 < len(args):
+            command_filter = args[i + 1]
+            i += 2
+        elif args[i] in ("-n", "--limit") and i + 1 < len(args):
+            try:
+                limit = int(args[i + 1])
+                if limit < 1:
+                    raise ValueError
+            except ValueError:
+                print(f"错误：无效的显示数量: {args[i + 1]}")
+                return 1
+            i += 2
+        elif args[i] == "--csv" and i + 1 < len(args):
+            csv_path = args[i + 1]
+            i += 2
+        else:
+            print(f"无效参数: {args[i]}")
+            return 1
+
+    try:
+        db = open_history_db()
+        query = "SELECT * FROM runs WHERE project = ?"
+        params = [os.getcwd()]
+        if command_filter:
+            query += " AND command = ?"
+            params.append(command_filter)
+        cursor = db.execute(query + " ORDER BY started_at", params)
+        columns = [c[0] for c in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        db.close()
+    except Exception as e:
+        print(f"读取构建历史失败: {e}")
+        return 1
+
+    if csv_path:
+        import csv
+
+        with open(csv_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"已导出 {len(rows)} 条记录: {csv_path}")
+        return 0
+
+    if not rows:
+        print("当前项目没有构建历史")
+        return 0
+
+    print(f"项目: {os.getcwd()} | 共 {len(rows)} 次运行")
+    print(f"\n最近 {min(limit, len(rows))} 次运行:")
+    print(f"  {'时间':<19} {'命令':<9} {'耗时(s)':>9} {'重编译':>6} {'内存(MB)':>8} {'状态':>4}  提交")
+    for row in rows[-limit:]:
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["started_at"]))
+        memory = f"{row['peak_memory_kb'] / 1024:.0f}" if row["peak_memory_kb"] else "-"
+        rebuilt = "-" if row["objects_rebuilt"] is None else row["objects_rebuilt"]
+        print(
+            f"  {started:<19} {row['command']:<9} {row['duration']:>9.2f} {rebuilt:>6} {memory:>8} {row['exit_status']:>4}  {(row['commit_hash'] or '-')[:10]}"
+        )
+
+    print("\n耗时百分位(仅成功的运行):")
+    for command in sorted(set(row["command"] for row in rows)):
+        durations = sorted(
+            row["duration"]
+            for row in rows
+            if row["command"] == command and row["exit_status"] == 0
+        )
+        if durations:
+            print(
+                f"  {command:<9} 次数 {len(durations):<5} p50 {percentile(durations, 50):.2f}s  p90 {percentile(durations, 90):.2f}s  p99 {percentile(durations, 99):.2f}s  最大 {durations[-1]:.2f}s"
+            )
+
+    # 同一命令相邻两次成功运行之间耗时增加50%以上(且超过1秒)视为突增
+    print("\n耗时突增:")
+    found = False
+    previous = {}
+    for row in rows:
+        if row["exit_status"] != 0:
+            continue
+        prev = previous.get(row["command"])
+        previous[row["command"]] = row
+        if not prev or prev["duration"] <= 0:
+            continue
+        increase = row["duration"] - prev["duration"]
+        if increase > 1.0 and row["duration"] > prev["duration"] * 1.5:
+            found = True
+            reasons = []
+            if row["commit_hash"] != prev["commit_hash"]:
+                reasons.append(
+                    f"提交 {(prev['commit_hash'] or '-')[:10]} -> {(row['commit_hash'] or '-')[:10]}"
+                )
+            if row["config_fingerprint"] != prev["config_fingerprint"]:
+                reasons.append("配置改变")
+            started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["started_at"]))
+            print(
+                f"  {started} {row['command']}: {prev['duration']:.2f}s -> {row['duration']:.2f}s ({', '.join(reasons) or '输入未变'})"
+            )
+    if not found:
+        print("  无")
+    return 0
+
+
+def execute_command(command, cwd=None, log_file=None):
+    """执行命令并检查状态
+
+    cwd: 命令的工作目录,避免修改进程全局的当前目录
+    log_file: 若指定,命令输出写入该文件而不是终端(并发构建时使用)
+    """
+    import subprocess
+
+    print(f"执行命令: {command}")
+    # Python API捕获输出时,子进程的输出也写入本次运行的缓冲区
+    output = current_run_output() if log_file is None else None
+    try:
+        result = subprocess.run(
+            command,
+            shell=True,
+            check=True,
+            text=True,
+            cwd=cwd,
+            stdout=subprocess.PIPE if output is not None else log_file,
+            stderr=subprocess.STDOUT if log_file or output is not None else None,
+        )
+        if output is not None:
+            output.write(result.stdout)
+        return True
+    except subprocess.CalledProcessError as e:
+        if output is not None:
+            output.write(e.stdout or "")
+        print(f"命令执行失败: {e.stderr}")
+        return False
+    except Exception as e:
+        print(f"命令执行错误: {e}")
+        return False
+
+
+# clean --objects 删除的编译产物
+OBJECT_FILE_SUFFIXES = (".o", ".obj", ".gch", ".pch", ".ipch", ".pdb", ".ilk")
+# 整体删除时构建目录先改名为 <构建目录><后缀>-<pid>,再由后台进程删除
+TRASH_SUFFIX = ".pybuild-trash"
+
+
+def clean_targets(build_path, level):
+    """返回指定清理级别要删除的路径列表
+
+    cache: 每个CMake构建目录(含多配置/配置方案子目录)中的CMakeCache.txt、配置指纹和
+           CMakeFiles下除 <目标>.dir 以外的内容,目标文件保留,下次构建重新配置
+    objects: 构建目录中的目标文件和预编译头,配置保留
+    all: 整个构建目录
+    """
+    if level == "all":
+        return [build_path]
+    targets = []
+    for root, dirs, files in os.walk(build_path):
+        if level == "cache":
+            if "CMakeCache.txt" not in files:
+                continue
+            for name in ("CMakeCache.txt", CONFIGURE_FINGERPRINT_FILE):
+                if name in files:
+                    targets.append(os.path.join(root, name))
+            cmake_files = os.path.join(root, "CMakeFiles")
+            if os.path.isdir(cmake_files):
+                for entry in os.scandir(cmake_files):
+                    if not (entry.is_dir(follow_symlinks=False) and entry.name.endswith(".dir")):
+                        targets.append(entry.path)
+        else:
+            targets += [
+                os.path.join(root, name)
+                for name in files
+                if name.endswith(OBJECT_FILE_SUFFIXES)
+            ]
+    return targets
+
+
+def path_size(path):
+    """返回文件或目录(递归,不跟随符号链接)的总字节数"""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return 0
+    if not stat.S_ISDIR(st.st_mode):
+        return st.st_size
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def remove_path(path):
+    """删除一个文件或空目录,Windows上遇到只读文件时去掉只读属性后重试"""
+    remove = os.rmdir if os.path.isdir(path) and not os.path.islink(path) else os.remove
+    try:
+        remove(path)
+    except FileNotFoundError:
+        pass
+    except PermissionError:
+        os.chmod(path, stat.S_IWRITE)
+        remove(path)
+
+
+def remove_tree_parallel(paths, workers=None):
+    """用多个线程删除文件和目录树
+
+    先遍历收集所有文件,按批交给线程池删除(unlink会释放GIL),最后从最深层开始删除空目录
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    files = []
+    dirs = []
+    for path in paths:
+        if os.path.isdir(path) and not os.path.islink(path):
+            for root, dirnames, filenames in os.walk(path):
+                dirs.append(root)
+                files += [os.path.join(root, name) for name in filenames]
+                # 指向目录的符号链接不会被遍历,只删除链接本身
+                files += [
+                    os.path.join(root, name)
+                    for name in dirnames
+                    if os.path.islink(os.path.join(root, name))
+                ]
+        elif os.path.lexists(path):
+            files.append(path)
+
+    def remove_batch(batch):
+        for path in batch:
+            remove_path(path)
+
+    batch_size = 256
+    with ThreadPoolExecutor(max_workers=workers or min(32, get_cpu_count() * 4)) as executor:
+        list(
+            executor.map(
+                remove_batch,
+                [files[i : i + batch_size] for i in range(0, len(files), batch_size)],
+            )
+        )
+    for path in reversed(dirs):
+        remove_path(path)
+
+
+def pybuild_self_command(isolated=False):
+    """返回重新运行pybuild自身的命令(脚本、zipapp或打包后的可执行文件)
+
+    使用本模块自己的路径而不是sys.argv[0]: 通过Python API调用时,
+    sys.argv[0]是调用方的脚本(或pytest等),不能用它重新运行pybuild。
+    isolated: 以Python隔离模式(-I)运行,忽略PYTHONPATH和用户site-packages,交给sudo时使用
+    """
+    if getattr(sys, "frozen", False):
+        return [sys.executable]
+    script = os.path.abspath(__file__)
+    if not os.path.isfile(script):
+        # zipapp中__file__是 <pybuild.pyz>/__main__.py,直接运行.pyz文件
+        script = os.path.dirname(script)
+    return [sys.executable] + (["-I"] if isolated else []) + [script]
+
+
+def purge_in_background(paths):
+    """启动一个脱离当前终端的后台进程删除paths,失败时返回False"""
+    import subprocess
+
+    kwargs = {}
+    if PLATFORM_WINDOWS:
+        kwargs["creationflags"] = 0x00000008 | 0x00000200  # DETACHED_PROCESS | CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    try:
+        subprocess.Popen(
+            pybuild_self_command() + ["clean", "--purge"] + paths,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            close_fds=True,
+            **kwargs,
+        )
+        return True
+    except OSError:
+        return False
+
+
+def clean_project_cache(project_dir=".", level="all", build_dir="build", dry_run=False, background=True):
+    """清理项目缓存
+
+    level: cache(只删除CMake缓存)、objects(只删除目标文件)或 all(整个构建目录)
+    dry_run: 只报告各级别能释放的空间,不删除
+    background: all级别时把构建目录改名后交给后台进程删除,命令立即返回
+    """
+    build_path = os.path.join(project_dir, build_dir)
+
+    try:
+        # 检查build目录是否存在
+        if not os.path.exists(build_path):
+            print(f"{build_dir}目录不存在,无需清理")
+            if not dry_run:
+                os.makedirs(build_path, exist_ok=True)
+            return 0
+
+        if dry_run:
+            print(f"清理 {build_path} 可释放的空间(未删除任何文件):")
+            for name in ("cache", "objects", "all"):
+                targets = clean_targets(build_path, name)
+                size = sum(path_size(path) for path in targets)
+                print(f"  --{name:<9}{format_size(size):>12}  ({len(targets)} 项)")
+            return 0
+
+        targets = clean_targets(build_path, level)
+        if level == "all":
+            # 同一文件系统内改名是瞬时的,新的空构建目录可以立即使用
+            parent = os.path.dirname(os.path.abspath(build_path))
+            trash = f"{os.path.abspath(build_path)}{TRASH_SUFFIX}-{os.getpid()}-{int(time.time())}"
+            # 以前的后台删除中断时留下的目录一起删除
+            prefix = os.path.basename(os.path.abspath(build_path)) + TRASH_SUFFIX
+            leftovers = [
+                os.path.join(parent, name)
+                for name in os.listdir(parent)
+                if name.startswith(prefix)
+            ]
+            try:
+                os.rename(build_path, trash)
+                targets = [trash] + leftovers
+            except OSError:
+                # Windows上文件被占用时无法改名,直接删除
+                background = False
+            os.makedirs(build_path, exist_ok=True)
+            if background and purge_in_background(targets):
+                print(f"清理成功,旧构建目录在后台删除: {trash}")
+                return 0
+
+        remove_tree_parallel(targets)
+        if level == "all":
+            os.makedirs(build_path, exist_ok=True)
+        print(f"清理成功({level}, {len(targets)} 项)")
+        return 0
+    except Exception as e:
+        print(f"清理缓存失败: {e}")
+        return 1
+
+
+def clean_command(args):
+    """pybuild clean [--cache|--objects|--all] [-b 目录] [--dry-run]"""
+    level = "all"
+    build_dir = "build"
+    dry_run = False
+    background = True
+    i = 2
+    while i < len(args):
+        arg = args[i]
+        if arg in ("--cache", "--objects", "--all"):
+            level = arg[2:]
+        elif (arg == "-b" or arg == "--build-dir") and i + 1 < len(args):
+            i += 1
+            build_dir = args[i]
+        elif arg == "--dry-run":
+            dry_run = True
+        elif arg == "--wait":
+            background = False
+        elif arg == "--purge":
+            # 内部使用: 后台进程删除改名后的构建目录
+            remove_tree_parallel(args[i + 1 :])
+            return 0
+        else:
+            print(f"未知参数: {arg}")
+            return 1
+        i += 1
+    return clean_project_cache(
+        level=level, build_dir=build_dir, dry_run=dry_run, background=background
+    )
+
+
+def get_cpu_count():
+    """获取CPU核心数,失败时返回1"""
+    try:
+        import multiprocessing
+
+        return multiprocessing.cpu_count()
+    except:
+        return 1
+
+
+class JobBudget:
+    """全局编译任务预算
+
+    多个并发构建共享同一组编译槽位,每次构建申请若干槽位,
+    `cmake --build` 的并行数即为申请到的槽位数,避免机器超负荷。
+    total: 槽位总数(通常为CPU核心数)
+    workers: 同时构建的数量,用于计算每个构建的公平份额
+    """
+
+    def __init__(self, total, workers=1):
+        self.total = max(1, total)
+        self.available = self.total
+        self.share = max(1, self.total // max(1, workers))
+        self.cond = threading.Condition()
+
+    def acquire(self, wanted=None):
+        """申请最多wanted个槽位(默认为公平份额),至少有一个空闲槽位时返回实际获得的数量"""
+        if wanted is None:
+            wanted = self.share
+        with self.cond:
+            while self.available == 0:
+                self.cond.wait()
+            granted = max(1, min(wanted, self.available))
+            self.available -= granted
+            return granted
+
+    def release(self, granted):
+        """归还槽位"""
+        with self.cond:
+            self.available += granted
+            self.cond.notify_all()
+
+
+def get_cache_dir(*parts):
+    """返回pybuild的缓存目录(可通过环境变量PYBUILD_CACHE_DIR覆盖)"""
+    root = os.environ.get("PYBUILD_CACHE_DIR")
+    if not root:
+        if PLATFORM_WINDOWS:
+            root = os.path.join(
+                os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "pybuild"
+            )
+        else:
+            root = os.path.join(
+                os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                "pybuild",
+            )
+    return os.path.join(root, *parts)
+
+
+# 工具链探测涉及的工具: 名称 -> 候选可执行文件名
+TOOLCHAIN_TOOLS = {
+    "cmake": ["cmake"],
+    "ninja": ["ninja", "ninja-build"],
+    "make": ["mingw32-make", "make"] if PLATFORM_WINDOWS else ["make", "gmake"],
+    "gcc": ["gcc"],
+    "g++": ["g++"],
+    "clang": ["clang"],
+    "clang++": ["clang++"],
+}
+_toolchain = None
+
+
+def tool_version(path):
+    """执行 `<工具> --version`,返回 (第一行输出, 版本号)"""
+    import re
+    import subprocess
+
+    try:
+        result = subprocess.run(
+            [path, "--version"], capture_output=True, text=True, timeout=30
+        )
+        first_line = (result.stdout or result.stderr).strip().splitlines()[0]
+    except Exception:
+        return "", ""
+    match = re.search(r"\d+\.\d+(\.\d+)?", first_line)
+    return first_line, match.group(0) if match else ""
+
+
+def version_at_least(version, minimum):
+    """比较 x.y.z 形式的版本号"""
+    try:
+        return tuple(int(p) for p in version.split(".")[:3]) >= tuple(
+            int(p) for p in minimum.split(".")
+        )
+    except ValueError:
+        return False
+
+
+def probe_toolchain(refresh=False):
+    """探测可用的生成器和编译器(路径与版本),结果缓存在磁盘上
+
+    缓存键由PATH以及各工具的路径和修改时间组成,只有安装/升级工具或
+    修改PATH后才会重新执行版本查询子进程。
+    """
+    import hashlib
+    import json
+    import shutil
+
+    global _toolchain
+    if _toolchain is not None and not refresh:
+        return _toolchain
+
+    tools = {}
+    for name, candidates in TOOLCHAIN_TOOLS.items():
+        for exe in candidates:
+            path = shutil.which(exe)
+            if path:
+                tools[name] = {"path": path, "mtime": os.path.getmtime(path)}
+                break
+    key = hashlib.sha256(
+        json.dumps([os.environ.get("PATH", ""), tools], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+    cache_path = get_cache_dir("toolchain.json")
+    if not refresh:
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("key") == key:
+                _toolchain = cached
+                return _toolchain
+        except Exception:
+            pass
+
+    for info in tools.values():
+        info["id"], info["version"] = tool_version(info["path"])
+    _toolchain = {"key": key, "tools": tools}
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(_toolchain, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        print(f"警告: 写入工具链缓存失败: {e}")
+    return _toolchain
+
+
+def select_generator(setting="auto"):
+    """选择CMake生成器,返回生成器名称;返回None表示使用CMake默认生成器
+
+    setting: "auto"(安装了Ninja时优先使用)、"ninja"、"make",或完整的CMake生成器名称
+    """
+    tools = probe_toolchain()["tools"]
+    default = "MinGW Makefiles" if PLATFORM_WINDOWS else None
+    setting = setting or "auto"
+    if setting == "auto":
+        return "Ninja" if "ninja" in tools else default
+    if setting.lower() == "ninja":
+        if "ninja" not in tools:
+            print("警告: 未找到ninja,使用默认生成器")
+            return default
+        return "Ninja"
+    if setting.lower() == "make":
+        return "MinGW Makefiles" if PLATFORM_WINDOWS else "Unix Makefiles"
+    return setting
+
+
+def select_compiler(setting="auto"):
+    """选择编译器,返回 (名称, C编译器, C++编译器)
+
+    setting: "auto"(优先gcc,其次clang)、"gcc" 或 "clang"
+    """
+    tools = probe_toolchain()["tools"]
+    pairs = {"gcc": ("gcc", "g++"), "clang": ("clang", "clang++")}
+    setting = setting or "auto"
+    if setting == "auto":
+        candidates = ["gcc", "clang"]
+    elif setting in pairs:
+        candidates = [setting]
+    else:
+        print(f"警告: 不支持的编译器 {setting},使用gcc")
+        candidates = ["gcc"]
+    for name in candidates:
+        c, cxx = pairs[name]
+        if c in tools and cxx in tools:
+            return name, tools[c]["path"], tools[cxx]["path"]
+    # 未探测到时保持原有行为,交给CMake在PATH中查找
+    name = candidates[0]
+    return name, pairs[name][0], pairs[name][1]
+
+
+def toolchain_command(args):
+    """pybuild toolchain [--refresh]: 显示探测到的工具链"""
+    refresh = "--refresh" in args[2:]
+    toolchain = probe_toolchain(refresh=refresh)
+    print(f"工具链缓存: {get_cache_dir('toolchain.json')}")
+    for name in TOOLCHAIN_TOOLS:
+        info = toolchain["tools"].get(name)
+        if info:
+            print(f"  {name:<8} {info['version']:<10} {info['path']}")
+        else:
+            print(f"  {name:<8} 未找到")
+    generator = select_generator("auto") or "CMake默认"
+    compiler = select_compiler("auto")[0]
+    print(f"默认生成器: {generator} | 默认编译器: {compiler}")
+    return 0
+
+
+def read_cmake_cache(build_path):
+    """读取构建目录中的CMakeCache.txt,返回 {变量名: 值};不存在时返回空字典"""
+    entries = {}
+    with open(os.path.join(build_path, "CMakeCache.txt"), "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith(("#", "//")) or "=" not in line:
+                continue
+            name_type, value = line.rstrip("\n").split("=", 1)
+            entries[name_type.split(":", 1)[0]] = value.strip()
+    return entries
+
+
+# 影响CMake配置结果的环境变量
+CONFIGURE_ENV_VARS = [
+    "CC",
+    "CXX",
+    "CFLAGS",
+    "CXXFLAGS",
+    "CPPFLAGS",
+    "LDFLAGS",
+    "CMAKE_PREFIX_PATH",
+    "CMAKE_GENERATOR",
+    "CMAKE_TOOLCHAIN_FILE",
+    "PKG_CONFIG_PATH",
+    "PKG_CONFIG_LIBDIR",
+]
+CONFIGURE_FINGERPRINT_FILE = "pybuild-configure.json"
+
+
+def file_digest(path):
+    """返回文件内容的sha256,文件不存在时返回空字符串"""
+    import hashlib
+
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return ""
+
+
+def configure_inputs(project_dir, cmake_command, toolchain):
+    """收集决定CMake配置结果的全部输入
+
+    包括完整的cmake参数、工具链版本、CMakeLists.txt、CMake.json和源文件列表的内容哈希,
+    以及CONFIGURE_ENV_VARS中的环境变量。
+    """
+    import shlex
+
+    return {
+        "cmake_args": shlex.split(cmake_command, posix=not PLATFORM_WINDOWS),
+        "toolchain": toolchain,
+        "files": {
+            name: file_digest(os.path.join(project_dir, name))
+            for name in ["CMakeLists.txt", "CMake.json", SOURCE_LIST_FILE]
+        },
+        "env": {name: os.environ.get(name, "") for name in CONFIGURE_ENV_VARS},
+    }
+
+
+def load_configure_inputs(build_path):
+    """读取上次成功配置时保存的配置输入,不存在时返回None"""
+    import json
+
+    try:
+        with open(
+            os.path.join(build_path, CONFIGURE_FINGERPRINT_FILE), "r", encoding="utf-8"
+        ) as f:
+            return json.load(f)["inputs"]
+    except Exception:
+        return None
+
+
+def configure_fingerprint(inputs):
+    """计算配置输入的指纹"""
+    import hashlib
+    import json
+
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def save_configure_inputs(build_path, inputs):
+    """保存配置输入及其指纹"""
+    import json
+
+    fingerprint = configure_fingerprint(inputs)
+    with open(
+        os.path.join(build_path, CONFIGURE_FINGERPRINT_FILE), "w", encoding="utf-8"
+    ) as f:
+        json.dump(
+            {"fingerprint": fingerprint, "inputs": inputs},
+            f,
+            indent=2,
+            ensure_ascii=False,
+        )
+
+
+def explain_configure_changes(old, new):
+    """比较两次配置输入,返回描述变化的字符串列表;完全相同时返回空列表"""
+    if old is None:
+        return ["没有上次配置的指纹"]
+    changes = []
+    if old.get("cmake_args") != new["cmake_args"]:
+        old_args = old.get("cmake_args", [])
+        removed = [a for a in old_args if a not in new["cmake_args"]]
+        added = [a for a in new["cmake_args"] if a not in old_args]
+        detail = ", ".join([f"移除 {a}" for a in removed] + [f"新增 {a}" for a in added])
+        changes.append(f"cmake参数: {detail or '顺序改变'}")
+    for name, value in new["toolchain"].items():
+        if old.get("toolchain", {}).get(name) != value:
+            changes.append(
+                f"工具链 {name}: {old.get('toolchain', {}).get(name)} -> {value}"
+            )
+    for name, digest in new["files"].items():
+        if old.get("files", {}).get(name) != digest:
+            changes.append(f"文件 {name} 内容已改变")
+    for name, value in new["env"].items():
+        if old.get("env", {}).get(name, "") != value:
+            changes.append(
+                f"环境变量 {name}: '{old.get('env', {}).get(name, '')}' -> '{value}'"
+            )
+    return changes
+
+
+def detect_compiler_launcher(setting="auto"):
+    """查找编译器缓存工具,返回 (名称, 路径),未找到或已禁用时返回 (None, None)
+
+    setting: "auto"(优先ccache,其次sccache)、"ccache"、"sccache",
+    或 "none"/False 表示不使用编译器缓存
+    """
+    import shutil
+
+    if setting in (False, None, "none", "off", "false"):
+        return None, None
+    candidates = ["ccache", "sccache"] if setting in (True, "auto") else [setting]
+    for name in candidates:
+        path = shutil.which(name)
+        if path:
+            return name, path
+    if setting not in (True, "auto"):
+        print(f"警告: 未找到编译器缓存工具 {setting}")
+    return None, None
+
+
+def compiler_cache_stats(name, path):
+    """读取编译器缓存的累计统计,返回 (命中数, 未命中数),失败时返回None"""
+    import json
+    import subprocess
+
+    try:
+        if name == "sccache":
+            result = subprocess.run(
+                [path, "--show-stats", "--stats-format=json"],
+                capture_output=True,
+                text=True,
+            )
+            stats = json.loads(result.stdout)["stats"]
+            hits = sum(stats.get("cache_hits", {}).get("counts", {}).values())
+            misses = sum(stats.get("cache_misses", {}).get("counts", {}).values())
+            return hits, misses
+
+        result = subprocess.run(
+            [path, "--print-stats"], capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            return None
+        values = {}
+        for line in result.stdout.splitlines():
+            parts = line.split("\t")
+            if len(parts) == 2 and parts[1].strip().isdigit():
+                values[parts[0]] = int(parts[1])
+        # ccache 4.x 与 3.7 的字段名不同
+        hits = (
+            values.get("direct_cache_hit", values.get("cache_hit_direct", 0))
+            + values.get("preprocessed_cache_hit", values.get("cache_hit_preprocessed", 0))
+        )
+        misses = values.get("cache_miss", 0)
+        return hits, misses
+    except Exception:
+        return None
+
+
+def print_compiler_cache_report(name, before, after):
+    """输出本次构建的编译器缓存命中情况"""
+    if before is None or after is None:
+        return
+    hits = after[0] - before[0]
+    misses = after[1] - before[1]
+    total = hits + misses
+    if total <= 0:
+        print(f"编译器缓存({name}): 没有编译任何源文件")
+        return
+    print(
+        f"编译器缓存({name}): 命中 {hits}, 未命中 {misses}, 命中率 {hits * 100.0 / total:.1f}%"
+    )
+
+
+def build_project(
+    args,
+    project_dir=".",
+    job_budget=None,
+    log_file=None,
+    output_suffix="",
+    build_info=None,
+):
+    """构建项目
+
+    project_dir: 项目根目录,所有命令通过cwd在该目录下执行,不修改进程当前目录
+    job_budget: 共享的JobBudget,为None时使用全部CPU核心
+    log_file: 并发构建时命令输出写入的日志文件
+    output_suffix: 多配置构建时各配置产物的输出子目录(如 /Debug)
+    build_info: 若指定(字典),在其中的列表 build_paths、output_suffixes 和 logs 中
+                追加实际使用的构建目录(构建失败时也追加)、构建成功的产物输出子目录和日志文件
+                (多配置和PGO构建同样适用)
+    """
+    import shutil
+
+    cmake_build_type = "Debug"
+    build_types = []
+    # 多配置构建时需要从子构建中去掉的参数位置
+    multi_config_args = set()
+    make_install_prefix = ""
+    build_dir = "build"
+    additional_flags = ""
+    configure_only = False
+    clean_cache = False
+    build_test = False
+    force_configure = False
+    explain_configure = False
+    profile_name = None
+    build_dir_set = False
+    lto = False
+    pgo = False
+    pgo_retrain = False
+    training_command = []
+    # PGO各阶段子构建需要去掉的参数位置
+    pgo_args = set()
+    config = read_cmake_json(project_dir)
+    compiler_cache = config.get("compiler_cache", "auto")
+    generator_setting = config.get("generator", "auto")
+    compiler_setting = config.get("compiler", "auto")
+    unity = unity_settings(config.get("unity"))
+
+    # 设置默认安装路径
+    if PLATFORM_WINDOWS:
+        make_install_prefix = ".\\install"  # Windows默认安装路径
+    else:
+        make_install_prefix = "/usr/local"
+
+    # 解析命令行参数
+    i = 2  # args[0]是程序名，args[1]是"build"
+    while i < len(args):
+        arg = args[i]
+        if arg == "-d" or arg == "--debug":
+            build_types.append("Debug")
+            multi_config_args.add(i)
+            i += 1
+        elif arg == "-r" or arg == "--release":
+            build_types.append("Release")
+            multi_config_args.add(i)
+            i += 1
+        elif arg == "--configs":
+            if i + 1 < len(args) and not args[i + 1].startswith("-"):
+                multi_config_args.update([i, i + 1])
+                i += 1
+                build_types.extend(t.strip() for t in args[i].split(",") if t.strip())
+            else:
+                print("错误：未指定构建配置")
+                return 1
+            i += 1
+        elif arg == "-p" or arg == "--prefix":
+            if i + 1 < len(args) and not args[i + 1].startswith("-"):
+                i += 1
+                make_install_prefix = args[i]
+            else:
+                print("错误：未指定安装目录,使用默认安装目录")
+                if PLATFORM_WINDOWS:
+                    make_install_prefix = ".\\install"
                 else:
+                    make_install_prefix = "/usr/local"
+            i += 1
+        elif arg == "-c" or arg == "--configure-only":
+            configure_only = True
+            i += 1
+        elif arg == "-b" or arg == "--build-dir":
+            if i + 1 < len(args) and not args[i + 1].startswith("-"):
+                multi_config_args.update([i, i + 1])
+                i += 1
+                build_dir = args[i]
+                build_dir_set = True
+            else:
+                print("错误：未指定构建目录")
+                return 1
+            i += 1
+        elif arg == "-t" or arg == "--test":
+            build_test = True
+            i += 1
+        elif arg == "-C" or arg == "--clean-cache":
+            clean_cache = True
+            multi_config_args.add(i)
+            pgo_args.add(i)
+            i += 1
+        elif arg == "--no-compiler-cache":
+            compiler_cache = "none"
+            i += 1
+        elif arg == "--reconfigure":
+            force_configure = True
+            i += 1
+        elif arg == "--explain-configure":
+            explain_configure = True
+            i += 1
+        elif arg == "--unity" or arg.startswith("--unity="):
+            try:
+                batch_size = parse_unity_arg(arg)
+            except ValueError:
+                print(f"错误：无效的Unity批大小: {arg}")
+                return 1
+            unity["enabled"] = True
+            if batch_size:
+                unity["batch_size"] = batch_size
+            i += 1
+        elif arg == "--no-unity":
+            unity["enabled"] = False
+            i += 1
+        elif arg == "--lto":
+            lto = True
+            i += 1
+        elif arg == "--profile":
+            if i + 1 < len(args) and not args[i + 1].startswith("-"):
+                i += 1
+                profile_name = args[i]
+            else:
+                print("错误：未指定构建配置方案")
+                return 1
+            i += 1
+        elif arg == "--pgo" or arg == "--pgo-retrain":
+            pgo = True
+            pgo_retrain = pgo_retrain or arg == "--pgo-retrain"
+            pgo_args.add(i)
+            i += 1
+        elif arg == "--":
+            # 之后的参数是PGO的训练命令
+            training_command = args[i + 1 :]
+            pgo_args.update(range(i, len(args)))
+            break
+        elif arg == "-G" or arg == "--generator":
+            if i + 1 < len(args) and not args[i + 1].startswith("-"):
+                i += 1
+                generator_setting = args[i]
+            else:
+                print("错误：未指定生成器")
+                return 1
+            i += 1
+        elif arg == "--compiler":
+            if i + 1 < len(args) and not args[i + 1].startswith("-"):
+                i += 1
+                compiler_setting = args[i]
+            else:
+                print("错误：未指定编译器")
+                return 1
+            i += 1
+        elif arg == "--compiler-cache":
+            if i + 1 < len(args) and not args[i + 1].startswith("-"):
+                i += 1
+                compiler_cache = args[i]
+            else:
+                compiler_cache = "auto"
+            i += 1
+        else:
+            # 收集额外的CMake参数
+            if additional_flags:
+                additional_flags += " "
+            additional_flags += arg
+            i += 1
+
+    # 构建配置方案: 命令行中的构建类型和构建目录优先
+    profile = {}
+    if profile_name:
+        profiles = config.get("profiles", {})
+        if profile_name not in profiles:
+            print(f"错误：CMake.json中没有构建配置方案 {profile_name}")
+            if profiles:
+                print("可用的配置方案: " + ", ".join(profiles))
+            return 1
+        profile = profiles[profile_name]
+        if not build_types and profile.get("build_type"):
+            build_types.append(profile["build_type"])
+        if not build_dir_set:
+            # 每个配置方案使用独立的构建目录,切换方案不会使其他目录重新配置
+            build_dir = profile.get("build_dir", os.path.join(build_dir, profile_name))
+        # 产物输出到 bin/<方案> 等子目录,各方案的产物互不覆盖
+        output_suffix = f"/{profile_name}{output_suffix}"
+        print(f"构建配置方案: {profile_name} | 构建目录: {build_dir}")
+
+    # 去重并保持顺序,多个配置时每个配置使用独立的构建目录并发构建
+    build_types = list(dict.fromkeys(build_types))
+    if len(build_types) == 1:
+        cmake_build_type = build_types[0]
+
+    if clean_cache:
+        print("清理缓存")
+        with trace_span("clean", "phase", project=project_dir):
+            if clean_project_cache(project_dir) != 0:
+                print("清理缓存失败")
+                return 1
+
+    if pgo:
+        if len(build_types) > 1:
+            print("错误：--pgo 不能同时构建多个配置")
+            return 1
+        if not training_command:
+            print("错误：--pgo 需要在 -- 之后指定训练命令,如 pybuild build --pgo -- ./bin/app --bench")
+            return 1
+        child_args = [args[k] for k in range(len(args)) if k not in pgo_args]
+        return build_pgo(
+            child_args,
+            training_command,
+            build_types[0] if build_types else "Release",
+            build_dir,
+            compiler_setting,
+            pgo_retrain,
+            project_dir,
+            job_budget,
+            build_info,
+        )
+    elif training_command:
+        print("警告: 未指定 --pgo,忽略 -- 之后的参数")
+
+    if len(build_types) > 1:
+        child_args = [
+            args[k] for k in range(len(args)) if k not in multi_config_args
+        ]
+        return build_configurations(
+            child_args, build_types, build_dir, project_dir, job_budget, build_info
+        )
+
+    print(f"构建模式: {cmake_build_type} | 安装路径: {make_install_prefix}")
+
+    # 处理构建目录
+    build_path = os.path.join(project_dir, build_dir)
+    try:
+        os.makedirs(build_path, exist_ok=True)
+    except Exception as e:
+        print(f"创建构建目录失败: {build_dir} - {e}")
+        return 1
+    if build_info is not None:
+        build_info.setdefault("build_paths", []).append(build_path)
+
+    # 生成器与编译器
+    generator = select_generator(generator_setting)
+    compiler_name, c_compiler, cxx_compiler = select_compiler(compiler_setting)
+    print(f"生成器: {generator or 'CMake默认'} | 编译器: {compiler_name} ({cxx_compiler})")
+
+    # 编译器缓存(ccache/sccache)
+    launcher_name, launcher_path = detect_compiler_launcher(compiler_cache)
+    if launcher_name:
+        print(f"使用编译器缓存: {launcher_name} ({launcher_path})")
+        launcher_flags = f'-DCMAKE_C_COMPILER_LAUNCHER="{launcher_path}" -DCMAKE_CXX_COMPILER_LAUNCHER="{launcher_path}"'
+    else:
+        launcher_flags = "-UCMAKE_C_COMPILER_LAUNCHER -UCMAKE_CXX_COMPILER_LAUNCHER"
+
+    # Unity构建: 每次都显式传入,避免上一次 --unity 留在CMake缓存中
+    if cmakelists_contains(project_dir, "PYBUILD_UNITY_BUILD"):
+        if unity["enabled"]:
+            print(f"Unity构建: 开启 (每批 {unity['batch_size']} 个源文件)")
+        if additional_flags:
+            additional_flags += " "
+        additional_flags += f"-DPYBUILD_UNITY_BUILD={'ON' if unity['enabled'] else 'OFF'} -DPYBUILD_UNITY_BATCH_SIZE={int(unity['batch_size'])}"
+    elif unity["enabled"]:
+        print("警告: CMakeLists.txt不支持Unity构建,请运行 init 重新生成CMakeLists.txt")
+
+    # 构建配置方案的C++标准、编译/链接选项和宏,每次显式传入
+    if cmakelists_contains(project_dir, "PYBUILD_CXX_STANDARD"):
+        cxx_standard = profile.get(
+            "cxx_standard",
+            config.get("project", {}).get("cxx_standard", DEFAULT_CXX_STANDARD),
+        )
+        defines = ";".join(str(d) for d in profile.get("defines", []))
+        if additional_flags:
+            additional_flags += " "
+        additional_flags += f'-DPYBUILD_CXX_STANDARD={cxx_standard} -DPYBUILD_CXX_FLAGS="{profile_flags(profile.get("flags"))}" -DPYBUILD_LINK_FLAGS="{profile_flags(profile.get("link_flags"))}" -DPYBUILD_DEFINES="{defines}"'
+    elif profile:
+        print("警告: CMakeLists.txt不支持构建配置方案,请运行 init 重新生成CMakeLists.txt")
+
+    # 链接时优化: 同样每次显式传入
+    if cmakelists_contains(project_dir, "PYBUILD_LTO"):
+        if lto:
+            print("链接时优化(LTO): 开启")
+        if additional_flags:
+            additional_flags += " "
+        additional_flags += f"-DPYBUILD_LTO={'ON' if lto else 'OFF'}"
+    elif lto:
+        print("警告: CMakeLists.txt不支持LTO,请运行 init 重新生成CMakeLists.txt")
+
+    # 多配置构建时把产物输出到各自的子目录
+    if output_suffix:
+        if additional_flags:
+            additional_flags += " "
+        additional_flags += f'-DPYBUILD_OUTPUT_SUFFIX="{output_suffix}"'
+
+    # 构建配置命令
+    source_dir = os.path.relpath(project_dir, build_path)
+    generator_flag = f'-G "{generator}" ' if generator else ""
+    if PLATFORM_WINDOWS:
+        # Windows路径处理
+        escaped_prefix = make_install_prefix.replace("\\", "\\\\")
+        cmake_command = f'cmake "{source_dir}" {generator_flag}-DCMAKE_BUILD_TYPE={cmake_build_type} -DCMAKE_INSTALL_PREFIX="{escaped_prefix}" -DCMAKE_C_COMPILER="{c_compiler}" -DCMAKE_CXX_COMPILER="{cxx_compiler}" {launcher_flags} {"" if build_test else "-DBUILD_TESTING=OFF"} {additional_flags}'
+    else:
+        cmake_command = f'cmake "{source_dir}" {generator_flag}-DCMAKE_BUILD_TYPE={cmake_build_type} -DCMAKE_INSTALL_PREFIX="{make_install_prefix}" -DCMAKE_C_COMPILER="{c_compiler}" -DCMAKE_CXX_COMPILER="{cxx_compiler}" {launcher_flags} {"" if build_test else "-DBUILD_TESTING=OFF"} {additional_flags}'
+
+    trace_label = f"{os.path.basename(os.path.abspath(project_dir))} {cmake_build_type}"
+
+    # 更新自动发现的源文件列表(只有增删文件时才会改写,进而触发重新配置)
+    if cmakelists_contains(project_dir, "pybuild_sources.cmake"):
+        with trace_span("discover sources", "phase", project=trace_label):
+            try:
+                discover_sources(project_dir)
+            except OSError as e:
+                print(f"扫描源文件失败: {e}")
+                return 1
+
+    tools = probe_toolchain()["tools"]
+    inputs = configure_inputs(
+        project_dir,
+        cmake_command,
+        {
+            "generator": generator or "",
+            "compiler": compiler_name,
+            "compiler_version": tools.get(
+                "g++" if compiler_name == "gcc" else "clang++", {}
+            ).get("version", ""),
+            "cmake_version": tools.get("cmake", {}).get("version", ""),
+        },
+    )
+
+    try:
+        need_configure = True
+
+        # 检查是否存在CMake缓存文件
+        cache_file = os.path.join(build_path, "CMakeCache.txt")
+        if force_configure:
+            print("指定了--reconfigure,强制重新配置")
+        elif os.path.exists(cache_file):
+            # 比较配置指纹,只有配置输入改变时才重新配置
+            try:
+                cache = read_cmake_cache(build_path)
+                existing_generator = cache.get("CMAKE_GENERATOR", "")
+                existing_compiler = cache.get("CMAKE_CXX_COMPILER", "")
+                cxx_path = shutil.which(cxx_compiler) or cxx_compiler
+
+                if (generator and existing_generator != generator) or (
+                    existing_compiler
+                    and os.path.realpath(existing_compiler) != os.path.realpath(cxx_path)
+                ):
+                    # 生成器或编译器改变时CMake不能复用旧缓存,需要删除后重新配置
                     print(
-                        f"构建类型从 {existing_type} 变为 {cmake_build_type},需要重新配置"
+                        f"生成器/编译器从 {existing_generator}/{existing_compiler} 变为 {generator or 'CMake默认'}/{cxx_compiler},清除CMake缓存后重新配置"
                     )
-                    need_configure = True
+                    os.remove(cache_file)
+                    shutil.rmtree(
+                        os.path.join(build_path, "CMakeFiles"), ignore_errors=True
+                    )
+                else:
+                    changes = explain_configure_changes(
+                        load_configure_inputs(build_path), inputs
+                    )
+                    if not changes:
+                        need_configure = False
+                        print("配置指纹未改变,跳过配置阶段")
+                    elif explain_configure:
+                        print("以下配置输入已改变,需要重新配置:")
+                        for change in changes:
+                            print(f"  {change}")
+                    else:
+                        print(
+                            f"配置输入已改变({changes[0]}{' 等' if len(changes) > 1 else ''}),需要重新配置"
+                        )
             except Exception as e:
                 print(f"读取CMake缓存失败: {e}")
                 need_configure = True
@@ -955,69 +3242,1221 @@ def build_project(args):
 
         # 配置阶段
         if need_configure:
-            # 构建配置命令
-            if PLATFORM_WINDOWS:
-                # Windows路径处理
-                escaped_prefix = make_install_prefix.replace("\\", "\\\\")
-                cmake_command = f'cmake .. -G "MinGW Makefiles" -DCMAKE_BUILD_TYPE={cmake_build_type} -DCMAKE_INSTALL_PREFIX="{escaped_prefix}" -DCMAKE_C_COMPILER=gcc -DCMAKE_CXX_COMPILER=g++ {"" if build_test else "-DBUILD_TESTING=OFF"} {additional_flags}'
+            # 配置失败时旧指纹已失效
+            fingerprint_file = os.path.join(build_path, CONFIGURE_FINGERPRINT_FILE)
+            if os.path.exists(fingerprint_file):
+                os.remove(fingerprint_file)
+
+            print(f"配置CMake: {cmake_command}")
+            # 追踪时让CMake输出配置阶段的性能数据(CMake 3.18+),不计入配置指纹
+            profile_path = os.path.join(build_path, "pybuild-cmake-profile.json")
+            if trace_enabled() and version_at_least(
+                probe_toolchain()["tools"].get("cmake", {}).get("version", ""), "3.18"
+            ):
+                cmake_command += f' --profiling-format=google-trace --profiling-output="{os.path.abspath(profile_path)}"'
+            configure_start = trace_now() if trace_enabled() else 0
+            with trace_span("configure", "phase", project=trace_label):
+                ok = execute_command(cmake_command, cwd=build_path, log_file=log_file)
+            if trace_enabled() and os.path.exists(profile_path):
+                trace_cmake_profile(
+                    profile_path, configure_start, trace_now(), trace_label
+                )
+                os.remove(profile_path)
+            if not ok:
+                print("CMake配置失败")
+                return 1
+            save_configure_inputs(build_path, inputs)
+
+        record_run_metric("fingerprints", value=configure_fingerprint(inputs))
+
+        # 构建阶段
+        if not configure_only:
+            core_count = get_cpu_count()
+            granted = 0
+            if job_budget is not None:
+                # 从共享预算中申请槽位,并行数不超过预算分配的数量
+                with trace_span("wait for jobs", "phase", project=trace_label):
+                    granted = job_budget.acquire()
+                core_count = granted
+            build_tool = f"cmake --build . --parallel {core_count}"
+
+            stats_before = (
+                compiler_cache_stats(launcher_name, launcher_path) if launcher_name else None
+            )
+            # 首次构建时还没有.ninja_log,从头读取
+            ninja_offset = (ninja_log_size(build_path) or 0) if generator == "Ninja" else None
+            build_start = trace_now() if trace_enabled() else 0
+            build_wall_start = time.time()
+            try:
+                print(f"构建中: {build_tool}")
+                with trace_span("build", "phase", project=trace_label, jobs=core_count):
+                    ok = execute_command(build_tool, cwd=build_path, log_file=log_file)
+                if trace_enabled() and generator == "Ninja":
+                    trace_ninja_log(build_path, ninja_offset, build_start, trace_label)
+                record_run_metric(
+                    "objects_rebuilt",
+                    value=count_rebuilt_objects(build_path, ninja_offset, build_wall_start),
+                )
+                if not ok:
+                    print("构建失败")
+                    return 1
+            finally:
+                if granted:
+                    job_budget.release(granted)
+            if launcher_name:
+                print_compiler_cache_report(
+                    launcher_name,
+                    stats_before,
+                    compiler_cache_stats(launcher_name, launcher_path),
+                )
+
+            # -t: 构建成功后运行测试
+            if build_test:
+                print("\n运行测试...")
+                with trace_span("test", "phase", project=trace_label):
+                    if run_tests(build_path, project_dir=project_dir) != 0:
+                        return 1
+
+        if build_info is not None:
+            build_info.setdefault("output_suffixes", []).append(output_suffix)
+        print(f"\n构建{'配置' if configure_only else ''}成功!")
+        return 0
+    except Exception as e:
+        print(f"构建项目失败: {e}")
+        return 1
+
+
+def build_configurations(
+    args, build_types, build_dir, project_dir=".", job_budget=None, build_info=None
+):
+    """并发构建多个配置,每个配置使用 <构建目录>/<配置> 并共享同一个编译任务预算
+
+    args: 已去掉构建类型、构建目录和清理参数的build命令参数
+    build_info: 见build_project,各配置的结果追加到同一个字典中
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not cmakelists_contains(project_dir, "PYBUILD_OUTPUT_SUFFIX"):
+        print("警告: CMakeLists.txt不支持按配置分开输出目录,各配置的产物可能互相覆盖")
+        print("      请运行 init 重新生成CMakeLists.txt")
+
+    if job_budget is None:
+        job_budget = JobBudget(get_cpu_count(), len(build_types))
+    print(
+        f"并发构建配置: {', '.join(build_types)} | 共享 {job_budget.total} 个编译任务"
+    )
+
+    def run(build_type):
+        config_build_dir = os.path.join(build_dir, build_type)
+        os.makedirs(os.path.join(project_dir, config_build_dir), exist_ok=True)
+        log_path = os.path.join(project_dir, config_build_dir, "pybuild-build.log")
+        if build_info is not None:
+            build_info.setdefault("logs", []).append(log_path)
+        with open(log_path, "w", encoding="utf-8") as log_file:
+            ok = (
+                build_project(
+                    args + ["--configs", build_type, "-b", config_build_dir],
+                    project_dir=project_dir,
+                    job_budget=job_budget,
+                    log_file=log_file,
+                    output_suffix="/" + build_type,
+                    build_info=build_info,
+                )
+                == 0
+            )
+        if not ok:
+            print(f"配置 {build_type} 构建失败,详细日志: {log_path}")
+        return build_type, ok
+
+    with ThreadPoolExecutor(max_workers=len(build_types)) as executor:
+        results = list(executor.map(inherit_run(run), build_types))
+
+    succeeded = [t for t, ok in results if ok]
+    failed = [t for t, ok in results if not ok]
+    print(f"多配置构建完成: 成功 {succeeded}, 失败 {failed}")
+    return 0 if not failed else 1
+
+
+PGO_PROFILE_DIR = "pgo-profile"
+
+
+def find_llvm_profdata(clang_version):
+    """查找与clang版本匹配的llvm-profdata"""
+    import shutil
+
+    major = clang_version.split(".")[0] if clang_version else ""
+    for name in ([f"llvm-profdata-{major}"] if major else []) + ["llvm-profdata"]:
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+def pgo_flags(compiler_name, stage, profile_dir, stage_build_dir):
+    """返回PGO某一阶段的 (编译选项, 链接选项)
+
+    stage: "generate" 插桩构建 / "use" 使用profile构建
+    GCC按目标文件路径命名.gcda,用 -fprofile-prefix-path(GCC 11及以上)去掉构建目录前缀,
+    两个阶段使用不同构建目录时也能找到对应的profile;stage_build_dir为None时不去掉前缀,
+    两个阶段需要使用同一个构建目录
+    """
+    if compiler_name == "gcc":
+        prefix = f" -fprofile-prefix-path={stage_build_dir}" if stage_build_dir else ""
+        if stage == "generate":
+            generate = f"-fprofile-generate={profile_dir}"
+            return f"{generate} -fprofile-update=atomic{prefix}", generate
+        # 源文件修改后profile不完全匹配,只给出警告而不是报错
+        return (
+            f"-fprofile-use={profile_dir}{prefix} -Wno-missing-profile -Wno-error=coverage-mismatch",
+            f"-fprofile-use={profile_dir}",
+        )
+    if stage == "generate":
+        generate = f"-fprofile-generate={profile_dir}"
+        return generate, generate
+    profdata = os.path.join(profile_dir, "default.profdata")
+    return (
+        f"-fprofile-use={profdata} -Wno-profile-instr-unprofiled -Wno-profile-instr-out-of-date",
+        f"-fprofile-use={profdata}",
+    )
+
+
+def pgo_flag_args(args, compile_flags, link_flags):
+    """把PGO选项加入build命令参数,返回新的参数列表
+
+    PGO选项追加在用户的选项之后: args中的 -DCMAKE_CXX_FLAGS=... 等参数被合并,
+    没有时使用环境变量CXXFLAGS/LDFLAGS(命令行指定了这些变量后CMake不再读取环境变量)
+    """
+    import re
+
+    pattern = re.compile(
+        r"^-D(CMAKE_CXX_FLAGS|CMAKE_EXE_LINKER_FLAGS|CMAKE_SHARED_LINKER_FLAGS)(?::\w+)?=(.*)$"
+    )
+    user_flags = {
+        "CMAKE_CXX_FLAGS": os.environ.get("CXXFLAGS", ""),
+        "CMAKE_EXE_LINKER_FLAGS": os.environ.get("LDFLAGS", ""),
+        "CMAKE_SHARED_LINKER_FLAGS": os.environ.get("LDFLAGS", ""),
+    }
+    result = []
+    for arg in args:
+        match = pattern.match(arg)
+        if match:
+            user_flags[match.group(1)] = match.group(2).strip('"')
+        else:
+            result.append(arg)
+    pgo = {
+        "CMAKE_CXX_FLAGS": compile_flags,
+        "CMAKE_EXE_LINKER_FLAGS": link_flags,
+        "CMAKE_SHARED_LINKER_FLAGS": link_flags,
+    }
+    for name, flags in pgo.items():
+        merged = f"{user_flags[name]} {flags}".strip()
+        result.append(f'-D{name}="{merged}"')
+    return result
+
+
+def build_pgo(
+    args,
+    training_command,
+    build_type,
+    build_dir,
+    compiler_setting,
+    retrain=False,
+    project_dir=".",
+    job_budget=None,
+    build_info=None,
+):
+    """PGO三阶段构建: 插桩构建 -> 运行训练命令 -> 使用profile重新构建
+
+    插桩构建在 <构建目录>/pgo-instrument,最终构建在 <构建目录>/pgo,
+    profile保存在 pgo-profile/<构建类型>(不会被clean删除)。
+    已有与编译器和训练命令匹配的profile时只重新运行最后一个阶段。
+    args: 已去掉PGO相关参数的build命令参数
+    """
+    import json
+    import shlex
+    import shutil
+
+    compiler_name, _, cxx_compiler = select_compiler(compiler_setting)
+    if compiler_name not in ("gcc", "clang"):
+        print("错误：PGO只支持GCC和Clang")
+        return 1
+    compiler_version = (
+        probe_toolchain()["tools"]
+        .get("g++" if compiler_name == "gcc" else "clang++", {})
+        .get("version", "")
+    )
+    profdata_tool = None
+    if compiler_name == "clang":
+        profdata_tool = find_llvm_profdata(compiler_version)
+        if not profdata_tool:
+            print("错误：Clang的PGO需要llvm-profdata,请安装LLVM工具")
+            return 1
+
+    profile_dir = os.path.abspath(os.path.join(project_dir, PGO_PROFILE_DIR, build_type))
+    instrument_dir = os.path.join(build_dir, "pgo-instrument")
+    final_dir = os.path.join(build_dir, "pgo")
+    # GCC 11之前没有 -fprofile-prefix-path,.gcda按目标文件的完整路径命名,
+    # 插桩构建和最终构建使用同一个构建目录才能找到profile
+    strip_prefix = True
+    if compiler_name == "gcc":
+        try:
+            strip_prefix = int(compiler_version.split(".")[0]) >= 11
+        except ValueError:
+            strip_prefix = False
+        if not strip_prefix:
+            print(f"GCC {compiler_version or '(版本未知)'} 不支持 -fprofile-prefix-path,插桩构建与最终构建共用 {final_dir}")
+            instrument_dir = final_dir
+    training = " ".join(shlex.quote(a) for a in training_command)
+    metadata = {
+        "compiler": compiler_name,
+        "compiler_version": compiler_version,
+        "training": training,
+    }
+    metadata_path = os.path.join(profile_dir, "pybuild-pgo.json")
+    try:
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    except Exception:
+        saved = None
+    if compiler_name == "gcc":
+        has_profile = os.path.isdir(profile_dir) and any(
+            name.endswith(".gcda") for _, _, names in os.walk(profile_dir) for name in names
+        )
+    else:
+        has_profile = os.path.exists(os.path.join(profile_dir, "default.profdata"))
+
+    base_args = args[:2] + ["--configs", build_type] + args[2:]
+    if retrain or saved != metadata or not has_profile:
+        if retrain:
+            print("指定了--pgo-retrain,重新收集profile")
+        elif saved is not None and saved != metadata:
+            print("编译器或训练命令已改变,重新收集profile")
+
+        # 阶段1: 插桩构建
+        print(f"\n[PGO 1/3] 插桩构建: {instrument_dir}")
+        shutil.rmtree(profile_dir, ignore_errors=True)
+        os.makedirs(profile_dir, exist_ok=True)
+        compile_flags, link_flags = pgo_flags(
+            compiler_name,
+            "generate",
+            profile_dir,
+            os.path.abspath(os.path.join(project_dir, instrument_dir)) if strip_prefix else None,
+        )
+        with trace_span("pgo instrument", "phase", project=project_dir):
+            if (
+                build_project(
+                    pgo_flag_args(base_args + ["-b", instrument_dir], compile_flags, link_flags),
+                    project_dir=project_dir,
+                    job_budget=job_budget,
+                )
+                != 0
+            ):
+                print("PGO插桩构建失败")
+                return 1
+
+        # 阶段2: 运行训练命令
+        print(f"\n[PGO 2/3] 运行训练命令: {training}")
+        with trace_span("pgo training", "phase", project=project_dir):
+            if not execute_command(training, cwd=project_dir):
+                print("训练命令执行失败")
+                return 1
+        if compiler_name == "clang":
+            raw_profiles = [
+                os.path.join(profile_dir, name)
+                for name in os.listdir(profile_dir)
+                if name.endswith(".profraw")
+            ]
+            if not raw_profiles:
+                print("训练命令没有生成profile数据")
+                return 1
+            merge = f'"{profdata_tool}" merge -output="{os.path.join(profile_dir, "default.profdata")}" ' + " ".join(
+                f'"{path}"' for path in raw_profiles
+            )
+            if not execute_command(merge):
+                print("合并profile数据失败")
+                return 1
+        with open(metadata_path, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=2, ensure_ascii=False)
+    else:
+        print(f"复用已有profile: {profile_dir} (使用 --pgo-retrain 重新收集)")
+
+    # 阶段3: 使用profile构建
+    print(f"\n[PGO 3/3] 使用profile构建: {final_dir}")
+    compile_flags, link_flags = pgo_flags(
+        compiler_name,
+        "use",
+        profile_dir,
+        os.path.abspath(os.path.join(project_dir, final_dir)) if strip_prefix else None,
+    )
+    return build_project(
+        pgo_flag_args(base_args + ["-b", final_dir], compile_flags, link_flags),
+        project_dir=project_dir,
+        job_budget=job_budget,
+        build_info=build_info,
+    )
+
+
+# inotify事件(见 <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_DIRS = ["src", "include"]
+WATCH_FILES = ["CMakeLists.txt", "CMake.json"]
+
+
+class FileWatcher:
+    """监视src/、include/、CMakeLists.txt和CMake.json的改变
+
+    Linux上使用inotify,其他平台(或inotify不可用时)用scandir定期扫描文件的修改时间和大小
+    """
+
+    def __init__(self, project_dir=".", poll_interval=0.5, use_inotify=True):
+        self.project_dir = project_dir
+        self.poll_interval = poll_interval
+        self.inotify_fd = None
+        self.watch_dirs = {}
+        if use_inotify and PLATFORM_LINUX:
+            self._init_inotify()
+        if self.inotify_fd is None:
+            self.snapshot = self._scan()
+
+    def _init_inotify(self):
+        import ctypes
+        import ctypes.util
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+        self.libc = libc
+        self.inotify_fd = fd
+        # 项目根目录只关心CMakeLists.txt和CMake.json(编辑器常以重命名方式保存)
+        self._add_watch(self.project_dir, "")
+        for name in WATCH_DIRS:
+            top = os.path.join(self.project_dir, name)
+            for root, dirs, _ in os.walk(top):
+                self._add_watch(root, os.path.relpath(root, self.project_dir))
+
+    def _add_watch(self, path, rel_path):
+        mask = (
+            IN_MODIFY
+            | IN_ATTRIB
+            | IN_CLOSE_WRITE
+            | IN_MOVED_FROM
+            | IN_MOVED_TO
+            | IN_CREATE
+            | IN_DELETE
+            | IN_DELETE_SELF
+        )
+        wd = self.libc.inotify_add_watch(self.inotify_fd, os.fsencode(path), mask)
+        if wd >= 0:
+            self.watch_dirs[wd] = rel_path
+
+    def _scan(self):
+        """返回 {相对路径: (修改时间, 大小)}"""
+        snapshot = {}
+        for name in WATCH_FILES:
+            try:
+                st = os.stat(os.path.join(self.project_dir, name))
+                snapshot[name] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                pass
+        pending = list(WATCH_DIRS)
+        while pending:
+            rel_dir = pending.pop()
+            try:
+                with os.scandir(os.path.join(self.project_dir, rel_dir)) as it:
+                    for entry in it:
+                        rel_path = os.path.join(rel_dir, entry.name)
+                        if entry.is_dir():
+                            pending.append(rel_path)
+                        else:
+                            st = entry.stat()
+                            snapshot[rel_path] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                continue
+        return snapshot
+
+    def _read_inotify(self, timeout):
+        """等待inotify事件,返回改变的相对路径集合(超时返回空集合)"""
+        import select
+        import struct
+
+        readable, _, _ = select.select([self.inotify_fd], [], [], timeout)
+        if not readable:
+            return set()
+        data = os.read(self.inotify_fd, 65536)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from("iIII", data, offset)
+            offset += struct.calcsize("iIII")
+            name = data[offset : offset + length].rstrip(b"\0").decode("utf-8", "replace")
+            offset += length
+            if mask & IN_IGNORED or wd not in self.watch_dirs:
+                self.watch_dirs.pop(wd, None)
+                continue
+            rel_dir = self.watch_dirs[wd]
+            if rel_dir == "" and name not in WATCH_FILES and name not in WATCH_DIRS:
+                continue
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # 新建的目录需要加入监视,其中已有的文件也算作改变
+                for root, dirs, files in os.walk(os.path.join(self.project_dir, rel_path)):
+                    rel_root = os.path.relpath(root, self.project_dir)
+                    self._add_watch(root, rel_root)
+                    changed.update(os.path.join(rel_root, f) for f in files)
+            if name:
+                changed.add(rel_path)
+        return changed
+
+    def _poll(self, timeout):
+        """扫描一次,返回与上次扫描相比改变的相对路径集合"""
+        time.sleep(timeout)
+        snapshot = self._scan()
+        changed = {
+            path
+            for path in set(snapshot) | set(self.snapshot)
+            if snapshot.get(path) != self.snapshot.get(path)
+        }
+        self.snapshot = snapshot
+        return changed
+
+    def wait(self, debounce=0.3):
+        """阻塞直到有文件改变,再等到debounce秒内没有新的改变,返回全部改变的路径"""
+        poll = self._read_inotify if self.inotify_fd is not None else self._poll
+        changed = set()
+        while not changed:
+            changed = poll(None if self.inotify_fd is not None else self.poll_interval)
+        while True:
+            more = poll(debounce)
+            if not more:
+                return changed
+            changed |= more
+
+    def close(self):
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+
+
+def discover_tests(build_path, project_dir="."):
+    """列出构建目录中的测试,返回 [{name, command, cwd, env, timeout, will_fail, run_serial, required_files}]
+
+    优先使用 ctest --show-only=json-v1;没有CTest测试时使用 bin/ 下名称包含test的可执行文件
+    """
+    import json
+    import subprocess
+
+    tests = []
+    try:
+        result = subprocess.run(
+            ["ctest", "--show-only=json-v1"],
+            cwd=build_path,
+            capture_output=True,
+            text=True,
+        )
+        data = json.loads(result.stdout) if result.returncode == 0 else {}
+    except (OSError, ValueError):
+        data = {}
+    for test in data.get("tests", []):
+        props = {p["name"]: p["value"] for p in test.get("properties", [])}
+        if props.get("DISABLED"):
+            continue
+        env = {}
+        for item in props.get("ENVIRONMENT", []):
+            key, _, value = item.partition("=")
+            env[key] = value
+        tests.append(
+            {
+                "name": test["name"],
+                "command": test.get("command") or [],
+                "cwd": props.get("WORKING_DIRECTORY", build_path),
+                "env": env,
+                "timeout": float(props["TIMEOUT"]) if props.get("TIMEOUT") else None,
+                "will_fail": bool(props.get("WILL_FAIL")),
+                "run_serial": bool(props.get("RUN_SERIAL")),
+                "required_files": props.get("REQUIRED_FILES", []),
+            }
+        )
+    if tests:
+        return tests
+
+    bin_dir = os.path.join(project_dir, "bin")
+    for root, _, names in os.walk(bin_dir):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            stem = os.path.splitext(name)[0] if PLATFORM_WINDOWS else name
+            if "test" in stem.lower() and os.access(path, os.X_OK):
+                tests.append(
+                    {
+                        "name": os.path.relpath(path, bin_dir).replace(os.sep, "/"),
+                        "command": [os.path.abspath(path)],
+                        "cwd": build_path,
+                        "env": {},
+                        "timeout": None,
+                        "will_fail": False,
+                        "run_serial": False,
+                        "required_files": [],
+                    }
+                )
+    return tests
+
+
+def shared_libraries_digest(project_dir):
+    """计算项目lib/shared下所有共享库的哈希,每次运行测试只计算一次"""
+    import hashlib
+
+    digest = hashlib.sha256()
+    shared_dir = os.path.join(project_dir, "lib", "shared")
+    for root, dirs, names in os.walk(shared_dir):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, shared_dir)
+            digest.update(f"{rel}\0{file_digest(path)}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def test_fingerprint(test, shared_digest, digests):
+    """计算测试输入的指纹: 命令、环境、可执行文件、作为参数的文件、REQUIRED_FILES和项目的共享库
+
+    shared_digest: shared_libraries_digest的结果
+    digests: 本次运行中已计算过的文件哈希,许多测试共用同一个可执行文件
+    """
+    import hashlib
+    import json
+
+    files = [arg for arg in test["command"] if os.path.isfile(arg)]
+    files += test["required_files"]
+    for path in files:
+        if path not in digests:
+            digests[path] = file_digest(path)
+    data = {
+        "command": test["command"],
+        "cwd": test["cwd"],
+        "env": test["env"],
+        "files": {path: digests[path] for path in sorted(set(files))},
+        "shared": shared_digest,
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def test_in_shard(name, shard):
+    """按测试名的稳定哈希分片,各CI节点独立计算也能得到一致的划分"""
+    import hashlib
+
+    index, count = shard
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()
+    return int(digest, 16) % count == index - 1
+
+
+def run_single_test(test):
+    """运行一个测试,返回 (是否通过, 耗时, 输出)"""
+    import subprocess
+
+    if not test["command"]:
+        return False, 0.0, "测试命令不可用(目标可能没有构建)"
+    env = dict(os.environ)
+    env.update(test["env"])
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(
+            test["command"],
+            cwd=test["cwd"],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=test["timeout"],
+        )
+        output = result.stdout.decode("utf-8", "replace")
+        passed = (result.returncode == 0) != test["will_fail"]
+        if not passed:
+            output += f"\n退出码: {result.returncode}"
+    except subprocess.TimeoutExpired as e:
+        output = (e.stdout or b"").decode("utf-8", "replace") + f"\n超时({test['timeout']}s)"
+        passed = False
+    except OSError as e:
+        output = f"无法运行: {e}"
+        passed = False
+    return passed, time.perf_counter() - start, output
+
+
+def write_junit_report(path, suite_name, results, elapsed):
+    """把测试结果写成JUnit XML"""
+    import xml.etree.ElementTree as ET
+
+    suite = ET.Element(
+        "testsuite",
+        name=suite_name,
+        tests=str(len(results)),
+        failures=str(sum(1 for r in results if r["status"] == "failed")),
+        skipped=str(sum(1 for r in results if r["status"] == "skipped")),
+        time=f"{elapsed:.3f}",
+    )
+    for r in results:
+        case = ET.SubElement(
+            suite, "testcase", name=r["name"], classname=suite_name, time=f"{r['duration']:.3f}"
+        )
+        if r["status"] == "failed":
+            failure = ET.SubElement(case, "failure", message="测试失败")
+            failure.text = r["output"]
+        elif r["status"] == "skipped":
+            ET.SubElement(case, "skipped", message="输入未改变,上次已通过")
+        elif r["output"]:
+            ET.SubElement(case, "system-out").text = r["output"]
+    ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def run_tests(
+    build_path,
+    project_dir=".",
+    jobs=None,
+    shard=None,
+    junit_path=None,
+    skip_unchanged=False,
+):
+    """并行运行测试,返回0(全部通过)或1
+
+    按历史耗时从长到短调度(没有记录的测试最先运行);
+    skip_unchanged为True时跳过输入未改变且上次通过的测试。
+    测试结果记录在构建历史数据库中(PYBUILD_NO_HISTORY=1时不读写)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    tests = discover_tests(build_path, project_dir)
+    if shard:
+        tests = [t for t in tests if test_in_shard(t["name"], shard)]
+    if not tests:
+        print("没有找到测试")
+        return 0
+
+    project = os.path.abspath(project_dir)
+    build_key = os.path.relpath(os.path.abspath(build_path), project)
+    use_history = not os.environ.get("PYBUILD_NO_HISTORY")
+    history = {}
+    if use_history:
+        try:
+            db = open_history_db()
+            for name, duration, pass_fingerprint in db.execute(
+                "SELECT name, duration, pass_fingerprint FROM tests WHERE project = ? AND build_dir = ?",
+                (project, build_key),
+            ):
+                history[name] = (duration, pass_fingerprint)
+            db.close()
+        except Exception as e:
+            print(f"警告: 读取测试历史失败: {e}")
+
+    shared_digest = shared_libraries_digest(project_dir)
+    digests = {}
+    pending = []
+    results = []
+    for test in tests:
+        test["fingerprint"] = test_fingerprint(test, shared_digest, digests)
+        duration, pass_fingerprint = history.get(test["name"], (None, None))
+        if skip_unchanged and pass_fingerprint == test["fingerprint"]:
+            results.append(
+                {"name": test["name"], "status": "skipped", "duration": 0.0, "output": ""}
+            )
+            continue
+        test["expected"] = duration if duration is not None else float("inf")
+        pending.append(test)
+    pending.sort(key=lambda t: -t["expected"])
+
+    jobs = jobs or get_cpu_count()
+    shard_text = f" | 分片 {shard[0]}/{shard[1]}" if shard else ""
+    print(
+        f"运行 {len(pending)} 个测试,跳过 {len(results)} 个未改变的已通过测试 | 并行 {jobs}{shard_text}"
+    )
+
+    lock = threading.Lock()
+    finished = [0]
+
+    def run(test):
+        passed, duration, output = run_single_test(test)
+        result = {
+            "name": test["name"],
+            "status": "passed" if passed else "failed",
+            "duration": duration,
+            "output": output,
+            "fingerprint": test["fingerprint"],
+        }
+        with lock:
+            finished[0] += 1
+            print(
+                f"[{finished[0]}/{len(pending)}] {'通过' if passed else '失败'} {test['name']} ({duration:.2f}s)"
+            )
+            if not passed:
+                print(output.rstrip())
+        return result
+
+    start = time.perf_counter()
+    parallel = [t for t in pending if not t["run_serial"]]
+    serial = [t for t in pending if t["run_serial"]]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results += list(executor.map(inherit_run(run), parallel))
+    results += [run(t) for t in serial]
+    elapsed = time.perf_counter() - start
+
+    if use_history:
+        try:
+            db = open_history_db()
+            with db:
+                for r in results:
+                    if r["status"] == "skipped":
+                        continue
+                    db.execute(
+                        """INSERT OR REPLACE INTO tests (project, build_dir, name, duration,
+                        status, pass_fingerprint, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                        (
+                            project,
+                            build_key,
+                            r["name"],
+                            r["duration"],
+                            r["status"],
+                            r["fingerprint"] if r["status"] == "passed" else None,
+                            time.time(),
+                        ),
+                    )
+            db.close()
+        except Exception as e:
+            print(f"警告: 写入测试历史失败: {e}")
+
+    if junit_path:
+        write_junit_report(junit_path, os.path.basename(project), results, elapsed)
+        print(f"JUnit报告已写入: {junit_path}")
+
+    failed = [r["name"] for r in results if r["status"] == "failed"]
+    print(
+        f"\n测试完成: 通过 {sum(1 for r in results if r['status'] == 'passed')}, 失败 {len(failed)}, 跳过 {len(results) - len(pending)} | 耗时 {elapsed:.2f}s"
+    )
+    if failed:
+        print("失败的测试: " + ", ".join(sorted(failed)))
+        return 1
+    return 0
+
+
+def test_command(args):
+    """pybuild test: 在构建目录中并行运行测试"""
+    build_dir = "build"
+    jobs = None
+    shard = None
+    junit_path = None
+    skip_unchanged = False
+    i = 2
+    while i < len(args):
+        arg = args[i]
+        if (arg == "-b" or arg == "--build-dir") and i + 1 < len(args):
+            i += 1
+            build_dir = args[i]
+        elif (arg == "-j" or arg == "--jobs") and i + 1 < len(args):
+            i += 1
+            try:
+                jobs = int(args[i])
+                if jobs < 1:
+                    raise ValueError
+            except ValueError:
+                print(f"错误：无效的并行任务数 {args[i]}")
+                return 1
+        elif arg == "--shard" and i + 1 < len(args):
+            i += 1
+            try:
+                index, count = (int(x) for x in args[i].split("/"))
+                if not 1 <= index <= count:
+                    raise ValueError
+            except ValueError:
+                print(f"错误：无效的分片 {args[i]},格式为 <序号>/<总数>,如 2/8")
+                return 1
+            shard = (index, count)
+        elif arg == "--junit" and i + 1 < len(args):
+            i += 1
+            junit_path = args[i]
+        elif arg == "--skip-unchanged":
+            skip_unchanged = True
+        else:
+            print(f"未知参数: {arg}")
+            return 1
+        i += 1
+
+    if not os.path.isdir(build_dir):
+        print(f"构建目录不存在: {build_dir},请先运行 pybuild build -t")
+        return 1
+    return run_tests(
+        build_dir,
+        jobs=jobs,
+        shard=shard,
+        junit_path=junit_path,
+        skip_unchanged=skip_unchanged,
+    )
+
+
+def watch_command(args):
+    """pybuild watch: 文件改变后自动增量构建
+
+    CMake.json或CMakeLists.txt改变时重新配置,其他改变只进行构建;
+    其余参数原样传给build(如 -r、--profile fast)
+    """
+    build_args = args[:1] + ["build"]
+    with_tests = False
+    debounce = 0.3
+    use_inotify = True
+    i = 2
+    while i < len(args):
+        arg = args[i]
+        if arg == "--test":
+            with_tests = True
+        elif arg == "--debounce" and i + 1 < len(args):
+            i += 1
+            try:
+                debounce = int(args[i]) / 1000
+                if debounce < 0:
+                    raise ValueError
+            except ValueError:
+                print(f"错误：无效的防抖时间 {args[i]},单位为毫秒")
+                return 1
+        elif arg == "--poll":
+            use_inotify = False
+        else:
+            build_args.append(arg)
+        i += 1
+    if with_tests and "-t" not in build_args and "--test" not in build_args:
+        # build -t 构建测试代码并在构建成功后运行测试
+        build_args.append("-t")
+
+    def run(reconfigure):
+        return (
+            build_project(build_args + (["--reconfigure"] if reconfigure else [])) == 0
+        )
+
+    watcher = FileWatcher(".", use_inotify=use_inotify)
+    print(
+        f"监视 src/、include/、CMakeLists.txt、CMake.json ({'inotify' if watcher.inotify_fd is not None else '轮询'}),按Ctrl+C退出"
+    )
+    try:
+        run(False)
+        while True:
+            print("\n等待文件改变...")
+            changed = watcher.wait(debounce)
+            shown = sorted(changed)
+            print(
+                f"\n检测到 {len(changed)} 个文件改变: {', '.join(shown[:5])}{' ...' if len(shown) > 5 else ''}"
+            )
+            reconfigure = any(path in WATCH_FILES for path in changed)
+            if reconfigure:
+                print("项目配置已改变,重新配置")
+            start = time.time()
+            ok = run(reconfigure)
+            print(f"{'完成' if ok else '失败'},耗时 {time.time() - start:.2f}s")
+    except KeyboardInterrupt:
+        print("\n停止监视")
+        return 0
+    finally:
+        watcher.close()
+
+
+# 增量安装: 先用DESTDIR安装到构建目录中的暂存目录,再把改变的文件原子替换到安装前缀
+INSTALL_STAGE_DIR = "pybuild-stage"
+# 扩展安装清单,记录每个文件的内容哈希,与CMake的install_manifest.txt放在一起
+INSTALL_HASH_MANIFEST = "pybuild_install_manifest.json"
+FICLONE = 0x40049409
+
+
+def clone_file(src, dst):
+    """用reflink复制文件(Linux FICLONE,btrfs/xfs等),不支持时抛出OSError"""
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def copy_file_range_all(src, dst):
+    """用copy_file_range在内核中复制文件内容,同一文件系统上可能不经过用户态缓冲"""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+
+
+def place_file(src, dst, allow_hardlink):
+    """把src原子地放到dst,返回使用的方式: hardlink、reflink、copy_file_range或copy
+
+    先在dst所在目录创建临时文件,再用os.replace替换,读取dst的进程不会看到写了一半的文件
+    """
+    import shutil
+
+    tmp = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.pybuild-tmp-{os.getpid()}")
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), tmp)
+        os.replace(tmp, dst)
+        return "symlink"
+
+    method = None
+    if allow_hardlink:
+        try:
+            os.link(src, tmp)
+            method = "hardlink"
+        except OSError:
+            pass
+    if method is None and PLATFORM_LINUX:
+        try:
+            clone_file(src, tmp)
+            method = "reflink"
+        except (OSError, ImportError):
+            pass
+    if method is None and hasattr(os, "copy_file_range"):
+        try:
+            copy_file_range_all(src, tmp)
+            method = "copy_file_range"
+        except OSError:
+            pass
+    if method is None:
+        shutil.copyfile(src, tmp)
+        method = "copy"
+    try:
+        if method != "hardlink":
+            shutil.copymode(src, tmp)
+        os.replace(tmp, dst)
+    except OSError:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+    return method
+
+
+def staged_install_files(build_path, stage, prefix):
+    """读取暂存安装生成的install_manifest.txt,返回 [(暂存路径, 最终路径)]
+
+    较新的CMake在清单中记录不含DESTDIR的最终路径,较旧的版本记录加上DESTDIR的路径,两种都支持
+    """
+    drive = os.path.splitdrive(os.path.abspath(prefix))[0]
+    files = []
+    with open(os.path.join(build_path, "install_manifest.txt"), "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            path = os.path.normpath(line.strip())
+            if path.startswith(stage + os.sep):
+                files.append((path, drive + path[len(stage) :]))
             else:
-                cmake_command = f'cmake .. -DCMAKE_BUILD_TYPE={cmake_build_type} -DCMAKE_INSTALL_PREFIX="{make_install_prefix}" -DCMAKE_C_COMPILER=gcc -DCMAKE_CXX_COMPILER=g++ {"" if build_test else "-DBUILD_TESTING=OFF"} {additional_flags}'
+                files.append((stage + os.path.splitdrive(path)[1], path))
+    return files
 
-            print(f"配置CMake: {cmake_command}")
-            if not execute_command(cmake_command):
-                print("CMake配置失败")
-                return 1
 
-        # 构建阶段
-        if not configure_only:
-            if PLATFORM_WINDOWS:
-                try:
-                    import multiprocessing
+def place_staged_install(build_path, prefix):
+    """把暂存目录中的文件增量安装到prefix,更新install_manifest.txt和扩展清单"""
+    import json
 
-                    core_count = multiprocessing.cpu_count()
-                    build_tool = f"cmake --build . --parallel {core_count}"
-                except:
-                    build_tool = "cmake --build ."
+    build_path = os.path.abspath(build_path)
+    stage = os.path.join(build_path, INSTALL_STAGE_DIR)
+    manifest_path = os.path.join(build_path, INSTALL_HASH_MANIFEST)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            old = json.load(f).get("files", {})
+    except (OSError, ValueError):
+        old = {}
+
+    # 以root身份运行时不使用硬链接,否则安装的文件与普通用户的暂存文件共用inode
+    allow_hardlink = not (hasattr(os, "geteuid") and os.geteuid() == 0 and os.environ.get("SUDO_USER"))
+    entries = {}
+    methods = {}
+    written = 0
+    skipped = 0
+    skipped_bytes = 0
+    for src, dst in staged_install_files(build_path, stage, prefix):
+        st = os.lstat(src)
+        if stat.S_ISLNK(st.st_mode):
+            entry = {"link": os.readlink(src)}
+            unchanged = os.path.islink(dst) and os.readlink(dst) == entry["link"]
+        else:
+            entry = {"sha256": file_digest(src), "size": st.st_size}
+            previous = old.get(dst, {})
+            try:
+                dst_st = os.lstat(dst)
+            except OSError:
+                dst_st = None
+            # 目标文件的大小和修改时间与上次安装记录一致时信任记录的哈希,否则重新计算
+            if dst_st is None or stat.S_ISLNK(dst_st.st_mode):
+                unchanged = False
+            elif previous.get("mtime_ns") == dst_st.st_mtime_ns and previous.get("size") == dst_st.st_size:
+                unchanged = previous.get("sha256") == entry["sha256"]
             else:
-                # 尝试获取核心数
-                try:
-                    import multiprocessing
+                unchanged = file_digest(dst) == entry["sha256"]
+        if unchanged:
+            skipped += 1
+            skipped_bytes += entry.get("size", 0)
+        else:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            method = place_file(src, dst, allow_hardlink)
+            methods[method] = methods.get(method, 0) + 1
+            if method in ("copy_file_range", "copy"):
+                written += entry.get("size", 0)
+            print(f"-- Installing ({method}): {dst}")
+        if "sha256" in entry:
+            dst_st = os.lstat(dst)
+            entry["mtime_ns"] = dst_st.st_mtime_ns
+        entries[dst] = entry
+
+    # 上次安装过、这次不再安装的文件
+    removed = 0
+    for path in old:
+        if path not in entries and os.path.lexists(path):
+            try:
+                os.remove(path)
+                removed += 1
+                print(f"-- Removing: {path}")
+            except OSError as e:
+                print(f"警告: 无法删除不再安装的文件 {path}: {e}")
+
+    write_file_if_changed(
+        manifest_path,
+        json.dumps({"prefix": prefix, "files": entries}, indent=2, ensure_ascii=False),
+    )
+    # uninstall读取的清单记录最终路径,而不是暂存路径
+    write_file_if_changed(
+        os.path.join(build_path, "install_manifest.txt"),
+        "".join(f"{path}\n" for path in entries),
+    )
+    updated = sum(methods.values())
+    method_text = ", ".join(f"{name} {count}" for name, count in sorted(methods.items()))
+    print(
+        f"增量安装完成: 更新 {updated} 个文件({method_text or '无'}), 写入 {format_size(written)}; "
+        f"跳过 {skipped} 个未改变的文件({format_size(skipped_bytes)}); 删除 {removed} 个不再安装的文件"
+    )
+    return 0
 
-                    core_count = multiprocessing.cpu_count()
-                    build_tool = f"cmake --build . --parallel {core_count}"
-                except:
-                    build_tool = "cmake --build ."
 
-            print(f"构建中: {build_tool}")
-            if not execute_command(build_tool):
-                print("构建失败")
-                return 1
+def install_incremental(build_path, install_path):
+    """增量安装: 暂存安装后只替换改变的文件"""
+    import subprocess
 
-        print(f"\n构建{'配置' if configure_only else ''}成功!")
-        return 0
-    except Exception as e:
-        print(f"构建项目失败: {e}")
+    prefix = install_path or read_cmake_cache(build_path).get("CMAKE_INSTALL_PREFIX", "")
+    if not prefix:
+        print("错误：无法确定安装前缀,请指定安装路径")
         return 1
-    finally:
-        # 返回原始目录
-        os.chdir(cwd)
+    prefix = os.path.abspath(prefix)
+    stage = os.path.join(os.path.abspath(build_path), INSTALL_STAGE_DIR)
+
+    # 每次重新暂存: 上次的暂存文件可能以硬链接的方式被安装,不能被cmake原地改写
+    if os.path.exists(stage):
+        remove_tree_parallel([stage])
+    env = dict(os.environ)
+    env["DESTDIR"] = stage
+    print(f"暂存安装: DESTDIR={stage} cmake --install . --prefix \"{prefix}\"")
+    with trace_span("stage install", "phase", prefix=prefix):
+        result = subprocess.run(
+            ["cmake", "--install", ".", "--prefix", prefix],
+            cwd=build_path,
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+    if result.returncode != 0:
+        print("暂存安装失败")
+        return 1
+
+    with trace_span("install", "phase", prefix=prefix):
+        if need_elevation(prefix):
+            # 只把pybuild自身交给sudo,不能是调用方的脚本(sys.argv[0])
+            command = (
+                ["sudo"]
+                + pybuild_self_command(isolated=True)
+                + ["install", "--place-stage", os.path.abspath(build_path), prefix]
+            )
+            return subprocess.run(command).returncode
+        return place_staged_install(build_path, prefix)
 
 
-def install_project(args):
-    """安装项目"""
+def install_project(args, project_dir=".", build_info=None):
+    """安装项目
+
+    project_dir: 项目根目录,安装命令在其中的构建目录下执行,不修改进程当前目录
+    构建目录与build的规则相同: 默认build,-b 指定,--profile 使用配置方案的构建目录
+    build_info: 若指定(字典),把使用的构建目录追加到其中的 build_paths 列表
+    """
     install_path = ""
-    set_path = False
+    incremental = False
+    build_dir = "build"
+    build_dir_set = False
+    profile_name = None
+    i = 2
+    while i < len(args):
+        arg = args[i]
+        if arg == "--incremental":
+            incremental = True
+        elif arg == "--place-stage" and i + 2 < len(args):
+            # 内部使用: 以sudo运行时把暂存目录中的文件放到安装前缀
+            return place_staged_install(args[i + 1], args[i + 2])
+        elif arg == "-b" or arg == "--build-dir":
+            if i + 1 < len(args) and not args[i + 1].startswith("-"):
+                i += 1
+                build_dir = args[i]
+                build_dir_set = True
+            else:
+                print("错误：未指定构建目录")
+                return 1
+        elif arg == "--profile":
+            if i + 1 < len(args) and not args[i + 1].startswith("-"):
+                i += 1
+                profile_name = args[i]
+            else:
+                print("错误：未指定构建配置方案")
+                return 1
+        else:
+            install_path = arg
+        i += 1
+
+    if profile_name:
+        profiles = read_cmake_json(project_dir).get("profiles", {})
+        if profile_name not in profiles:
+            print(f"错误：CMake.json中没有构建配置方案 {profile_name}")
+            if profiles:
+                print("可用的配置方案: " + ", ".join(profiles))
+            return 1
+        if not build_dir_set:
+            build_dir = profiles[profile_name].get(
+                "build_dir", os.path.join(build_dir, profile_name)
+            )
 
-    if len(args) > 2:
-        install_path = args[2]
-        set_path = True
+    build_path = os.path.join(project_dir, build_dir)
+    if not os.path.isfile(os.path.join(build_path, "CMakeCache.txt")):
+        print(f"错误：构建目录 {build_dir} 中没有CMake配置,请先运行 pybuild build")
+        # 多配置构建(build/Debug、build/Release)和配置方案的构建目录在子目录中
+        if os.path.isdir(build_path):
+            candidates = sorted(
+                name
+                for name in os.listdir(build_path)
+                if os.path.isfile(os.path.join(build_path, name, "CMakeCache.txt"))
+            )
+            if candidates:
+                print(
+                    "可用的构建目录: "
+                    + ", ".join(os.path.join(build_dir, name) for name in candidates)
+                    + " (用 -b 或 --profile 指定)"
+                )
+        return 1
+    if build_info is not None:
+        build_info.setdefault("build_paths", []).append(build_path)
 
     try:
-        # 进入build目录
-        os.chdir("build")
+        if incremental:
+            return install_incremental(build_path, install_path)
 
         # 构建安装命令
-        if set_path:
+        if install_path:
             if PLATFORM_WINDOWS:
                 command = f'cmake --install . --prefix "{install_path}"'
             else:
@@ -1028,59 +4467,196 @@ def install_project(args):
             else:
                 command = "sudo cmake --install ."
 
-        return 0 if execute_command(command) else 1
+        with trace_span("install", "phase", prefix=install_path or "default"):
+            return 0 if execute_command(command, cwd=build_path) else 1
     except Exception as e:
         print(f"安装项目失败: {e}")
         return 1
-    finally:
-        # 返回原始目录
-        os.chdir("..")
 
 
-def uninstall():
-    """卸载项目"""
+def split_command_batches(paths, limit=65536):
+    """把路径列表分成多批,每批参数总长度不超过limit,避免超过命令行长度限制"""
+    batches = []
+    batch = []
+    size = 0
+    for path in paths:
+        if batch and size + len(path) + 1 > limit:
+            batches.append(batch)
+            batch = []
+            size = 0
+        batch.append(path)
+        size += len(path) + 1
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def prune_candidates(paths, boundary):
+    """返回删除paths后可能变空的目录,从最深层开始排列
+
+    只考虑boundary之下的目录,boundary本身和它的直接子目录(include、lib、bin等)始终保留
+    """
+    boundary = os.path.abspath(boundary)
+    candidates = set()
+    for path in paths:
+        parent = os.path.dirname(os.path.abspath(path))
+        while parent.startswith(boundary + os.sep):
+            if os.path.dirname(parent) == boundary:
+                break
+            candidates.add(parent)
+            parent = os.path.dirname(parent)
+    return sorted(candidates, key=lambda d: (-d.count(os.sep), d))
+
+
+def uninstall_command(args, project_dir="."):
+    """卸载项目: 按build/install_manifest.txt删除安装的文件,并删除因此变空的目录
+
+    不需要提权的文件在本进程内并行删除;需要提权的文件先用 sudo -v 验证一次,
+    再分批并行执行 sudo rm,而不是每个文件启动一次sudo
+    project_dir: 项目根目录,构建目录相对于它
+    """
+    import json
+    import subprocess
+    from concurrent.futures import ThreadPoolExecutor
+
+    build_dir = "build"
+    dry_run = False
+    i = 2
+    while i < len(args):
+        arg = args[i]
+        if (arg == "-b" or arg == "--build-dir") and i + 1 < len(args):
+            i += 1
+            build_dir = args[i]
+        elif arg == "--dry-run":
+            dry_run = True
+        else:
+            print(f"未知参数: {arg}")
+            return 1
+        i += 1
+
+    build_dir = os.path.join(project_dir, build_dir)
+    manifest = os.path.join(build_dir, "install_manifest.txt")
     try:
-        if not os.path.exists("build/install_manifest.txt"):
-            print("未找到安装清单文件: build/install_manifest.txt")
+        if not os.path.exists(manifest):
+            print(f"未找到安装清单文件: {manifest}")
             return 1
 
-        with open("build/install_manifest.txt", "r", encoding="utf-8") as f:
+        with open(manifest, "r", encoding="utf-8") as f:
             files = [line.strip() for line in f if line.strip()]
+        if PLATFORM_WINDOWS:
+            # Windows路径处理
+            files = [path.replace("/", "\\") for path in files]
+        files = list(dict.fromkeys(files))
+
+        existing = [path for path in files if os.path.lexists(path)]
+        missing = len(files) - len(existing)
+        # 删除文件需要对其所在目录有写权限
+        elevated_dirs = {}
+        for path in existing:
+            parent = os.path.dirname(os.path.abspath(path))
+            if parent not in elevated_dirs:
+                elevated_dirs[parent] = need_elevation(parent)
+        local = [p for p in existing if not elevated_dirs[os.path.dirname(os.path.abspath(p))]]
+        elevated = [p for p in existing if elevated_dirs[os.path.dirname(os.path.abspath(p))]]
+
+        # 剪除空目录的边界: 安装前缀(优先使用增量安装记录的前缀),文件不全在前缀下时使用所有文件的公共父目录
+        try:
+            with open(os.path.join(build_dir, INSTALL_HASH_MANIFEST), "r", encoding="utf-8") as f:
+                boundary = json.load(f).get("prefix", "")
+        except (OSError, ValueError):
+            try:
+                boundary = read_cmake_cache(build_dir).get("CMAKE_INSTALL_PREFIX", "")
+            except OSError:
+                boundary = ""
+        abs_files = [os.path.abspath(path) for path in files]
+        if not boundary or any(
+            not path.startswith(os.path.abspath(boundary) + os.sep) for path in abs_files
+        ):
+            boundary = os.path.commonpath(abs_files) if abs_files else ""
+        candidates = prune_candidates(existing, boundary) if boundary else []
+
+        if dry_run:
+            sudo_files = set(elevated)
+            for path in existing:
+                print(f"将删除: {path}{' (sudo)' if path in sudo_files else ''}")
+            size = 0
+            for path in existing:
+                try:
+                    size += os.lstat(path).st_size
+                except OSError:
+                    pass
+            # 目录中的所有内容都会被删除时,该目录会被剪除
+            removed = set(os.path.abspath(path) for path in existing)
+            pruned = []
+            for d in candidates:
+                try:
+                    if all(os.path.join(d, name) in removed for name in os.listdir(d)):
+                        removed.add(d)
+                        pruned.append(d)
+                except OSError:
+                    pass
+            for d in pruned:
+                print(f"将删除空目录: {d}")
+            print(
+                f"\n预计删除 {len(existing)} 个文件({format_size(size)}),其中 {len(elevated)} 个需要sudo, "
+                f"{len(pruned)} 个空目录, {missing} 个文件已不存在"
+            )
+            return 0
 
-        success_count = 0
-        fail_count = 0
+        failures = {}
 
-        for file_path in files:
+        def remove_local(path):
             try:
-                if PLATFORM_WINDOWS:
-                    # Windows路径处理
-                    file_path = file_path.replace("/", "\\")
-                    # 确保文件可写
-                    if os.path.exists(file_path):
-                        os.chmod(file_path, stat.S_IWRITE)
-                        os.remove(file_path)
-                        success_count += 1
-                    else:
-                        fail_count += 1
-                else:
-                    # Linux/macOS
+                remove_path(path)
+            except OSError as e:
+                failures[path] = e.strerror or str(e)
+
+        with ThreadPoolExecutor(max_workers=min(32, get_cpu_count() * 4)) as executor:
+            list(executor.map(remove_local, local))
+
+        if elevated:
+            print(f"{len(elevated)} 个文件需要sudo权限删除")
+            if subprocess.run(["sudo", "-v"]).returncode != 0:
+                for path in elevated:
+                    failures[path] = "sudo验证失败"
+            else:
+
+                def remove_elevated(batch):
                     result = subprocess.run(
-                        f"sudo rm -f {file_path}",
-                        shell=True,
+                        ["sudo", "-n", "rm", "-f", "--"] + batch,
                         capture_output=True,
                         text=True,
                     )
-                    if result.returncode == 0:
-                        success_count += 1
-                    else:
-                        print(f"删除失败 {file_path}: {result.stderr}")
-                        fail_count += 1
-            except Exception as e:
-                print(f"处理 {file_path} 失败: {e}")
-                fail_count += 1
-
-        print(f"卸载完成：已删除 {success_count} 个文件, {fail_count} 个文件失败")
-        return 0 if fail_count == 0 else 1
+                    for path in batch:
+                        if os.path.lexists(path):
+                            failures[path] = result.stderr.strip() or "删除后仍然存在"
+
+                with ThreadPoolExecutor(max_workers=min(8, get_cpu_count())) as executor:
+                    list(executor.map(remove_elevated, split_command_batches(elevated)))
+
+        # 从最深层开始删除变空的目录,非空目录保留
+        sudo_dirs = [d for d in candidates if need_elevation(os.path.dirname(d))]
+        for d in candidates:
+            if d in sudo_dirs:
+                continue
+            try:
+                os.rmdir(d)
+            except OSError:
+                pass
+        if sudo_dirs:
+            for batch in split_command_batches(sudo_dirs):
+                # rmdir按参数顺序删除,非空目录报错并跳过
+                subprocess.run(["sudo", "-n", "rmdir", "--"] + batch, capture_output=True)
+        pruned = sum(1 for d in candidates if not os.path.exists(d))
+
+        removed = len(existing) - len(failures)
+        print(
+            f"卸载完成：已删除 {removed} 个文件, {pruned} 个空目录, "
+            f"{missing} 个文件已不存在, {len(failures)} 个文件失败"
+        )
+        for path in sorted(failures):
+            print(f"  删除失败 {path}: {failures[path]}")
+        return 0 if not failures else 1
     except Exception as e:
         print(f"卸载失败: {e}")
         return 1
@@ -1088,16 +4664,694 @@ def uninstall():
 
 def get_lib_name(url):
     # 从URL中提取库名（去掉.git后缀）
+    import re
+
     match = re.search(r"/([^/]+?)(\.git)?$", url)
     if match:
         return match.group(1)
     return "unknown_lib"
 
 
-def get_third_party_library(args):
+def need_elevation(path):
+    """判断写入path是否需要sudo提权(Windows上始终不需要)"""
+    if PLATFORM_WINDOWS:
+        return False
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return not os.access(path, os.W_OK)
+
+
+# 同一进程内对同一个镜像的更新需要串行
+_mirror_locks = {}
+_mirror_locks_guard = threading.Lock()
+
+
+def run_git(git_args, cwd=None, quiet=False):
+    """执行git命令,quiet为True时捕获输出"""
+    import subprocess
+
+    output = None if quiet else current_run_output()
+    if output is None:
+        return subprocess.run(
+            ["git"] + git_args, cwd=cwd, capture_output=quiet, text=True
+        )
+    # Python API捕获输出时,git的输出写入本次运行的缓冲区
+    result = subprocess.run(
+        ["git"] + git_args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    output.write(result.stdout)
+    return result
+
+
+def update_git_mirror(url, quiet=False):
+    """创建或更新url对应的本地镜像仓库,返回镜像路径,失败时返回None
+
+    镜像位于 <缓存目录>/git/<url的哈希>,首次使用时 `git clone --mirror`,
+    之后只做增量 `git fetch`;网络不可用时继续使用已有镜像。
+    """
+    import hashlib
+    import shutil
+
+    url_hash = hashlib.sha256(url.rstrip("/").encode("utf-8")).hexdigest()[:24]
+    mirror = get_cache_dir("git", url_hash)
+
+    with _mirror_locks_guard:
+        lock = _mirror_locks.setdefault(mirror, threading.Lock())
+    with lock:
+        if os.path.exists(os.path.join(mirror, "HEAD")):
+            result = run_git(
+                ["--git-dir", mirror, "fetch", "--prune", "--tags", "origin"],
+                quiet=quiet,
+            )
+            if result.returncode != 0:
+                print(f"警告: 更新镜像失败,使用已有镜像: {url}")
+            return mirror
+
+        os.makedirs(os.path.dirname(mirror), exist_ok=True)
+        tmp_mirror = f"{mirror}.tmp{os.getpid()}"
+        shutil.rmtree(tmp_mirror, ignore_errors=True)
+        result = run_git(["clone", "--mirror", url, tmp_mirror], quiet=quiet)
+        if result.returncode != 0:
+            shutil.rmtree(tmp_mirror, ignore_errors=True)
+            print(f"创建镜像失败 {url}: {result.stderr or ''}")
+            return None
+        try:
+            os.replace(tmp_mirror, mirror)
+        except OSError as e:
+            # 另一个pybuild进程已经创建了同一个镜像(目标非空),使用它的镜像
+            shutil.rmtree(tmp_mirror, ignore_errors=True)
+            if not os.path.exists(os.path.join(mirror, "HEAD")):
+                print(f"创建镜像失败 {url}: {e}")
+                return None
+        return mirror
+
+
+def clone_library(url, work_dir=".", quiet=False, use_mirror=True):
+    """使用git下载第三方库,返回(库名, 是否成功, git输出)
+
+    use_mirror为True时先更新本地镜像,再从镜像浅克隆工作副本(只有本地I/O),
+    并把origin指回原始url;子模块以浅克隆方式并行获取。
+    quiet为True时捕获git输出而不是直接打印到终端(并发下载时使用)
+    """
+    from pathlib import Path
+
+    lib_name = get_lib_name(url)
+    output = ""
+    try:
+        if use_mirror:
+            mirror = update_git_mirror(url, quiet=quiet)
+            if mirror is None:
+                return lib_name, False, ""
+            result = run_git(
+                [
+                    "clone",
+                    "--depth",
+                    "1",
+                    "--no-tags",
+                    Path(mirror).resolve().as_uri(),
+                    lib_name,
+                ],
+                cwd=work_dir,
+                quiet=quiet,
+            )
+        else:
+            result = run_git(["clone", url], cwd=work_dir, quiet=quiet)
+        if result.returncode != 0:
+            print(f"下载失败 {lib_name}: {result.stderr or ''}")
+            return lib_name, False, ""
+        output += result.stdout or ""
+
+        lib_dir = os.path.join(work_dir, lib_name)
+        if use_mirror:
+            run_git(["remote", "set-url", "origin", url], cwd=lib_dir, quiet=True)
+
+        if os.path.exists(os.path.join(lib_dir, ".gitmodules")):
+            result = run_git(
+                [
+                    "submodule",
+                    "update",
+                    "--init",
+                    "--recursive",
+                    "--depth",
+                    "1",
+                    "--jobs",
+                    str(get_cpu_count()),
+                ],
+                cwd=lib_dir,
+                quiet=quiet,
+            )
+            if result.returncode != 0:
+                print(f"下载子模块失败 {lib_name}: {result.stderr or ''}")
+                return lib_name, False, ""
+            output += result.stdout or ""
+        return lib_name, True, output
+    except Exception as e:
+        print(f"下载失败 {lib_name} 失败: {e}")
+        return lib_name, False, ""
+
+
+def read_library_dependencies(lib_dir):
+    """读取库的CMake.json,返回(项目名, 依赖列表);没有CMake.json时返回(None, [])"""
+    json_path = os.path.join(lib_dir, "CMake.json")
+    if not os.path.exists(json_path):
+        return None, []
+    project_name = [""]
+    project_type = [""]
+    deps = []
+    num_deps = [0]
+    add_precompile_headers = [False]
+    include_dir = []
+    parse_cmake_json(
+        project_name,
+        project_type,
+        deps,
+        num_deps,
+        add_precompile_headers,
+        include_dir,
+        json_path=json_path,
+    )
+    return project_name[0] or None, deps
+
+
+def find_dependency_cycle(graph):
+    """在依赖图中查找环,返回环上的节点列表(首尾相同),无环时返回None
+
+    graph: {库名: [该库依赖的库名]}
+    """
+    visiting = set()
+    visited = set()
+    path = []
+
+    def visit(node):
+        visiting.add(node)
+        path.append(node)
+        for dep in graph[node]:
+            if dep in visiting:
+                return path[path.index(dep) :] + [dep]
+            if dep not in visited:
+                cycle = visit(dep)
+                if cycle:
+                    return cycle
+        visiting.discard(node)
+        visited.add(node)
+        path.pop()
+        return None
+
+    for node in graph:
+        if node not in visited:
+            cycle = visit(node)
+            if cycle:
+                return cycle
+    return None
+
+
+def dependency_levels(graph):
+    """按拓扑顺序把依赖图分层,同一层的库之间没有依赖关系"""
+    remaining = {node: set(deps) for node, deps in graph.items()}
+    levels = []
+    while remaining:
+        level = sorted(node for node, deps in remaining.items() if not deps)
+        if not level:
+            break
+        levels.append(level)
+        for node in level:
+            del remaining[node]
+        for deps in remaining.values():
+            deps.difference_update(level)
+    return levels
+
+
+ARTIFACT_CACHE_DEFAULT_SIZE = 5 * 1024**3  # 预编译产物缓存默认上限 5GB
+_artifact_cache_lock = threading.Lock()
+
+
+def parse_size(text):
+    """解析 10G/512M/100K/1024 形式的大小,返回字节数"""
+    text = text.strip().upper().rstrip("B")
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    """把字节数格式化为便于阅读的字符串"""
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+def get_compiler_id(setting="auto"):
+    """返回按setting选择的C++编译器的标识(`--version` 的第一行)"""
+    name, _, cxx = select_compiler(setting)
+    info = probe_toolchain()["tools"].get("g++" if name == "gcc" else "clang++")
+    return info["id"] if info else cxx
+
+
+def get_artifact_cache_size():
+    """返回产物缓存的容量上限,可通过PYBUILD_ARTIFACT_CACHE_SIZE设置"""
+    try:
+        return parse_size(os.environ["PYBUILD_ARTIFACT_CACHE_SIZE"])
+    except (KeyError, ValueError):
+        return ARTIFACT_CACHE_DEFAULT_SIZE
+
+
+def artifact_cache_key(lib_dir, build_type, install_prefix, flags, dependencies=()):
+    """计算库的产物缓存键,工作区有未提交修改或不是git仓库时返回None
+
+    键由提交哈希、构建类型、编译器标识、安装路径、额外的CMake参数
+    以及依赖库的缓存键组成。编译器与 build 的选择规则一致:
+    参数中的 --compiler 优先,其次是库的CMake.json中的 compiler 设置。
+    """
+    import hashlib
+    import json
+    import platform
+
+    result = run_git(["rev-parse", "HEAD"], cwd=lib_dir, quiet=True)
+    if result.returncode != 0:
+        return None
+    status = run_git(["status", "--porcelain"], cwd=lib_dir, quiet=True)
+    if status.returncode != 0 or status.stdout.strip():
+        return None
+    flags = list(flags)
+    compiler_setting = read_cmake_json(lib_dir).get("compiler", "auto")
+    for i, flag in enumerate(flags[:-1]):
+        if flag == "--compiler":
+            compiler_setting = flags[i + 1]
+    key_data = {
+        "commit": result.stdout.strip(),
+        "build_type": build_type,
+        "compiler": get_compiler_id(compiler_setting),
+        "prefix": install_prefix,
+        "flags": flags,
+        "dependencies": list(dependencies),
+        "platform": platform.system() + "-" + platform.machine(),
+    }
+    return hashlib.sha256(
+        json.dumps(key_data, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def update_artifact_stats(field):
+    """累加缓存统计计数(hits/misses/stores)"""
+    import json
+
+    stats_path = get_cache_dir("artifacts", "stats.json")
+    with _artifact_cache_lock:
+        try:
+            with open(stats_path, "r", encoding="utf-8") as f:
+                stats = json.load(f)
+        except Exception:
+            stats = {}
+        stats[field] = stats.get(field, 0) + 1
+        os.makedirs(os.path.dirname(stats_path), exist_ok=True)
+        with open(stats_path, "w", encoding="utf-8") as f:
+            json.dump(stats, f, indent=2)
+
+
+def archive_sha256(path):
+    """分块计算归档文件的sha256"""
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def remove_artifact(archive):
+    """删除缓存中的归档及其元数据和校验文件"""
+    for path in (archive, archive + ".sha256", archive[: -len(".tar.gz")] + ".json"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def fetch_artifact(key):
+    """查找缓存的产物,返回本地归档路径,未命中时返回None
+
+    优先使用本地目录缓存;设置了PYBUILD_ARTIFACT_URL时,本地未命中会尝试
+    从HTTP服务器下载 <url>/<key>.tar.gz 及其校验文件 <key>.tar.gz.sha256,
+    校验通过后才放入本地缓存。没有校验文件或校验失败的产物视为未命中。
+    """
+    import shutil
+
+    archive = get_cache_dir("artifacts", f"{key}.tar.gz")
+    if os.path.exists(archive):
+        checksum_path = archive + ".sha256"
+        try:
+            with open(checksum_path, "r", encoding="utf-8") as f:
+                expected = f.read().split()[0]
+        except (OSError, IndexError):
+            expected = ""
+        if expected and archive_sha256(archive) == expected:
+            # 更新修改时间,作为LRU淘汰依据
+            os.utime(archive, None)
+            return archive
+        print(f"警告: 本地缓存产物校验失败,已删除: {archive}")
+        remove_artifact(archive)
+
+    base_url = os.environ.get("PYBUILD_ARTIFACT_URL")
+    if not base_url:
+        return None
+    import urllib.request
+    import urllib.error
+
+    url = f"{base_url.rstrip('/')}/{key}.tar.gz"
+    tmp_archive = f"{archive}.tmp{os.getpid()}-{threading.get_ident()}"
+    try:
+        with urllib.request.urlopen(url + ".sha256") as resp:
+            expected = resp.read().decode("ascii", "replace").split()[0]
+        with urllib.request.urlopen(url) as resp:
+            os.makedirs(os.path.dirname(archive), exist_ok=True)
+            with open(tmp_archive, "wb") as f:
+                shutil.copyfileobj(resp, f)
+        if archive_sha256(tmp_archive) != expected:
+            print(f"警告: 远程缓存产物的sha256不匹配,已丢弃: {url}")
+            os.remove(tmp_archive)
+            return None
+        with open(archive + ".sha256", "w", encoding="utf-8") as f:
+            f.write(expected + "\n")
+        os.replace(tmp_archive, archive)
+        return archive
+    except urllib.error.HTTPError as e:
+        if e.code != 404:
+            print(f"警告: 从远程缓存下载失败: {e}")
+    except Exception as e:
+        print(f"警告: 从远程缓存下载失败: {e}")
+    if os.path.exists(tmp_archive):
+        os.remove(tmp_archive)
+    return None
+
+
+def store_artifact(key, staging_dir, metadata):
+    """把暂存的安装目录打包存入缓存,返回归档路径,失败时返回None"""
+    import json
+    import tarfile
+
+    archive = get_cache_dir("artifacts", f"{key}.tar.gz")
+    try:
+        os.makedirs(os.path.dirname(archive), exist_ok=True)
+        tmp_archive = f"{archive}.tmp{os.getpid()}-{threading.get_ident()}"
+        with tarfile.open(tmp_archive, "w:gz") as tar:
+            for name in sorted(os.listdir(staging_dir)):
+                tar.add(os.path.join(staging_dir, name), arcname=name)
+        checksum = archive_sha256(tmp_archive)
+        with open(archive + ".sha256", "w", encoding="utf-8") as f:
+            f.write(checksum + "\n")
+        os.replace(tmp_archive, archive)
+        with open(get_cache_dir("artifacts", f"{key}.json"), "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=2, ensure_ascii=False)
+    except Exception as e:
+        print(f"警告: 写入产物缓存失败: {e}")
+        return None
+
+    base_url = os.environ.get("PYBUILD_ARTIFACT_URL")
+    if base_url:
+        import urllib.request
+
+        try:
+            url = f"{base_url.rstrip('/')}/{key}.tar.gz"
+            with open(archive, "rb") as f:
+                request = urllib.request.Request(url, data=f.read(), method="PUT")
+            urllib.request.urlopen(request).close()
+            # 校验文件在归档之后上传,下载方看到校验文件时归档已经完整
+            request = urllib.request.Request(
+                url + ".sha256", data=(checksum + "\n").encode("ascii"), method="PUT"
+            )
+            urllib.request.urlopen(request).close()
+        except Exception as e:
+            print(f"警告: 上传到远程缓存失败: {e}")
+
+    update_artifact_stats("stores")
+    prune_artifact_cache(get_artifact_cache_size())
+    return archive
+
+
+def unsafe_archive_members(members):
+    """返回会写到解压目录之外的成员名: 绝对路径、含..的路径、指向目录外的链接,以及设备文件等"""
+    import posixpath
+
+    unsafe = []
+    for m in members:
+        name = m.name.replace("\\", "/")
+        normalized = posixpath.normpath(name)
+        if (
+            name.startswith("/")
+            or os.path.splitdrive(name)[0]
+            or normalized == ".."
+            or normalized.startswith("../")
+        ):
+            unsafe.append(m.name)
+        elif m.issym() or m.islnk():
+            link = m.linkname.replace("\\", "/")
+            # 符号链接相对于所在目录,硬链接相对于归档根目录
+            base = posixpath.dirname(normalized) if m.issym() else ""
+            target = posixpath.normpath(posixpath.join(base, link))
+            if link.startswith("/") or target == ".." or target.startswith("../"):
+                unsafe.append(m.name)
+        elif not (m.isfile() or m.isdir()):
+            unsafe.append(m.name)
+    return unsafe
+
+
+def extract_artifact(archive, install_prefix, manifest_path):
+    """把缓存的产物解压到安装路径,并写出install_manifest.txt供uninstall使用
+
+    解压前检查所有成员,任何成员可能写到安装路径之外时拒绝整个归档并从缓存中删除
+    """
+    import tarfile
+
+    try:
+        with tarfile.open(archive, "r:gz") as tar:
+            all_members = tar.getmembers()
+            unsafe = unsafe_archive_members(all_members)
+            if unsafe:
+                print(f"错误: 缓存产物包含不安全的路径,拒绝解压: {', '.join(unsafe[:5])}")
+                remove_artifact(archive)
+                return False
+            members = [m for m in all_members if not m.isdir()]
+            if need_elevation(install_prefix):
+                if not execute_command(f'sudo mkdir -p "{install_prefix}"'):
+                    return False
+                if not execute_command(
+                    f'sudo tar --no-same-owner -xzf "{archive}" -C "{install_prefix}"'
+                ):
+                    return False
+            else:
+                os.makedirs(install_prefix, exist_ok=True)
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(install_prefix, filter="data")
+                else:
+                    tar.extractall(install_prefix)
+
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            for m in members:
+                f.write(os.path.join(install_prefix, m.name) + "\n")
+        return True
+    except Exception as e:
+        print(f"解压缓存产物失败: {e}")
+        return False
+
+
+def list_artifacts():
+    """返回缓存中的产物列表 [(路径, 大小, 修改时间)],按修改时间从旧到新排序"""
+    cache_dir = get_cache_dir("artifacts")
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".tar.gz") and entry.is_file():
+            st = entry.stat()
+            entries.append((entry.path, st.st_size, st.st_mtime))
+    entries.sort(key=lambda e: e[2])
+    return entries
+
+
+def prune_artifact_cache(max_size):
+    """按LRU淘汰产物,直到缓存总大小不超过max_size,返回(删除数量, 释放字节数)"""
+    with _artifact_cache_lock:
+        entries = list_artifacts()
+        total = sum(e[1] for e in entries)
+        removed = 0
+        freed = 0
+        for path, size, _ in entries:
+            if total <= max_size:
+                break
+            try:
+                remove_artifact(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+            freed += size
+        return removed, freed
+
+
+def cache_command(args):
+    """pybuild cache stats|prune: 查看或清理预编译产物缓存"""
+    import json
+
+    action = args[2] if len(args) > 2 else "stats"
+
+    if action == "stats":
+        entries = list_artifacts()
+        try:
+            with open(get_cache_dir("artifacts", "stats.json"), "r", encoding="utf-8") as f:
+                stats = json.load(f)
+        except Exception:
+            stats = {}
+        hits = stats.get("hits", 0)
+        misses = stats.get("misses", 0)
+        total = sum(e[1] for e in entries)
+        print(f"缓存目录: {get_cache_dir('artifacts')}")
+        if os.environ.get("PYBUILD_ARTIFACT_URL"):
+            print(f"远程缓存: {os.environ['PYBUILD_ARTIFACT_URL']}")
+        print(f"产物数量: {len(entries)}")
+        print(f"占用空间: {format_size(total)} / {format_size(get_artifact_cache_size())}")
+        print(f"命中: {hits} | 未命中: {misses} | 写入: {stats.get('stores', 0)}")
+        if hits + misses > 0:
+            print(f"命中率: {hits * 100.0 / (hits + misses):.1f}%")
+        return 0
+
+    elif action == "prune":
+        max_size = get_artifact_cache_size()
+        i = 3
+        while i < len(args):
+            if args[i] == "--max-size" and i + 1 < len(args):
+                try:
+                    max_size = parse_size(args[i + 1])
+                except ValueError:
+                    print(f"无效的大小: {args[i + 1]}")
+                    return 1
+                i += 2
+            elif args[i] == "--all":
+                max_size = 0
+                i += 1
+            else:
+                print(f"无效参数: {args[i]}")
+                return 1
+        removed, freed = prune_artifact_cache(max_size)
+        print(f"已清理 {removed} 个产物, 释放 {format_size(freed)}")
+        return 0
+
+    print(f"无效参数: {action}")
+    print("用法: pybuild cache stats | pybuild cache prune [--max-size <大小>] [--all]")
+    return 1
+
+
+def build_and_install_library(
+    lib_name,
+    lib_dir,
+    cmd,
+    install_prefix,
+    job_budget=None,
+    clone_output=None,
+    artifact_key=None,
+):
+    """构建并安装单个已下载的库,返回是否成功
+
+    clone_output不为None时表示并发模式,cmake输出(连同git输出)写入
+    <库名>/build/pybuild-get.log,避免多个库的输出在终端中交错。
+    artifact_key不为None时启用产物缓存:命中则直接解压到安装路径,跳过cmake;
+    未命中则构建后先安装到暂存目录,打包存入缓存,再解压到安装路径。
+    """
+    import shutil
+
+    build_path = os.path.join(lib_dir, "build")
+    manifest_path = os.path.join(build_path, "install_manifest.txt")
+    log_file = None
+    try:
+        if artifact_key:
+            archive = fetch_artifact(artifact_key)
+            if archive:
+                update_artifact_stats("hits")
+                print(f"命中产物缓存 {lib_name}: {artifact_key[:12]}")
+                with trace_span("install (artifact)", "phase", project=lib_name):
+                    return extract_artifact(archive, install_prefix, manifest_path)
+            update_artifact_stats("misses")
+
+        if clone_output is not None:
+            os.makedirs(build_path, exist_ok=True)
+            log_path = os.path.join(build_path, "pybuild-get.log")
+            log_file = open(log_path, "w", encoding="utf-8")
+            log_file.write(clone_output)
+            log_file.flush()
+
+        ok = (
+            build_project(
+                cmd, project_dir=lib_dir, job_budget=job_budget, log_file=log_file
+            )
+            == 0
+        )
+        if ok and artifact_key:
+            # 安装到暂存目录后存入缓存,再从缓存解压到真正的安装路径
+            staging_dir = os.path.join(build_path, "pybuild-staging")
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            ok = execute_command(
+                f'cmake --install . --prefix "{os.path.abspath(staging_dir)}"',
+                cwd=build_path,
+                log_file=log_file,
+            )
+            archive = None
+            if ok:
+                archive = store_artifact(
+                    artifact_key,
+                    staging_dir,
+                    {"name": lib_name, "prefix": install_prefix, "cmd": cmd[2:]},
+                )
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            if archive:
+                with trace_span("install (artifact)", "phase", project=lib_name):
+                    ok = extract_artifact(archive, install_prefix, manifest_path)
+                if not ok:
+                    print(f"安装失败 {lib_name}")
+                return ok
+            if not ok:
+                print(f"安装失败 {lib_name}")
+        if ok:
+            install_command = "cmake --install ."
+            if need_elevation(install_prefix):
+                install_command = "sudo " + install_command
+            with trace_span("install", "phase", project=lib_name):
+                ok = execute_command(
+                    install_command,
+                    cwd=build_path,
+                    log_file=log_file,
+                )
+            if not ok:
+                print(f"安装失败 {lib_name}")
+        if not ok and log_file is not None:
+            print(f"构建失败 {lib_name},详细日志: {log_file.name}")
+        return ok
+    except Exception as e:
+        print(f"构建失败 {lib_name}: {e}")
+        return False
+    finally:
+        if log_file is not None:
+            log_file.close()
+
+
+def get_third_party_library(args, work_dir="."):
+    """下载、构建并安装第三方库
+
+    work_dir: 库被克隆到的目录,不修改进程当前目录
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
     build_type = "-d"
     set_install_place = False
     install_place = ""
+    jobs = 1
+    use_mirror = True
+    use_artifact_cache = True
     url = []
     lib_success = []
     lib_fail = []
@@ -1109,7 +5363,13 @@ def get_third_party_library(args):
         elif args[i] == "-d" or args[i] == "--debug":
             build_type = "-d"
             i += 1
-        elif args[i] == "-p" or args[i] == "--prefic":
+        elif args[i] == "--no-mirror":
+            use_mirror = False
+            i += 1
+        elif args[i] == "--no-artifact-cache":
+            use_artifact_cache = False
+            i += 1
+        elif args[i] == "-p" or args[i] == "--prefix" or args[i] == "--prefic":
             if i + 1 >= len(args):
                 print("未指定下载位置!!! 参数无效")
                 break
@@ -1117,33 +5377,738 @@ def get_third_party_library(args):
             i += 1
             install_place = args[i]
             i += 1
+        elif args[i] == "-j" or args[i] == "--jobs":
+            if i + 1 >= len(args) or not args[i + 1].isdigit():
+                print("错误: -j 需要指定并发数量")
+                return 1
+            i += 1
+            jobs = max(1, int(args[i]))
+            i += 1
         else:
             url.append(args[i])
             i += 1
 
     cmd = ["", "", build_type]
     if set_install_place:
+        install_place = os.path.abspath(install_place)
         cmd.append("-p")
         cmd.append(install_place)
-    for third_party_library in url:
-        try:
-            lib_name = get_lib_name(third_party_library)
-            result = subprocess.run(["git", "clone", third_party_library])
-            if result.returncode == 0:
-                os.chdir(lib_name)
-                build_project(cmd)
-                os.chdir("..")
-                lib_success.append(lib_name)
-            else:
-                print(f"下载失败 {lib_name}: {result.stderr}")
-                lib_fail.append(lib_name)
-        except Exception as e:
-            print(f"下载失败 {lib_name} 失败: {e}")
+        # 让后构建的库能找到先安装到该目录的依赖
+        cmd.append(f'-DCMAKE_PREFIX_PATH="{install_place}"')
+    else:
+        install_place = os.path.join(work_dir, "install") if PLATFORM_WINDOWS else "/usr/local"
+
+    workers = min(jobs, len(url)) if url else 1
+    concurrent = workers > 1
+    job_budget = JobBudget(get_cpu_count(), workers)
+
+    def clone(u):
+        with trace_span(f"clone {get_lib_name(u)}", "phase", url=u):
+            return clone_library(u, work_dir=work_dir, quiet=concurrent, use_mirror=use_mirror)
+
+    # 下载阶段
+    if concurrent:
+        print(f"并发下载构建: {workers} 个库同时进行, 共享 {job_budget.total} 个编译任务")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            cloned = list(
+                executor.map(inherit_run(clone), url)
+            )
+    else:
+        cloned = [clone(u) for u in url]
+
+    clone_outputs = {}
+    clone_failed = []
+    for lib_name, ok, output in cloned:
+        if ok:
+            clone_outputs[lib_name] = output
+        else:
             lib_fail.append(lib_name)
+            clone_failed.append(lib_name)
+
+    # 根据各库CMake.json中的dependencies建立依赖图,名称可以是仓库名或项目名
+    # 下载失败的库也放进依赖图(按仓库名),依赖它的库随后被跳过
+    aliases = {}
+    declared = {}
+    for lib_name in clone_failed:
+        declared[lib_name] = []
+        aliases[lib_name] = lib_name
+    for lib_name in clone_outputs:
+        project_name, deps = read_library_dependencies(os.path.join(work_dir, lib_name))
+        declared[lib_name] = deps
+        aliases[lib_name] = lib_name
+        if project_name:
+            aliases.setdefault(project_name, lib_name)
+    graph = {
+        lib_name: sorted(
+            set(aliases[d] for d in deps if d in aliases and aliases[d] != lib_name)
+        )
+        for lib_name, deps in declared.items()
+    }
+
+    cycle = find_dependency_cycle(graph)
+    if cycle:
+        print(f"错误: 检测到循环依赖: {' -> '.join(cycle)}")
+        return 1
+
+    # 构建阶段: 每个库在其依赖全部安装完成后立即开始,不必等待整层结束
+    dependents = {lib_name: [] for lib_name in graph}
+    pending = {}
+    for lib_name, deps in graph.items():
+        pending[lib_name] = len(deps)
+        for dep in deps:
+            dependents[dep].append(lib_name)
+
+    def skip_dependents(lib_name, reason="构建失败"):
+        for dependent in dependents[lib_name]:
+            if dependent not in lib_fail:
+                print(f"跳过 {dependent}: 依赖 {lib_name} {reason}")
+                lib_fail.append(dependent)
+                skip_dependents(dependent)
+
+    for lib_name in clone_failed:
+        skip_dependents(lib_name, "下载失败")
+
+    levels = [
+        [lib_name for lib_name in level if lib_name not in lib_fail]
+        for level in dependency_levels(graph)
+    ]
+    levels = [level for level in levels if level]
+    if len(levels) > 1:
+        print("构建顺序: " + " -> ".join("[" + ", ".join(l) + "]" for l in levels))
+
+    artifact_keys = {}
+
+    def run(lib_name):
+        artifact_key = None
+        dep_keys = [artifact_keys.get(dep) for dep in graph[lib_name]]
+        if use_artifact_cache and all(dep_keys):
+            artifact_key = artifact_cache_key(
+                os.path.join(work_dir, lib_name),
+                "Release" if build_type == "-r" else "Debug",
+                install_place,
+                cmd[3:],
+                dep_keys,
+            )
+            artifact_keys[lib_name] = artifact_key
+        return build_and_install_library(
+            lib_name,
+            os.path.join(work_dir, lib_name),
+            cmd,
+            install_place,
+            job_budget=job_budget,
+            clone_output=clone_outputs[lib_name] if concurrent else None,
+            artifact_key=artifact_key,
+        )
+
+    run_in_worker = inherit_run(run)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        ready = [
+            lib_name
+            for level in levels
+            for lib_name in level
+            if not graph[lib_name] and lib_name not in lib_fail
+        ]
+        while ready or running:
+            for lib_name in ready:
+                running[executor.submit(run_in_worker, lib_name)] = lib_name
+            ready = []
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                lib_name = running.pop(future)
+                if future.result():
+                    lib_success.append(lib_name)
+                    for dependent in dependents[lib_name]:
+                        pending[dependent] -= 1
+                        if pending[dependent] == 0 and dependent not in lib_fail:
+                            ready.append(dependent)
+                else:
+                    lib_fail.append(lib_name)
+                    skip_dependents(lib_name)
+
     print(f"下载完成：已下载 {lib_success} 个文件, {lib_fail} 个文件失败")
     return 0 if len(lib_fail) == 0 else 1
 
 
+# ---------------------------------------------------------------------------
+# Python API: 在同一个进程中驱动多个构建,不修改进程当前目录,可以在多个线程中同时调用
+#
+#     import pybuild
+#     result = pybuild.build("path/to/project", config="Release", jobs=8)
+#     if not result.ok:
+#         for d in result.diagnostics:
+#             print(d["file"], d["line"], d["message"])
+# ---------------------------------------------------------------------------
+
+# GCC/Clang: file:line:col: error: message
+GCC_DIAGNOSTIC_PATTERN = r"^(?P<file>[^\s:][^:]*):(?P<line>\d+):(?:(?P<column>\d+):)?\s*(?P<severity>fatal error|error|warning):\s*(?P<message>.*)$"
+# MSVC: file(line,col): error C2065: message
+MSVC_DIAGNOSTIC_PATTERN = r"^\s*(?P<file>[^(]+)\((?P<line>\d+)(?:,(?P<column>\d+))?\)\s*:\s*(?P<severity>fatal error|error|warning)\s+\w+\d+\s*:\s*(?P<message>.*)$"
+# CMake: CMake Error at CMakeLists.txt:12 (add_executable):
+CMAKE_DIAGNOSTIC_PATTERN = r"^CMake (?P<severity>Error|Warning)(?: \(dev\))? at (?P<file>[^:]+):(?P<line>\d+)"
+
+
+def parse_diagnostics(text):
+    """从构建输出中解析编译器和CMake的错误与警告,返回 [{severity, file, line, column, message}]"""
+    import re
+
+    patterns = [
+        re.compile(GCC_DIAGNOSTIC_PATTERN),
+        re.compile(MSVC_DIAGNOSTIC_PATTERN),
+        re.compile(CMAKE_DIAGNOSTIC_PATTERN),
+    ]
+    diagnostics = []
+    seen = set()
+    lines = text.splitlines()
+    for index, line in enumerate(lines):
+        for pattern in patterns:
+            match = pattern.match(line)
+            if not match:
+                continue
+            groups = match.groupdict()
+            message = groups.get("message")
+            if message is None:
+                # CMake的消息在下一行,缩进两个空格
+                following = lines[index + 1].strip() if index + 1 < len(lines) else ""
+                message = following
+            severity = groups["severity"].lower()
+            diagnostic = {
+                "severity": "error" if severity == "fatal error" else severity,
+                "file": groups["file"].strip(),
+                "line": int(groups["line"]),
+                "column": int(groups["column"]) if groups.get("column") else None,
+                "message": message.strip(),
+            }
+            key = tuple(diagnostic.values())
+            if key not in seen:
+                seen.add(key)
+                diagnostics.append(diagnostic)
+            break
+    return diagnostics
+
+
+def collect_artifacts(project_dir, output_suffixes):
+    """返回各产物输出目录(bin、lib/static、lib/shared 加上输出子目录)中的文件"""
+    artifacts = []
+    for suffix in dict.fromkeys(output_suffixes):
+        for output_dir in ("bin", "lib/static", "lib/shared"):
+            path = os.path.join(project_dir, output_dir + suffix)
+            if not os.path.isdir(path):
+                continue
+            for entry in sorted(os.scandir(path), key=lambda e: e.name):
+                if entry.is_file():
+                    artifacts.append(os.path.abspath(entry.path))
+    return artifacts
+
+
+class BuildResult:
+    """Python API调用的结果
+
+    ok/exit_code: 是否成功,以及命令行中对应的退出码
+    duration: 总耗时(秒);phases: {阶段名: 秒},如 configure、build、install
+    build_paths: 使用的构建目录;artifacts: 生成的可执行文件和库
+    diagnostics: 从输出中解析出的编译器/CMake错误和警告 [{severity, file, line, column, message}]
+    output: 捕获的完整输出(capture_output=False时为空)
+    """
+
+    def __init__(self, command, project_dir):
+        self.command = command
+        self.project_dir = os.path.abspath(project_dir)
+        self.ok = False
+        self.exit_code = 1
+        self.duration = 0.0
+        self.phases = {}
+        self.build_paths = []
+        self.artifacts = []
+        self.diagnostics = []
+        self.logs = []
+        self.output = ""
+        # 工作区构建时输入未改变而跳过
+        self.skipped = False
+
+    def __bool__(self):
+        return self.ok
+
+    def __repr__(self):
+        return (
+            f"BuildResult(command={self.command!r}, project_dir={self.project_dir!r}, "
+            f"ok={self.ok}, duration={self.duration:.2f})"
+        )
+
+    @property
+    def errors(self):
+        return [d for d in self.diagnostics if d["severity"] == "error"]
+
+    @property
+    def warnings(self):
+        return [d for d in self.diagnostics if d["severity"] == "warning"]
+
+    def to_dict(self):
+        """转换为可以序列化为JSON的字典"""
+        return {
+            "command": self.command,
+            "project_dir": self.project_dir,
+            "ok": self.ok,
+            "exit_code": self.exit_code,
+            "duration": self.duration,
+            "phases": dict(self.phases),
+            "build_paths": [os.path.abspath(p) for p in self.build_paths],
+            "artifacts": list(self.artifacts),
+            "diagnostics": list(self.diagnostics),
+            "logs": [os.path.abspath(p) for p in self.logs],
+            "output": self.output,
+            "skipped": self.skipped,
+        }
+
+
+def run_api(command, project_dir, args, func, capture_output, record=True):
+    """在独立的运行上下文中执行func(result),返回填好的BuildResult
+
+    record为True时把这次运行写入构建历史(与命令行的build/get/install相同)
+    """
+    result = BuildResult(command, project_dir)
+    started_at = time.time()
+    start = time.perf_counter()
+    with run_context(capture_output) as run:
+        try:
+            with trace_span(f"pybuild {command}", "command"):
+                result.exit_code = func(result)
+        except Exception as e:
+            print(f"{command} 失败: {e}")
+            result.exit_code = 1
+        result.duration = time.perf_counter() - start
+        if record:
+            record_history(
+                command,
+                args,
+                started_at,
+                result.duration,
+                result.exit_code,
+                project=project_dir,
+                metrics=run["metrics"],
+            )
+    result.ok = result.exit_code == 0
+    result.phases = dict(run["metrics"]["phases"])
+    if run["output"] is not None:
+        result.output = run["output"].getvalue()
+    text = result.output
+    for log in result.logs:
+        try:
+            with open(log, "r", encoding="utf-8", errors="replace") as f:
+                text += "\n" + f.read()
+        except OSError:
+            pass
+    result.diagnostics = parse_diagnostics(text)
+    return result
+
+
+def build(
+    project_dir=".",
+    config=None,
+    jobs=None,
+    build_dir=None,
+    profile=None,
+    args=(),
+    job_budget=None,
+    capture_output=True,
+):
+    """构建项目,返回BuildResult
+
+    config: 构建类型(Debug、Release等)或其列表,多个配置时并发构建,默认Debug
+    jobs: 并行编译任务数,默认CPU核心数;多个线程同时构建时可以改为传入共享的job_budget
+    build_dir/profile: 同命令行的 -b 和 --profile
+    args: 其他build命令行参数,如 ["--lto", "-t"]
+    capture_output: 为True时输出(包括cmake和编译器的输出)保存在result.output中,不打印到终端
+    """
+    cli_args = ["pybuild", "build"]
+    configs = [config] if isinstance(config, str) else list(config or [])
+    if configs:
+        cli_args += ["--configs", ",".join(configs)]
+    if build_dir:
+        cli_args += ["-b", build_dir]
+    if profile:
+        cli_args += ["--profile", profile]
+    cli_args += list(args)
+    if job_budget is None and jobs:
+        job_budget = JobBudget(jobs, max(1, len(configs)))
+
+    def run(result):
+        build_info = {}
+        try:
+            return build_project(
+                cli_args, project_dir=project_dir, job_budget=job_budget, build_info=build_info
+            )
+        finally:
+            result.build_paths = build_info.get("build_paths", [])
+            result.logs = build_info.get("logs", [])
+            result.artifacts = collect_artifacts(
+                project_dir, build_info.get("output_suffixes", [])
+            )
+
+    return run_api("build", project_dir, cli_args[2:], run, capture_output)
+
+
+def install(project_dir=".", prefix=None, incremental=False, args=(), capture_output=True):
+    """安装已构建的项目,返回BuildResult;prefix为None时使用配置时的安装路径"""
+    cli_args = ["pybuild", "install"] + ([prefix] if prefix else [])
+    if incremental:
+        cli_args.append("--incremental")
+    cli_args += list(args)
+
+    def run(result):
+        build_info = {}
+        exit_code = install_project(cli_args, project_dir=project_dir, build_info=build_info)
+        result.build_paths = build_info.get("build_paths", [])
+        return exit_code
+
+    return run_api("install", project_dir, cli_args[2:], run, capture_output)
+
+
+def uninstall(project_dir=".", dry_run=False, args=(), capture_output=True):
+    """按安装清单卸载项目,返回BuildResult"""
+    cli_args = ["pybuild", "uninstall"] + (["--dry-run"] if dry_run else []) + list(args)
+    return run_api(
+        "uninstall",
+        project_dir,
+        cli_args[2:],
+        lambda result: uninstall_command(cli_args, project_dir=project_dir),
+        capture_output,
+        record=False,
+    )
+
+
+def get(urls, work_dir=".", prefix=None, config="Debug", jobs=1, args=(), capture_output=True):
+    """下载、构建并安装第三方库,返回BuildResult;库被克隆到work_dir下"""
+    if isinstance(urls, str):
+        urls = [urls]
+    cli_args = ["pybuild", "get"]
+    if config == "Release":
+        cli_args.append("-r")
+    if jobs > 1:
+        cli_args += ["-j", str(jobs)]
+    if prefix:
+        cli_args += ["-p", prefix]
+    cli_args += list(args) + list(urls)
+    return run_api(
+        "get",
+        work_dir,
+        cli_args[2:],
+        lambda result: get_third_party_library(cli_args, work_dir=work_dir),
+        capture_output,
+    )
+
+
+# 工作区: 一个目录下并列的多个pybuild项目
+WORKSPACE_FILE = "pybuild-workspace.json"
+# 计算项目输入指纹时跳过的顶层目录(构建产物)
+WORKSPACE_OUTPUT_DIRS = ("bin", "lib", PGO_PROFILE_DIR)
+
+
+def discover_workspace(workspace_dir="."):
+    """返回工作区中的项目目录列表
+
+    有pybuild-workspace.json时按其中的 projects(glob模式)和 exclude 查找,
+    否则使用所有包含CMake.json的直接子目录
+    """
+    import glob
+    import json
+
+    config_path = os.path.join(workspace_dir, WORKSPACE_FILE)
+    patterns = ["*"]
+    exclude = []
+    if os.path.exists(config_path):
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        patterns = config.get("projects", patterns)
+        exclude = [os.path.normpath(os.path.join(workspace_dir, e)) for e in config.get("exclude", [])]
+    projects = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(workspace_dir, pattern))):
+            path = os.path.normpath(path)
+            if (
+                os.path.isfile(os.path.join(path, "CMake.json"))
+                and path not in exclude
+                and path not in projects
+            ):
+                projects.append(path)
+    return projects
+
+
+def project_input_fingerprint(project_dir, extra):
+    """根据项目中所有输入文件的路径、大小和修改时间计算指纹
+
+    跳过隐藏文件和目录,以及顶层的build*目录和产物目录(子目录中同名的目录是源码,照常计算);
+    extra(构建参数、依赖项目的指纹)一起参与计算
+    """
+    import hashlib
+    import json
+
+    digest = hashlib.sha256(json.dumps(extra, sort_keys=True).encode("utf-8"))
+    for root, dirs, files in os.walk(project_dir):
+        dirs[:] = sorted(
+            d
+            for d in dirs
+            if not d.startswith(".")
+            and not (
+                root == project_dir
+                and (d.startswith("build") or d in WORKSPACE_OUTPUT_DIRS)
+            )
+        )
+        for name in sorted(files):
+            if name.startswith("."):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            rel = os.path.relpath(path, project_dir)
+            digest.update(f"{rel}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def build_workspace(
+    workspace_dir=".",
+    args=(),
+    jobs=None,
+    force=False,
+    install_projects=False,
+    capture_output=None,
+    projects=None,
+):
+    """按依赖顺序构建工作区中的所有项目,返回 {项目名: BuildResult}
+
+    依赖关系来自各项目CMake.json中的 dependencies,名称可以是目录名或项目名。
+    互不依赖的项目并发构建,共享一个编译任务预算;每个项目在其依赖构建完成后立即开始。
+    输入(文件、构建参数、依赖项目)自上次成功构建以来没有改变的项目被跳过(force为True时不跳过)。
+    install_projects: 每个项目构建成功后增量安装,依赖它的项目可以通过find_package找到它
+    capture_output: 为None时,只同时构建一个项目时直接输出,否则把各项目的输出写入日志文件
+    projects: 已发现的项目目录列表,为None时调用discover_workspace查找
+    """
+    import hashlib
+    import json
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    args = list(args)
+    if projects is None:
+        projects = discover_workspace(workspace_dir)
+    results = {}
+    if not projects:
+        print(f"工作区中没有找到项目(包含CMake.json的子目录或 {WORKSPACE_FILE})")
+        return results
+
+    # 依赖图: 名称可以是目录名或CMake.json中的项目名,工作区外的依赖忽略
+    dirs = {}
+    aliases = {}
+    declared = {}
+    for project_dir in projects:
+        name = os.path.basename(project_dir)
+        project_name, deps = read_library_dependencies(project_dir)
+        dirs[name] = project_dir
+        declared[name] = deps
+        aliases[name] = name
+        if project_name:
+            aliases.setdefault(project_name, name)
+    graph = {
+        name: sorted(set(aliases[d] for d in deps if d in aliases and aliases[d] != name))
+        for name, deps in declared.items()
+    }
+    cycle = find_dependency_cycle(graph)
+    if cycle:
+        print(f"错误: 检测到循环依赖: {' -> '.join(cycle)}")
+        return results
+    levels = dependency_levels(graph)
+    print(f"工作区: {len(projects)} 个项目")
+    if len(levels) > 1:
+        print("构建顺序: " + " -> ".join("[" + ", ".join(l) + "]" for l in levels))
+
+    workers = min(jobs or get_cpu_count(), len(projects))
+    if capture_output is None:
+        capture_output = workers > 1
+    job_budget = JobBudget(get_cpu_count(), workers)
+    if workers > 1:
+        print(f"并发构建: 最多 {workers} 个项目同时进行, 共享 {job_budget.total} 个编译任务")
+
+    state_path = get_cache_dir(
+        "workspace",
+        hashlib.sha256(os.path.abspath(workspace_dir).encode("utf-8")).hexdigest()[:24] + ".json",
+    )
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    fingerprints = {}
+
+    def fingerprint(name):
+        return project_input_fingerprint(
+            dirs[name], {"args": args, "deps": [fingerprints[d] for d in graph[name]]}
+        )
+
+    def run(name):
+        project_dir = dirs[name]
+        current = fingerprint(name)
+        saved = state.get(name)
+        # 状态中记录了上次构建使用的构建目录(-b、--profile、多配置时不是build/)
+        if (
+            not force
+            and isinstance(saved, dict)
+            and saved.get("fingerprint") == current
+            and saved.get("build_paths")
+            and all(os.path.isdir(p) for p in saved["build_paths"])
+        ):
+            fingerprints[name] = current
+            result = BuildResult("build", project_dir)
+            result.ok = True
+            result.exit_code = 0
+            result.skipped = True
+            result.build_paths = list(saved["build_paths"])
+            return result
+        result = build(project_dir, args=args, job_budget=job_budget, capture_output=capture_output)
+        if result.ok and install_projects:
+            # 从本次实际构建的目录安装,多配置构建时依次安装每个配置
+            for build_path in result.build_paths:
+                installed = install(
+                    project_dir,
+                    incremental=True,
+                    args=["-b", os.path.abspath(build_path)],
+                    capture_output=capture_output,
+                )
+                result.output += installed.output
+                result.ok = installed.ok
+                result.exit_code = installed.exit_code
+                if not installed.ok:
+                    break
+        if capture_output and result.output:
+            # 构建目录还没有确定时(如参数错误)写入默认的build目录
+            log_dir = (
+                result.build_paths[0] if result.build_paths else os.path.join(project_dir, "build")
+            )
+            log_path = os.path.join(log_dir, "pybuild-workspace.log")
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            with open(log_path, "w", encoding="utf-8") as f:
+                f.write(result.output)
+            result.logs.append(log_path)
+        # 构建过程会改写生成的文件(如源文件列表),保存构建之后的指纹
+        fingerprints[name] = fingerprint(name) if result.ok else current
+        return result
+
+    def report(name, result):
+        if result.skipped:
+            print(f"跳过 {name}: 输入未改变")
+        elif result.ok:
+            print(f"构建成功 {name} ({result.duration:.2f}s)")
+        else:
+            print(f"构建失败 {name} ({result.duration:.2f}s)")
+            for d in result.errors[:5]:
+                print(f"  {d['file']}:{d['line']}: {d['message']}")
+            if result.logs:
+                print(f"  详细日志: {result.logs[-1]}")
+
+    dependents = {name: [] for name in graph}
+    pending = {}
+    for name, deps in graph.items():
+        pending[name] = len(deps)
+        for dep in deps:
+            dependents[dep].append(name)
+    failed = []
+
+    def skip_dependents(name):
+        for dependent in dependents[name]:
+            if dependent not in failed:
+                print(f"跳过 {dependent}: 依赖 {name} 构建失败")
+                failed.append(dependent)
+                skip_dependents(dependent)
+
+    run_in_worker = inherit_run(run)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            running = {}
+            ready = [name for level in levels for name in level if not graph[name]]
+            while ready or running:
+                for name in ready:
+                    running[executor.submit(run_in_worker, name)] = name
+                ready = []
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    result = future.result()
+                    results[name] = result
+                    report(name, result)
+                    if result.ok:
+                        state[name] = {
+                            "fingerprint": fingerprints[name],
+                            "build_paths": [os.path.abspath(p) for p in result.build_paths],
+                        }
+                        for dependent in dependents[name]:
+                            pending[dependent] -= 1
+                            if pending[dependent] == 0 and dependent not in failed:
+                                ready.append(dependent)
+                    else:
+                        state.pop(name, None)
+                        failed.append(name)
+                        skip_dependents(name)
+    finally:
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        write_file_if_changed(state_path, json.dumps(state, indent=2, ensure_ascii=False))
+
+    built = [n for n, r in results.items() if r.ok and not r.skipped]
+    skipped = [n for n, r in results.items() if r.skipped]
+    print(
+        f"\n工作区构建完成: 构建 {len(built)} 个, 跳过 {len(skipped)} 个未改变的项目, 失败 {len(failed)} 个"
+    )
+    if failed:
+        print("失败的项目: " + ", ".join(failed))
+    return results
+
+
+def workspace_command(args):
+    """pybuild build --all: 构建工作区中的所有项目,其余参数传给每个项目的build"""
+    build_args = []
+    jobs = None
+    force = False
+    install_projects = False
+    prefix = None
+    i = 2
+    while i < len(args):
+        arg = args[i]
+        if arg == "--all":
+            pass
+        elif (arg == "-j" or arg == "--jobs") and i + 1 < len(args):
+            i += 1
+            try:
+                jobs = int(args[i])
+                if jobs < 1:
+                    raise ValueError
+            except ValueError:
+                print(f"错误：无效的并行任务数 {args[i]}")
+                return 1
+        elif arg == "--force":
+            force = True
+        elif arg == "--install":
+            install_projects = True
+        else:
+            if (arg == "-p" or arg == "--prefix") and i + 1 < len(args):
+                prefix = args[i + 1]
+            build_args.append(arg)
+        i += 1
+    if install_projects and prefix:
+        # 让后构建的项目能找到先安装到该目录的依赖
+        build_args.append(f'-DCMAKE_PREFIX_PATH="{os.path.abspath(prefix)}"')
+
+    projects = discover_workspace()
+    results = build_workspace(
+        args=build_args,
+        jobs=jobs,
+        force=force,
+        install_projects=install_projects,
+        projects=projects,
+    )
+    if not projects:
+        return 1
+    return 0 if len(results) == len(projects) and all(r.ok for r in results.values()) else 1
+
+
 def main():
     """主函数"""
     # 设置控制台编码为UTF-8
@@ -1166,10 +6131,37 @@ def main():
 
     command = sys.argv[1]
 
+    if command not in ("build", "get", "install"):
+        return run_command(command)
+
+    # --trace <文件>: 记录build/get/install各阶段耗时,输出Chrome trace-event JSON
+    trace_path = None
+    if "--trace" in sys.argv:
+        index = sys.argv.index("--trace")
+        if index + 1 >= len(sys.argv):
+            print("错误: --trace 需要指定输出文件")
+            return 1
+        trace_path = sys.argv[index + 1]
+        del sys.argv[index : index + 2]
+        start_trace()
+
+    try:
+        return run_command(command)
+    finally:
+        if trace_path:
+            write_trace(trace_path)
+
+
+def run_command(command):
+    """执行子命令"""
     # 构建项目
+    # build/get/install/uninstall通过Python API执行,build/get/install的每次运行都记录到构建历史
     if command == "build":
+        # --all: 构建工作区中的所有项目
+        if "--all" in sys.argv[2:]:
+            return workspace_command(sys.argv)
         print("开始构建...")
-        return build_project(sys.argv)
+        return build(args=sys.argv[2:], capture_output=False).exit_code
 
     # 根据解析的CMake.json初始化项目
     elif command == "init":
@@ -1177,7 +6169,7 @@ def main():
 
     # 清除cmake构建
     elif command == "clean":
-        return clean_project_cache()
+        return clean_command(sys.argv)
 
     # 创建新的项目
     elif command == "new":
@@ -1185,14 +6177,42 @@ def main():
 
     # 安装项目
     elif command == "install":
-        return install_project(sys.argv)
+        return install(args=sys.argv[2:], capture_output=False).exit_code
 
     # 卸载安装的项目
     elif command == "uninstall":
-        return uninstall()
+        return uninstall(args=sys.argv[2:], capture_output=False).exit_code
 
     elif command == "get":
-        return get_third_party_library(sys.argv)
+        return get([], args=sys.argv[2:], capture_output=False).exit_code
+
+    # 显示探测到的工具链
+    elif command == "toolchain":
+        return toolchain_command(sys.argv)
+
+    # 根据源文件中的包含次数生成预编译头
+    elif command == "pch":
+        return pch_command(sys.argv)
+
+    # 并行运行测试
+    elif command == "test":
+        return test_command(sys.argv)
+
+    # 文件改变后自动构建
+    elif command == "watch":
+        return watch_command(sys.argv)
+
+    # 分析头文件包含关系
+    elif command == "analyze":
+        return analyze_command(sys.argv)
+
+    # 显示构建历史统计
+    elif command == "stats":
+        return stats_command(sys.argv)
+
+    # 管理预编译产物缓存
+    elif command == "cache":
+        return cache_command(sys.argv)
 
     # 输出帮助消息
     elif command == "-h" or command == "--help":
@@ -1206,8 +6226,6 @@ def main():
 
 
 if __name__ == "__main__":
-    import time
-
     start = time.time()
     res = main()
     end = time.time()
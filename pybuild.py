@@ -0,0 +1,27 @@
+"""pybuild的Python API
+
+在同一个Python进程中驱动构建,不必每次启动pybuild可执行文件再解析它的输出:
+
+    import pybuild
+
+    result = pybuild.build("path/to/project", config="Release", jobs=8)
+    print(result.ok, result.duration, result.phases, result.artifacts)
+    for d in result.errors:
+        print(f"{d['file']}:{d['line']}: {d['message']}")
+
+所有函数都不修改进程当前目录,可以在多个线程中同时调用;
+多个构建共享编译任务时传入同一个 pybuild.JobBudget。
+实现位于main.py,命令行也是这些函数的一层包装。
+"""
+
+from main import BuildResult, JobBudget, build, build_workspace, get, install, uninstall
+
+__all__ = [
+    "BuildResult",
+    "JobBudget",
+    "build",
+    "build_workspace",
+    "get",
+    "install",
+    "uninstall",
+]
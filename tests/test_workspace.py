@@ -0,0 +1,40 @@
+"""pybuild build --all 的参数检查
+
+运行: python3 -m unittest discover -s tests
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+class WorkspaceCommandTest(unittest.TestCase):
+    def run_workspace(self, *args):
+        """在空的临时目录中运行 workspace_command,返回 (返回值, 输出)"""
+        output = io.StringIO()
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as work_dir:
+            os.chdir(work_dir)
+            try:
+                with contextlib.redirect_stdout(output):
+                    code = main.workspace_command(["main.py", "build", "--all"] + list(args))
+            finally:
+                os.chdir(cwd)
+        return code, output.getvalue()
+
+    def test_invalid_jobs(self):
+        for value in ("abc", "0", "-2"):
+            code, output = self.run_workspace("-j", value)
+            self.assertEqual(code, 1)
+            self.assertIn(f"错误：无效的并行任务数 {value}", output)
+
+
+if __name__ == "__main__":
+    unittest.main()